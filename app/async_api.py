@@ -0,0 +1,220 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+import datetime
+
+from . import schemas, crud, services
+from .config import settings
+from .database import get_async_db
+from .dependencies import (
+    parse_cursor,
+    set_next_cursor,
+    cached_page,
+    check_selection_strategy,
+    if_none_match,
+    parse_contact_ids,
+    parse_expand,
+    get_async_distribution_service
+)
+
+# Асинхронные эндпоинты на AsyncSession (включаются настройкой CRM_ASYNC_DB_ENABLED).
+# Пути и ответы совпадают с синхронными эндпоинтами из main.py
+router = APIRouter()
+
+operator_crud = crud.AsyncOperatorCRUD()
+lead_crud = crud.AsyncLeadCRUD()
+source_crud = crud.AsyncSourceCRUD()
+contact_crud = crud.AsyncContactCRUD()
+
+# Эндпоинты для управления операторами
+@router.post("/operators/", response_model=schemas.Operator)
+async def create_operator_async(operator: schemas.OperatorCreate, db: AsyncSession = Depends(get_async_db)):
+    return await operator_crud.create_operator(db=db, operator=operator)
+
+@router.get("/operators/", response_model=List[schemas.Operator])
+async def read_operators_async(request: Request, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                               db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        operators = await operator_crud.get_operators(db, skip=skip, limit=limit, after=parse_cursor(cursor, int))
+        return cached_page(operators, limit, schemas.Operator, "id")
+    return await services.response_cache.respond_async(
+        ("operators", "list", skip, limit, cursor), if_none_match(request), load
+    )
+
+@router.get("/operators/{operator_id}", response_model=schemas.Operator)
+async def read_operator_async(operator_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        db_operator = await operator_crud.get_operator(db, operator_id=operator_id)
+        if db_operator is None:
+            raise HTTPException(status_code=404, detail="Operator not found")
+        return schemas.Operator.model_validate(db_operator), None
+    return await services.response_cache.respond_async(("operators", operator_id), if_none_match(request), load)
+
+@router.put("/operators/{operator_id}", response_model=schemas.Operator)
+async def update_operator_async(operator_id: int, operator: schemas.OperatorUpdate,
+                                db: AsyncSession = Depends(get_async_db)):
+    db_operator = await operator_crud.update_operator(db, operator_id=operator_id, operator=operator)
+    if db_operator is None:
+        raise HTTPException(status_code=404, detail="Operator not found")
+    return db_operator
+
+@router.delete("/operators/{operator_id}")
+async def delete_operator_async(operator_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_operator = await operator_crud.delete_operator(db, operator_id=operator_id)
+    if db_operator is None:
+        raise HTTPException(status_code=404, detail="Operator not found")
+    return {"message": "Operator deleted successfully"}
+
+# Эндпоинты для управления весами операторов по источникам
+@router.post("/operators/{operator_id}/sources/{source_id}/weight")
+async def set_operator_weight_async(operator_id: int, source_id: int, weight: float,
+                                    db: AsyncSession = Depends(get_async_db)):
+    db_weight = await operator_crud.set_operator_weight(db, operator_id=operator_id, source_id=source_id, weight=weight)
+    return {"message": "Weight set successfully", "weight": db_weight}
+
+@router.get("/operators/{operator_id}/weights", response_model=List[schemas.OperatorSourceWeight])
+async def read_operator_weights_async(operator_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        weights = await operator_crud.get_operator_weights(db, operator_id=operator_id)
+        return [schemas.OperatorSourceWeight.model_validate(weight) for weight in weights], None
+    return await services.response_cache.respond_async(("weights", operator_id), if_none_match(request), load)
+
+# Эндпоинты для управления источниками
+@router.post("/sources/", response_model=schemas.Source)
+async def create_source_async(source: schemas.SourceCreate, db: AsyncSession = Depends(get_async_db)):
+    check_selection_strategy(source)
+    return await source_crud.create_source(db=db, source=source)
+
+@router.get("/sources/", response_model=List[schemas.Source])
+async def read_sources_async(request: Request, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                             db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        sources = await source_crud.get_sources(db, skip=skip, limit=limit, after=parse_cursor(cursor, int))
+        return cached_page(sources, limit, schemas.Source, "id")
+    return await services.response_cache.respond_async(
+        ("sources", "list", skip, limit, cursor), if_none_match(request), load
+    )
+
+@router.get("/sources/{source_id}", response_model=schemas.Source)
+async def read_source_async(source_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def load():
+        db_source = await source_crud.get_source(db, source_id=source_id)
+        if db_source is None:
+            raise HTTPException(status_code=404, detail="Source not found")
+        return schemas.Source.model_validate(db_source), None
+    return await services.response_cache.respond_async(("sources", source_id), if_none_match(request), load)
+
+@router.put("/sources/{source_id}", response_model=schemas.Source)
+async def update_source_async(source_id: int, source: schemas.SourceCreate, db: AsyncSession = Depends(get_async_db)):
+    check_selection_strategy(source)
+    db_source = await source_crud.update_source(db, source_id=source_id, source=source)
+    if db_source is None:
+        raise HTTPException(status_code=404, detail="Source not found")
+    return db_source
+
+# Эндпоинты для лидов
+@router.post("/leads/", response_model=schemas.Lead)
+async def create_lead_async(lead: schemas.LeadCreate, db: AsyncSession = Depends(get_async_db)):
+    return await lead_crud.create_lead(db=db, lead=lead)
+
+@router.get("/leads/", response_model=List[schemas.Lead])
+async def read_leads_async(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                           db: AsyncSession = Depends(get_async_db)):
+    leads = await lead_crud.get_leads(db, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int))
+    set_next_cursor(response, leads, limit, "created_at", "id")
+    return leads
+
+@router.get("/leads/{lead_id}", response_model=schemas.Lead)
+async def read_lead_async(lead_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_lead = await lead_crud.get_lead(db, lead_id=lead_id)
+    if db_lead is None:
+        raise HTTPException(status_code=404, detail="Lead not found")
+    return db_lead
+
+@router.get("/leads/{lead_id}/contacts", response_model=List[schemas.Contact])
+async def read_lead_contacts_async(lead_id: int, include_archived: bool = False,
+                                   db: AsyncSession = Depends(get_async_db)):
+    return await lead_crud.get_lead_contacts(db, lead_id=lead_id, include_archived=include_archived)
+
+# Регистрация обращений; в режиме очереди (CRM_INGEST_ENABLED) ее обслуживает эндпоинт из main.py
+if not settings.ingest_enabled:
+    @router.post("/contacts/register/", response_model=schemas.Contact)
+    async def register_contact_async(contact_data: schemas.ContactRegistration,
+                                     distribution_service: services.AsyncDistributionService = Depends(get_async_distribution_service)):
+        try:
+            return await distribution_service.register_contact(contact_data)
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+@router.post("/contacts/register/batch", response_model=List[schemas.ContactRegistrationResult])
+async def register_contacts_batch_async(contacts_data: List[schemas.ContactRegistration],
+                                        distribution_service: services.AsyncDistributionService = Depends(get_async_distribution_service)):
+    return await distribution_service.register_contacts(contacts_data)
+
+# Эндпоинты для обращений
+@router.post("/contacts/processed", response_model=schemas.ContactsProcessedResult)
+async def mark_contacts_processed_async(request: schemas.ContactsProcessedRequest,
+                                        db: AsyncSession = Depends(get_async_db)):
+    if request.ids is None and request.operator_id is None and request.created_before is None:
+        raise HTTPException(status_code=400, detail="Specify ids, operator_id or created_before")
+    return await contact_crud.mark_contacts_processed(
+        db, ids=request.ids, operator_id=request.operator_id, created_before=request.created_before
+    )
+
+@router.get("/contacts/", response_model=List[schemas.ContactDetails], response_model_exclude_unset=True)
+async def read_contacts_async(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                              ids: Optional[str] = None, expand: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    # expand=lead,source,operator догружает связи всей страницы отдельным запросом на каждую связь
+    expand = parse_expand(expand)
+    contact_ids = parse_contact_ids(ids)
+    if contact_ids is not None:
+        contacts = await contact_crud.get_contacts_by_ids(db, contact_ids, expand=expand)
+    else:
+        contacts = await contact_crud.get_contacts(
+            db, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int), expand=expand
+        )
+        set_next_cursor(response, contacts, limit, "created_at", "id")
+    return [crud.contact_details(contact, expand) for contact in contacts]
+
+@router.get("/contacts/{contact_id}", response_model=schemas.ContactDetails)
+async def read_contact_with_details_async(contact_id: int, db: AsyncSession = Depends(get_async_db)):
+    contact = await contact_crud.get_contact_with_details(db, contact_id=contact_id)
+    if contact is None:
+        raise HTTPException(status_code=404, detail="Contact not found")
+    return contact
+
+@router.get("/operators/{operator_id}/contacts", response_model=List[schemas.Contact])
+async def read_operator_contacts_async(operator_id: int, response: Response, skip: int = 0, limit: int = 100,
+                                       cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    contacts = await contact_crud.get_contacts_by_operator(
+        db, operator_id=operator_id, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int)
+    )
+    set_next_cursor(response, contacts, limit, "created_at", "id")
+    return contacts
+
+@router.get("/sources/{source_id}/contacts", response_model=List[schemas.Contact])
+async def read_source_contacts_async(source_id: int, response: Response, skip: int = 0, limit: int = 100,
+                                     cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    contacts = await contact_crud.get_contacts_by_source(
+        db, source_id=source_id, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int)
+    )
+    set_next_cursor(response, contacts, limit, "created_at", "id")
+    return contacts
+
+# Эндпоинты для статистики и состояния
+@router.get("/stats/operator-load")
+async def get_operator_load_stats_async(source_id: Optional[int] = None, is_active: Optional[bool] = None,
+                                        by_source: bool = False,
+                                        distribution_service: services.AsyncDistributionService = Depends(get_async_distribution_service)):
+    return await distribution_service.get_operator_load_stats(
+        source_id=source_id, is_active=is_active, by_source=by_source
+    )
+
+@router.get("/stats/unprocessed-contacts")
+async def get_unprocessed_contacts_async(response: Response, skip: int = 0, limit: int = 100,
+                                         cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    contacts = await contact_crud.get_unprocessed_contacts(
+        db, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int)
+    )
+    next_cursor = set_next_cursor(response, contacts, limit, "created_at", "id")
+    return {"count": len(contacts), "contacts": contacts, "next_cursor": next_cursor}
@@ -1,6 +1,22 @@
 from .operator import OperatorCRUD
 from .lead import LeadCRUD
 from .source import SourceCRUD
-from .contact import ContactCRUD
+from .contact import ContactCRUD, CONTACT_EXPANDS, contact_details
+from .async_crud import AsyncOperatorCRUD, AsyncLeadCRUD, AsyncSourceCRUD, AsyncContactCRUD
+from .pagination import encode_cursor, decode_cursor, next_cursor
 
-__all__ = ["OperatorCRUD", "LeadCRUD", "SourceCRUD", "ContactCRUD"]
+__all__ = [
+    "OperatorCRUD",
+    "LeadCRUD",
+    "SourceCRUD",
+    "ContactCRUD",
+    "CONTACT_EXPANDS",
+    "contact_details",
+    "AsyncOperatorCRUD",
+    "AsyncLeadCRUD",
+    "AsyncSourceCRUD",
+    "AsyncContactCRUD",
+    "encode_cursor",
+    "decode_cursor",
+    "next_cursor"
+]
@@ -0,0 +1,236 @@
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from starlette.concurrency import run_in_threadpool
+from ..models import Operator, OperatorSourceWeight, Lead, Source, Contact
+from ..schemas import OperatorCreate, OperatorUpdate, LeadCreate, SourceCreate, ContactCreate
+from ..services.load_ledger import load_ledger
+from ..services.routing import routing_cache
+from ..services.response_cache import response_cache
+from ..services.lead_identity import lead_identity_resolver, identity_keys
+from ..services.rollups import apply_rollups_async
+from ..services.archive import lead_history_async
+from .contact import (
+    CONTACT_EXPANDS,
+    contact_details,
+    expand_options,
+    order_by_ids,
+    processed_updates,
+    processed_rollups,
+    release_processed
+)
+from .pagination import keyset_paginate
+import datetime
+
+# Асинхронные варианты CRUD для AsyncSession: те же методы и побочные эффекты
+# (журнал нагрузки, кэш маршрутизации, ключи лидов), что и у синхронных классов
+
+class AsyncOperatorCRUD:
+    async def create_operator(self, db: AsyncSession, operator: OperatorCreate) -> Operator:
+        db_operator = Operator(**operator.dict())
+        db.add(db_operator)
+        await db.commit()
+        await db.refresh(db_operator)
+        response_cache.invalidate("operators")
+        return db_operator
+    
+    async def get_operator(self, db: AsyncSession, operator_id: int) -> Operator:
+        return await db.get(Operator, operator_id)
+    
+    async def get_operators(self, db: AsyncSession, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Operator]:
+        # Курсор after = (id,) последнего оператора предыдущей страницы
+        return list(await db.scalars(keyset_paginate(select(Operator), [Operator.id], after, limit, skip)))
+    
+    async def update_operator(self, db: AsyncSession, operator_id: int, operator: OperatorUpdate) -> Operator:
+        db_operator = await db.get(Operator, operator_id)
+        if db_operator:
+            update_data = operator.dict(exclude_unset=True)
+            for key, value in update_data.items():
+                setattr(db_operator, key, value)
+            await db.commit()
+            await db.refresh(db_operator)
+            routing_cache.invalidate_operator(operator_id)
+            response_cache.invalidate("operators")
+        return db_operator
+    
+    async def delete_operator(self, db: AsyncSession, operator_id: int) -> Operator:
+        db_operator = await db.get(Operator, operator_id)
+        if db_operator:
+            await db.delete(db_operator)
+            await db.commit()
+            # Хранилище нагрузки (таблица operator_capacity, Redis) синхронное: вызов не блокирует цикл событий
+            await run_in_threadpool(load_ledger.forget, operator_id)
+            routing_cache.invalidate_operator(operator_id)
+            response_cache.invalidate("operators", "weights")
+        return db_operator
+    
+    async def set_operator_weight(self, db: AsyncSession, operator_id: int, source_id: int, weight: float) -> OperatorSourceWeight:
+        db_weight = await db.scalar(select(OperatorSourceWeight).where(
+            OperatorSourceWeight.operator_id == operator_id,
+            OperatorSourceWeight.source_id == source_id
+        ))
+        
+        if db_weight:
+            db_weight.weight = float(weight)
+        else:
+            db_weight = OperatorSourceWeight(
+                operator_id=operator_id,
+                source_id=source_id,
+                weight=float(weight)
+            )
+            db.add(db_weight)
+        
+        await db.commit()
+        await db.refresh(db_weight)
+        routing_cache.invalidate_source(source_id)
+        response_cache.invalidate("weights")
+        return db_weight
+    
+    async def get_operator_weights(self, db: AsyncSession, operator_id: int) -> list[OperatorSourceWeight]:
+        return list(await db.scalars(select(OperatorSourceWeight).where(
+            OperatorSourceWeight.operator_id == operator_id
+        )))
+
+class AsyncLeadCRUD:
+    async def create_lead(self, db: AsyncSession, lead: LeadCreate) -> Lead:
+        db_lead = Lead(**lead.dict())
+        db.add(db_lead)
+        await db.flush()
+        # Ключи идентификации, которые уже заняты другими лидами, остаются за ними
+        keys = identity_keys(db_lead.external_id, db_lead.phone, db_lead.email)
+        taken = await db.run_sync(lambda session: lead_identity_resolver.lookup(session, keys))
+        keys = [key for key in keys if key not in taken]
+        lead_identity_resolver.add_identities(db, db_lead.id, keys)
+        await db.commit()
+        await db.refresh(db_lead)
+        lead_identity_resolver.remember(keys, db_lead.id)
+        return db_lead
+    
+    async def get_lead(self, db: AsyncSession, lead_id: int) -> Lead:
+        return await db.get(Lead, lead_id)
+    
+    async def get_lead_by_external_id(self, db: AsyncSession, external_id: str) -> Lead:
+        return await db.scalar(select(Lead).where(Lead.external_id == external_id).limit(1))
+    
+    async def get_leads(self, db: AsyncSession, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Lead]:
+        # Курсор after = (created_at, id) последнего лида предыдущей страницы
+        return list(await db.scalars(keyset_paginate(select(Lead), [Lead.created_at, Lead.id], after, limit, skip)))
+    
+    async def find_lead(self, db: AsyncSession, phone: str = None, email: str = None) -> Lead:
+        keys = identity_keys(phone=phone, email=email)
+        lead_id = await db.run_sync(lambda session: lead_identity_resolver.resolve(session, keys))
+        if lead_id is None:
+            return None
+        return await db.get(Lead, lead_id)
+    
+    async def get_lead_contacts(self, db: AsyncSession, lead_id: int, include_archived: bool = False) -> list:
+        contacts = list(await db.scalars(select(Contact).where(Contact.lead_id == lead_id).order_by(Contact.id)))
+        return await lead_history_async(db, lead_id, contacts) if include_archived else contacts
+
+class AsyncSourceCRUD:
+    async def create_source(self, db: AsyncSession, source: SourceCreate) -> Source:
+        db_source = Source(**source.dict())
+        db.add(db_source)
+        await db.commit()
+        await db.refresh(db_source)
+        response_cache.invalidate("sources")
+        return db_source
+    
+    async def get_source(self, db: AsyncSession, source_id: int) -> Source:
+        return await db.get(Source, source_id)
+    
+    async def get_source_by_name(self, db: AsyncSession, name: str) -> Source:
+        return await db.scalar(select(Source).where(Source.name == name).limit(1))
+    
+    async def get_sources(self, db: AsyncSession, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Source]:
+        # Курсор after = (id,) последнего источника предыдущей страницы
+        return list(await db.scalars(keyset_paginate(select(Source), [Source.id], after, limit, skip)))
+    
+    async def update_source(self, db: AsyncSession, source_id: int, source: SourceCreate) -> Source:
+        db_source = await db.get(Source, source_id)
+        if db_source:
+            update_data = source.dict(exclude_unset=True)
+            for key, value in update_data.items():
+                setattr(db_source, key, value)
+            await db.commit()
+            await db.refresh(db_source)
+            routing_cache.invalidate_source(source_id)
+            response_cache.invalidate("sources")
+        return db_source
+    
+    async def delete_source(self, db: AsyncSession, source_id: int) -> Source:
+        db_source = await db.get(Source, source_id)
+        if db_source:
+            await db.delete(db_source)
+            await db.commit()
+            routing_cache.invalidate_source(source_id)
+            response_cache.invalidate("sources", "weights")
+        return db_source
+
+class AsyncContactCRUD:
+    async def create_contact(self, db: AsyncSession, contact: ContactCreate) -> Contact:
+        db_contact = Contact(**contact.dict())
+        db.add(db_contact)
+        await db.commit()
+        await db.refresh(db_contact)
+        return db_contact
+    
+    async def get_contact(self, db: AsyncSession, contact_id: int) -> Contact:
+        return await db.get(Contact, contact_id)
+    
+    async def _paginate(self, db: AsyncSession, statement, skip: int, limit: int, after: tuple) -> list[Contact]:
+        # Курсор after = (created_at, id) последнего обращения предыдущей страницы
+        return list(await db.scalars(keyset_paginate(statement, [Contact.created_at, Contact.id], after, limit, skip)))
+    
+    async def get_contacts(self, db: AsyncSession, skip: int = 0, limit: int = 100, after: tuple = None,
+                           expand: tuple = ()) -> list[Contact]:
+        return await self._paginate(db, select(Contact).options(*expand_options(expand)), skip, limit, after)
+    
+    async def get_contacts_by_ids(self, db: AsyncSession, ids: list[int], expand: tuple = ()) -> list[Contact]:
+        contacts = await db.scalars(select(Contact).where(Contact.id.in_(ids)).options(*expand_options(expand)))
+        return order_by_ids(list(contacts), ids)
+    
+    async def get_contacts_by_lead(self, db: AsyncSession, lead_id: int) -> list[Contact]:
+        return list(await db.scalars(select(Contact).where(Contact.lead_id == lead_id)))
+    
+    async def get_contacts_by_operator(self, db: AsyncSession, operator_id: int, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Contact]:
+        return await self._paginate(db, select(Contact).where(Contact.operator_id == operator_id), skip, limit, after)
+    
+    async def get_contacts_by_source(self, db: AsyncSession, source_id: int, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Contact]:
+        return await self._paginate(db, select(Contact).where(Contact.source_id == source_id), skip, limit, after)
+    
+    async def get_unprocessed_contacts(self, db: AsyncSession, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Contact]:
+        return await self._paginate(db, select(Contact).where(Contact.is_processed == False), skip, limit, after)
+    
+    async def mark_contact_processed(self, db: AsyncSession, contact_id: int) -> Contact:
+        contact = await db.get(Contact, contact_id)
+        if contact:
+            was_processed = contact.is_processed
+            contact.is_processed = True
+            if not was_processed:
+                await apply_rollups_async(
+                    db, processed_rollups([(contact.operator_id, contact.source_id, contact.created_at)])
+                )
+            await db.commit()
+            await db.refresh(contact)
+            if not was_processed and contact.operator_id is not None:
+                await run_in_threadpool(load_ledger.decrement, contact.operator_id)
+        return contact
+    
+    async def mark_contacts_processed(self, db: AsyncSession, ids: list[int] = None, operator_id: int = None,
+                                      created_before: datetime.datetime = None) -> dict:
+        rows = []
+        for statement in processed_updates(ids, operator_id, created_before):
+            rows.extend((await db.execute(statement)).all())
+        await apply_rollups_async(db, processed_rollups(rows))
+        await db.commit()
+        return await run_in_threadpool(release_processed, [row[0] for row in rows])
+    
+    async def get_contact_with_details(self, db: AsyncSession, contact_id: int) -> dict:
+        # Связанные записи загружаются сразу: ленивая загрузка в AsyncSession недоступна
+        contact = await db.scalar(select(Contact).where(Contact.id == contact_id).options(
+            *expand_options(CONTACT_EXPANDS, joinedload)
+        ))
+        if not contact:
+            return None
+        return contact_details(contact)
@@ -1,7 +1,20 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import desc, update
 from ..models import Contact
 from ..schemas import ContactCreate, Contact as ContactSchema
+from ..services.load_ledger import load_ledger
+from ..services.rollups import RollupDelta, apply_rollups
+from .pagination import keyset_paginate
+import datetime
+
+# Связи обращения, которые можно запросить в expand
+CONTACT_EXPANDS = ("lead", "source", "operator")
+# Максимальное число id в одном UPDATE ... WHERE id IN (...)
+PROCESSED_CHUNK_SIZE = 500
+
+def expand_options(expand: tuple = (), loader=selectinload) -> list:
+    """Опции загрузки связей: selectinload догружает связи всей страницы одним запросом IN на связь"""
+    return [loader(getattr(Contact, name)) for name in expand]
 
 class ContactCRUD:
     def create_contact(self, db: Session, contact: ContactCreate) -> Contact:
@@ -14,59 +27,147 @@ class ContactCRUD:
     def get_contact(self, db: Session, contact_id: int) -> Contact:
         return db.query(Contact).filter(Contact.id == contact_id).first()
     
-    def get_contacts(self, db: Session, skip: int = 0, limit: int = 100) -> list[Contact]:
-        return db.query(Contact).offset(skip).limit(limit).all()
+    def _paginate(self, query, skip: int, limit: int, after: tuple) -> list[Contact]:
+        # Курсор after = (created_at, id) последнего обращения предыдущей страницы
+        return keyset_paginate(query, [Contact.created_at, Contact.id], after, limit, skip).all()
+    
+    def get_contacts(self, db: Session, skip: int = 0, limit: int = 100, after: tuple = None,
+                     expand: tuple = ()) -> list[Contact]:
+        return self._paginate(db.query(Contact).options(*expand_options(expand)), skip, limit, after)
+    
+    def get_contacts_by_ids(self, db: Session, ids: list[int], expand: tuple = ()) -> list[Contact]:
+        """Обращения по списку id в порядке запроса; связи из expand загружаются постоянным числом запросов"""
+        contacts = db.query(Contact).filter(Contact.id.in_(ids)).options(*expand_options(expand)).all()
+        return order_by_ids(contacts, ids)
     
     def get_contacts_by_lead(self, db: Session, lead_id: int) -> list[Contact]:
         return db.query(Contact).filter(Contact.lead_id == lead_id).all()
     
-    def get_contacts_by_operator(self, db: Session, operator_id: int) -> list[Contact]:
-        return db.query(Contact).filter(Contact.operator_id == operator_id).all()
+    def get_contacts_by_operator(self, db: Session, operator_id: int, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Contact]:
+        return self._paginate(db.query(Contact).filter(Contact.operator_id == operator_id), skip, limit, after)
     
-    def get_contacts_by_source(self, db: Session, source_id: int) -> list[Contact]:
-        return db.query(Contact).filter(Contact.source_id == source_id).all()
+    def get_contacts_by_source(self, db: Session, source_id: int, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Contact]:
+        return self._paginate(db.query(Contact).filter(Contact.source_id == source_id), skip, limit, after)
     
-    def get_unprocessed_contacts(self, db: Session, skip: int = 0, limit: int = 100) -> list[Contact]:
-        return db.query(Contact).filter(Contact.is_processed == False).offset(skip).limit(limit).all()
+    def get_unprocessed_contacts(self, db: Session, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Contact]:
+        return self._paginate(db.query(Contact).filter(Contact.is_processed == False), skip, limit, after)
     
     def mark_contact_processed(self, db: Session, contact_id: int) -> Contact:
         contact = db.query(Contact).filter(Contact.id == contact_id).first()
         if contact:
+            was_processed = contact.is_processed
             contact.is_processed = True
+            if not was_processed:
+                apply_rollups(db, processed_rollups([(contact.operator_id, contact.source_id, contact.created_at)]))
             db.commit()
             db.refresh(contact)
+            if not was_processed and contact.operator_id is not None:
+                load_ledger.decrement(contact.operator_id)
         return contact
     
+    def mark_contacts_processed(self, db: Session, ids: list[int] = None, operator_id: int = None,
+                                created_before: datetime.datetime = None) -> dict:
+        """Отмечает обращения обработанными одной транзакцией и сразу освобождает места операторов"""
+        rows = []
+        for statement in processed_updates(ids, operator_id, created_before):
+            rows.extend(db.execute(statement).all())
+        apply_rollups(db, processed_rollups(rows))
+        db.commit()
+        return release_processed([row[0] for row in rows])
+    
     def get_contact_with_details(self, db: Session, contact_id: int) -> dict:
-        contact = db.query(Contact).filter(Contact.id == contact_id).first()
+        # Лид, источник и оператор загружаются тем же запросом
+        contact = db.query(Contact).filter(Contact.id == contact_id).options(
+            *expand_options(CONTACT_EXPANDS, joinedload)
+        ).first()
         if not contact:
             return None
-        
-        return {
-            "id": contact.id,
-            "lead_id": contact.lead_id,
-            "source_id": contact.source_id,
-            "operator_id": contact.operator_id,
-            "message": contact.message,
-            "contact_data": contact.contact_data,
-            "created_at": contact.created_at,
-            "is_processed": contact.is_processed,
-            "lead": {
-                "id": contact.lead.id,
-                "external_id": contact.lead.external_id,
-                "phone": contact.lead.phone,
-                "email": contact.lead.email,
-                "name": contact.lead.name
-            },
-            "source": {
-                "id": contact.source.id,
-                "name": contact.source.name,
-                "description": contact.source.description
-            },
-            "operator": {
-                "id": contact.operator.id,
-                "name": contact.operator.name,
-                "is_active": contact.operator.is_active,
-                "max_load": contact.operator.max_load
-            } if contact.operator else None
+        return contact_details(contact)
+
+def processed_updates(ids: list[int] = None, operator_id: int = None,
+                      created_before: datetime.datetime = None) -> list:
+    """UPDATE-запросы, отмечающие обработанными необработанные обращения по списку id и фильтрам.
+
+    RETURNING возвращает operator_id, source_id и created_at каждой измененной строки, поэтому
+    освобожденная нагрузка и агрегаты считаются по фактически измененным строкам, а не по предварительной выборке.
+    """
+    conditions = [Contact.is_processed == False]
+    if operator_id is not None:
+        conditions.append(Contact.operator_id == operator_id)
+    if created_before is not None:
+        conditions.append(Contact.created_at < created_before)
+    statement = update(Contact).values(is_processed=True).returning(
+        Contact.operator_id, Contact.source_id, Contact.created_at
+    ).execution_options(synchronize_session=False)
+    if ids is None:
+        return [statement.where(*conditions)]
+    ids = list(dict.fromkeys(ids))
+    return [
+        statement.where(Contact.id.in_(ids[start:start + PROCESSED_CHUNK_SIZE]), *conditions)
+        for start in range(0, len(ids), PROCESSED_CHUNK_SIZE)
+    ]
+
+def processed_rollups(rows: list[tuple]) -> RollupDelta:
+    """Изменения агрегатов для обработанных обращений: строки (operator_id, source_id, created_at)"""
+    delta = RollupDelta()
+    for operator_id, source_id, created_at in rows:
+        if source_id is not None:
+            delta.add(created_at, source_id, operator_id, processed=1)
+    return delta
+
+def release_processed(operator_ids: list[int]) -> dict:
+    """Снимает в журнале нагрузку за обработанные обращения (operator_id измененных строк).
+
+    Возвращает число обработанных обращений и освобожденные места по операторам.
+    """
+    released = {}
+    for operator_id in operator_ids:
+        if operator_id is not None:
+            released[operator_id] = released.get(operator_id, 0) + 1
+    return {
+        "processed": len(operator_ids),
+        "released": [
+            {"operator_id": operator_id, "released": amount,
+             "current_load": load_ledger.decrement(operator_id, amount)}
+            for operator_id, amount in sorted(released.items())
+        ]
+    }
+
+def order_by_ids(contacts: list[Contact], ids: list[int]) -> list[Contact]:
+    by_id = {contact.id: contact for contact in contacts}
+    return [by_id[contact_id] for contact_id in dict.fromkeys(ids) if contact_id in by_id]
+
+def contact_details(contact: Contact, expand: tuple = CONTACT_EXPANDS) -> dict:
+    """Обращение вместе со связями из expand; связи должны быть загружены заранее"""
+    details = {
+        "id": contact.id,
+        "lead_id": contact.lead_id,
+        "source_id": contact.source_id,
+        "operator_id": contact.operator_id,
+        "message": contact.message,
+        "contact_data": contact.contact_data,
+        "created_at": contact.created_at,
+        "is_processed": contact.is_processed,
+    }
+    if "lead" in expand:
+        details["lead"] = {
+            "id": contact.lead.id,
+            "external_id": contact.lead.external_id,
+            "phone": contact.lead.phone,
+            "email": contact.lead.email,
+            "name": contact.lead.name
+        }
+    if "source" in expand:
+        details["source"] = {
+            "id": contact.source.id,
+            "name": contact.source.name,
+            "description": contact.source.description
         }
+    if "operator" in expand:
+        details["operator"] = {
+            "id": contact.operator.id,
+            "name": contact.operator.name,
+            "is_active": contact.operator.is_active,
+            "max_load": contact.operator.max_load
+        } if contact.operator else None
+    return details
@@ -1,14 +1,23 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from ..models import Lead
+from ..models import Lead, Contact
 from ..schemas import LeadCreate
+from .pagination import keyset_paginate
+from ..services.lead_identity import lead_identity_resolver, identity_keys
+from ..services.archive import lead_history
 
 class LeadCRUD:
     def create_lead(self, db: Session, lead: LeadCreate) -> Lead:
         db_lead = Lead(**lead.dict())
         db.add(db_lead)
+        db.flush()
+        # Ключи идентификации, которые уже заняты другими лидами, остаются за ними
+        keys = identity_keys(db_lead.external_id, db_lead.phone, db_lead.email)
+        taken = lead_identity_resolver.lookup(db, keys)
+        keys = [key for key in keys if key not in taken]
+        lead_identity_resolver.add_identities(db, db_lead.id, keys)
         db.commit()
         db.refresh(db_lead)
+        lead_identity_resolver.remember(keys, db_lead.id)
         return db_lead
     
     def get_lead(self, db: Session, lead_id: int) -> Lead:
@@ -17,19 +26,18 @@ class LeadCRUD:
     def get_lead_by_external_id(self, db: Session, external_id: str) -> Lead:
         return db.query(Lead).filter(Lead.external_id == external_id).first()
     
-    def get_leads(self, db: Session, skip: int = 0, limit: int = 100) -> list[Lead]:
-        return db.query(Lead).offset(skip).limit(limit).all()
+    def get_leads(self, db: Session, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Lead]:
+        # Курсор after = (created_at, id) последнего лида предыдущей страницы
+        return keyset_paginate(db.query(Lead), [Lead.created_at, Lead.id], after, limit, skip).all()
     
     def find_lead(self, db: Session, phone: str = None, email: str = None) -> Lead:
-        conditions = []
-        if phone:
-            conditions.append(Lead.phone == phone)
-        if email:
-            conditions.append(Lead.email == email)
-        
-        if conditions:
-            return db.query(Lead).filter(or_(*conditions)).first()
-        return None
+        lead_id = lead_identity_resolver.resolve(db, identity_keys(phone=phone, email=email))
+        if lead_id is None:
+            return None
+        return db.get(Lead, lead_id)
     
-    def get_lead_contacts(self, db: Session, lead_id: int) -> list:
-        return db.query(Lead).filter(Lead.id == lead_id).first().contacts if db.query(Lead).filter(Lead.id == lead_id).first() else []
+    def get_lead_contacts(self, db: Session, lead_id: int, include_archived: bool = False) -> list:
+        # Один запрос по индексу contacts.lead_id вместо загрузки лида и ленивой загрузки обращений
+        contacts = db.query(Contact).filter(Contact.lead_id == lead_id).order_by(Contact.id).all()
+        # Полная история - вместе с перенесенными в архив обработанными обращениями
+        return lead_history(db, lead_id, contacts) if include_archived else contacts
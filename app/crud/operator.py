@@ -1,6 +1,10 @@
 from sqlalchemy.orm import Session
 from ..models import Operator, OperatorSourceWeight
 from ..schemas import OperatorCreate, OperatorUpdate
+from ..services.load_ledger import load_ledger
+from ..services.routing import routing_cache
+from ..services.response_cache import response_cache
+from .pagination import keyset_paginate
 
 class OperatorCRUD:
     def create_operator(self, db: Session, operator: OperatorCreate) -> Operator:
@@ -8,13 +12,15 @@ class OperatorCRUD:
         db.add(db_operator)
         db.commit()
         db.refresh(db_operator)
+        response_cache.invalidate("operators")
         return db_operator
     
     def get_operator(self, db: Session, operator_id: int) -> Operator:
         return db.query(Operator).filter(Operator.id == operator_id).first()
     
-    def get_operators(self, db: Session, skip: int = 0, limit: int = 100) -> list[Operator]:
-        return db.query(Operator).offset(skip).limit(limit).all()
+    def get_operators(self, db: Session, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Operator]:
+        # Курсор after = (id,) последнего оператора предыдущей страницы
+        return keyset_paginate(db.query(Operator), [Operator.id], after, limit, skip).all()
     
     def update_operator(self, db: Session, operator_id: int, operator: OperatorUpdate) -> Operator:
         db_operator = db.query(Operator).filter(Operator.id == operator_id).first()
@@ -24,6 +30,8 @@ class OperatorCRUD:
                 setattr(db_operator, key, value)
             db.commit()
             db.refresh(db_operator)
+            routing_cache.invalidate_operator(operator_id)
+            response_cache.invalidate("operators")
         return db_operator
     
     def delete_operator(self, db: Session, operator_id: int) -> Operator:
@@ -31,6 +39,9 @@ class OperatorCRUD:
         if db_operator:
             db.delete(db_operator)
             db.commit()
+            load_ledger.forget(operator_id)
+            routing_cache.invalidate_operator(operator_id)
+            response_cache.invalidate("operators", "weights")
         return db_operator
 
     def set_operator_weight(self, db: Session, operator_id: int, source_id: int, weight: float) -> OperatorSourceWeight:
@@ -52,6 +63,8 @@ class OperatorCRUD:
         
         db.commit()
         db.refresh(db_weight)
+        routing_cache.invalidate_source(source_id)
+        response_cache.invalidate("weights")
         return db_weight
 
     def get_operator_weights(self, db: Session, operator_id: int) -> list[OperatorSourceWeight]:
@@ -0,0 +1,46 @@
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+import base64
+import datetime
+import json
+
+def encode_cursor(*values) -> str:
+    """Кодирует ключ последней записи страницы в непрозрачный курсор"""
+    payload = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """Декодирует курсор в ключ записи; при неверном формате бросает ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError
+        return tuple(
+            datetime.datetime.fromisoformat(value) if value_type is datetime.datetime else value_type(value)
+            for value, value_type in zip(payload, types)
+        )
+    except (ValueError, TypeError, json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def keyset_paginate(query: Query, columns: list, after: tuple = None, limit: int = 100, skip: int = 0) -> Query:
+    """Упорядочивает запрос по columns и оставляет записи строго после ключа after.
+
+    Без курсора сохраняется прежний постраничный вывод через skip.
+    """
+    if after is None:
+        return query.order_by(*columns).offset(skip).limit(limit)
+    
+    # (c1, c2, ...) > (v1, v2, ...) в виде, который понимают все диалекты
+    conditions = []
+    for position, column in enumerate(columns):
+        equal = [columns[i] == after[i] for i in range(position)]
+        conditions.append(and_(*equal, column > after[position]))
+    return query.filter(or_(*conditions)).order_by(*columns).limit(limit)
+
+def next_cursor(items: list, limit: int, *attributes: str) -> str:
+    """Возвращает курсор следующей страницы или None, если страница последняя"""
+    if not items or len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor(*(getattr(last, attribute) for attribute in attributes))
@@ -1,6 +1,9 @@
 from sqlalchemy.orm import Session
 from ..models import Source
 from ..schemas import SourceCreate
+from ..services.response_cache import response_cache
+from ..services.routing import routing_cache
+from .pagination import keyset_paginate
 
 class SourceCRUD:
     def create_source(self, db: Session, source: SourceCreate) -> Source:
@@ -8,6 +11,7 @@ class SourceCRUD:
         db.add(db_source)
         db.commit()
         db.refresh(db_source)
+        response_cache.invalidate("sources")
         return db_source
     
     def get_source(self, db: Session, source_id: int) -> Source:
@@ -16,8 +20,9 @@ class SourceCRUD:
     def get_source_by_name(self, db: Session, name: str) -> Source:
         return db.query(Source).filter(Source.name == name).first()
     
-    def get_sources(self, db: Session, skip: int = 0, limit: int = 100) -> list[Source]:
-        return db.query(Source).offset(skip).limit(limit).all()
+    def get_sources(self, db: Session, skip: int = 0, limit: int = 100, after: tuple = None) -> list[Source]:
+        # Курсор after = (id,) последнего источника предыдущей страницы
+        return keyset_paginate(db.query(Source), [Source.id], after, limit, skip).all()
     
     def update_source(self, db: Session, source_id: int, source: SourceCreate) -> Source:
         db_source = db.query(Source).filter(Source.id == source_id).first()
@@ -27,6 +32,8 @@ class SourceCRUD:
                 setattr(db_source, key, value)
             db.commit()
             db.refresh(db_source)
+            routing_cache.invalidate_source(source_id)
+            response_cache.invalidate("sources")
         return db_source
     
     def delete_source(self, db: Session, source_id: int) -> Source:
@@ -34,4 +41,6 @@ class SourceCRUD:
         if db_source:
             db.delete(db_source)
             db.commit()
+            routing_cache.invalidate_source(source_id)
+            response_cache.invalidate("sources", "weights")
         return db_source
@@ -1,12 +1,182 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-import os
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from .config import Settings, settings
 
-DATABASE_URL = "sqlite:///./crm.db"
+SQLITE_JOURNAL_MODES = {"delete", "truncate", "persist", "memory", "wal", "off"}
+SQLITE_SYNCHRONOUS_MODES = {"off", "normal", "full", "extra"}
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Схема архива обращений в отдельном файле SQLite (CRM_ARCHIVE_DATABASE_PATH); None - архив в основной БД
+ARCHIVE_SCHEMA = "archive" if settings.archive_database_path else None
+
+# Асинхронные драйверы по умолчанию для синхронного адреса БД
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def sqlite_pragmas(config: Settings) -> list[str]:
+    """PRAGMA, которые выполняются на каждом новом соединении с SQLite"""
+    journal_mode = config.sqlite_journal_mode.lower()
+    synchronous = config.sqlite_synchronous.lower()
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"Unknown SQLite journal mode: {config.sqlite_journal_mode}")
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f"Unknown SQLite synchronous mode: {config.sqlite_synchronous}")
+    return [
+        # busy_timeout первым: переключение в WAL само ждет блокировку базы
+        f"PRAGMA busy_timeout = {int(config.sqlite_busy_timeout)}",
+        f"PRAGMA journal_mode = {journal_mode}",
+        f"PRAGMA synchronous = {synchronous}",
+        f"PRAGMA mmap_size = {int(config.sqlite_mmap_size)}",
+        f"PRAGMA cache_size = {int(config.sqlite_cache_size)}",
+    ]
+
+def _engine_options(config: Settings, url: URL) -> dict:
+    options = {"echo": config.database_echo, "pool_pre_ping": config.db_pool_pre_ping}
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=config.db_pool_size,
+            max_overflow=config.db_max_overflow,
+            pool_timeout=config.db_pool_timeout,
+            pool_recycle=config.db_pool_recycle,
+        )
+        return options
+
+    # Соединение SQLite используется из пула потоков FastAPI
+    options["connect_args"] = {"check_same_thread": False}
+    if not _sqlite_in_memory(url):
+        # У базы в памяти свой пул на поток, размер пула к нему не применяется
+        options.update(
+            pool_size=config.db_pool_size,
+            max_overflow=config.db_max_overflow,
+            pool_timeout=config.db_pool_timeout,
+        )
+    return options
+
+def _sqlite_in_memory(url: URL) -> bool:
+    return url.database in (None, "", ":memory:")
+
+def sqlite_archive_statements(config: Settings) -> list[str]:
+    """ATTACH файла архива обращений и его режим журнала; выполняются после PRAGMA основной базы"""
+    if not config.archive_database_path:
+        return []
+    path = config.archive_database_path.replace("'", "''")
+    return [
+        f"ATTACH DATABASE '{path}' AS archive",
+        # Режим журнала и синхронизации задаются для каждого файла отдельно
+        f"PRAGMA archive.journal_mode = {config.sqlite_journal_mode.lower()}",
+        f"PRAGMA archive.synchronous = {config.sqlite_synchronous.lower()}",
+    ]
+
+def _listen_sqlite_pragmas(engine: Engine, config: Settings, url: URL) -> None:
+    pragmas = sqlite_pragmas(config)
+    if _sqlite_in_memory(url):
+        pragmas = [pragma for pragma in pragmas if "journal_mode" not in pragma and "mmap_size" not in pragma]
+    pragmas += sqlite_archive_statements(config)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+# Первое слово запросов, перед которыми начинается транзакция SQLite
+SQLITE_WRITE_STATEMENTS = {"INSERT", "UPDATE", "DELETE", "REPLACE", "SAVEPOINT"}
+
+def _listen_sqlite_transactions(engine: Engine) -> None:
+    """Управление транзакциями pysqlite и aiosqlite на стороне SQLAlchemy.
+
+    Драйвер сам отправляет BEGIN только перед INSERT/UPDATE/DELETE, а SAVEPOINT - вне транзакции:
+    тогда точка сохранения становится внешней транзакцией и ее RELEASE коммитит изменения до коммита
+    сессии. Поэтому драйвер переводится в режим autocommit, а BEGIN IMMEDIATE отправляется перед первой
+    записью или точкой сохранения транзакции. Чтение до нее не держит снимок базы: иначе переход
+    от чтения к записи после чужого коммита сразу завершался бы ошибкой "database is locked".
+    """
+
+    @event.listens_for(engine, "connect")
+    def disable_driver_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def defer_begin(conn):
+        conn.info["sqlite_begin_pending"] = True
+
+    @event.listens_for(engine, "commit")
+    @event.listens_for(engine, "rollback")
+    def end_transaction(conn):
+        conn.info["sqlite_begin_pending"] = False
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def begin_before_write(conn, cursor, statement, parameters, context, executemany):
+        if not conn.info.get("sqlite_begin_pending"):
+            return
+        words = statement.split(None, 1)
+        if words and words[0].upper() in SQLITE_WRITE_STATEMENTS:
+            conn.info["sqlite_begin_pending"] = False
+            cursor.execute("BEGIN IMMEDIATE")
+
+def _check_archive_backend(config: Settings, url: URL) -> None:
+    if config.archive_database_path and url.get_backend_name() != "sqlite":
+        raise ValueError("Separate archive database is supported only for SQLite")
+
+def _with_overrides(config: Settings, overrides: dict) -> Settings:
+    config = config or settings
+    if overrides:
+        config = config.model_copy(update=overrides)
+    return config
+
+def create_db_engine(config: Settings = None, **overrides) -> Engine:
+    """Создает движок БД по настройкам; один и тот же код работает с SQLite и PostgreSQL"""
+    config = _with_overrides(config, overrides)
+    url = make_url(config.database_url)
+    _check_archive_backend(config, url)
+    engine = create_engine(url, **_engine_options(config, url))
+    if url.get_backend_name() == "sqlite":
+        _listen_sqlite_pragmas(engine, config, url)
+        _listen_sqlite_transactions(engine)
+    return engine
+
+def async_database_url(config: Settings = None) -> URL:
+    """Адрес БД для асинхронного движка: явно заданный или database_url с асинхронным драйвером"""
+    config = config or settings
+    if config.async_database_url:
+        return make_url(config.async_database_url)
+    url = make_url(config.database_url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    return url.set(drivername=driver) if driver else url
+
+def create_async_db_engine(config: Settings = None, **overrides) -> AsyncEngine:
+    """Создает асинхронный движок с теми же настройками пула и PRAGMA, что и синхронный"""
+    config = _with_overrides(config, overrides)
+    url = async_database_url(config)
+    _check_archive_backend(config, url)
+    options = _engine_options(config, url)
+    options.pop("connect_args", None)
+    if url.get_backend_name() == "sqlite" and not _sqlite_in_memory(url):
+        # aiosqlite по умолчанию открывает соединение на каждый запрос; держим их в пуле, как синхронный движок
+        options["poolclass"] = AsyncAdaptedQueuePool
+    engine = create_async_engine(url, **options)
+    if url.get_backend_name() == "sqlite":
+        _listen_sqlite_pragmas(engine.sync_engine, config, url)
+        _listen_sqlite_transactions(engine.sync_engine)
+    return engine
+
+engine = create_db_engine()
+# Объекты не сбрасываются при коммите: ответ сериализуется из уже загруженных полей без повторного SELECT
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# Асинхронный движок создается только при CRM_ASYNC_DB_ENABLED: драйвер (aiosqlite) - необязательная зависимость
+async_engine = create_async_db_engine() if settings.async_db_enabled else None
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+) if async_engine is not None else None
 
 Base = declarative_base()
 
@@ -16,3 +186,7 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
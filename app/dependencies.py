@@ -0,0 +1,73 @@
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from . import crud, services
+from .database import get_db, get_async_db
+
+# Курсоры постраничного вывода
+def parse_cursor(cursor: Optional[str], *types) -> Optional[tuple]:
+    if cursor is None:
+        return None
+    try:
+        return crud.decode_cursor(cursor, *types)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def set_next_cursor(response: Response, items: list, limit: int, *attributes: str) -> Optional[str]:
+    cursor = crud.next_cursor(items, limit, *attributes)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return cursor
+
+# Кэшируемые ответы справочников: содержимое и заголовки сохраняются вместе
+def cached_page(items: list, limit: int, schema, *attributes: str) -> tuple[list, dict]:
+    cursor = crud.next_cursor(items, limit, *attributes)
+    return [schema.model_validate(item) for item in items], ({"X-Next-Cursor": cursor} if cursor else {})
+
+def if_none_match(request: Request) -> Optional[str]:
+    return request.headers.get("if-none-match")
+
+# Стратегия выбора оператора источника
+def check_selection_strategy(source) -> None:
+    if source.selection_strategy is not None and source.selection_strategy not in services.SELECTION_STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown selection strategy: {source.selection_strategy}; "
+                   f"allowed: {', '.join(services.SELECTION_STRATEGIES)}"
+        )
+
+# Пакетное чтение обращений: ?ids=1,2,3&expand=lead,source,operator
+MAX_CONTACT_IDS = 500
+
+def parse_contact_ids(ids: Optional[str]) -> Optional[list[int]]:
+    if ids is None:
+        return None
+    try:
+        values = [int(value) for value in ids.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+    if len(values) > MAX_CONTACT_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_CONTACT_IDS} ids per request")
+    return values
+
+def parse_expand(expand: Optional[str]) -> tuple:
+    if not expand:
+        return ()
+    names = tuple(dict.fromkeys(name.strip() for name in expand.split(",") if name.strip()))
+    unknown = [name for name in names if name not in crud.CONTACT_EXPANDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown expand: {', '.join(unknown)}; allowed: {', '.join(crud.CONTACT_EXPANDS)}"
+        )
+    return names
+
+# Функции для получения сервиса распределения
+def get_distribution_service(db: Session = Depends(get_db)) -> services.DistributionService:
+    # Сервис работает в сессии запроса: одно соединение на запрос, закрывается вместе с сессией
+    return services.DistributionService(db)
+
+def get_async_distribution_service(db: AsyncSession = Depends(get_async_db)) -> services.AsyncDistributionService:
+    return services.AsyncDistributionService(db)
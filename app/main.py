@@ -1,28 +1,121 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import datetime
 import uvicorn
 
 from . import models, schemas, crud, services
-from .database import engine, get_db, Base
+from .database import engine, async_engine, get_db, SessionLocal
+from .dependencies import (
+    parse_cursor,
+    set_next_cursor,
+    cached_page,
+    check_selection_strategy,
+    if_none_match,
+    parse_contact_ids,
+    parse_expand,
+    get_distribution_service
+)
+from . import async_api, metrics
+from .config import settings
+from .migrations import run_migrations
 
-# Создаем таблицы в БД
-Base.metadata.create_all(bind=engine)
+# Создаем недостающие таблицы в БД и применяем миграции схемы к уже существующей базе
+run_migrations(engine)
 
 app = FastAPI(title="CRM Lead Distribution", version="1.0.0")
 
+# Метрики: длительность и число SQL-запросов каждого HTTP-запроса
+if settings.metrics_enabled:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engine(engine)
+    if async_engine is not None:
+        metrics.instrument_engine(async_engine.sync_engine)
+
+# Асинхронные эндпоинты подключаются первыми и обслуживают совпадающие пути вместо синхронных
+if settings.async_db_enabled:
+    app.include_router(async_api.router)
+
 # Инициализация CRUD
 operator_crud = crud.OperatorCRUD()
 lead_crud = crud.LeadCRUD()
 source_crud = crud.SourceCRUD()
 contact_crud = crud.ContactCRUD()
 
-# Функция для получения сервиса распределения
-def get_distribution_service():
-    db = next(get_db())
-    service = services.distribution.DistributionService(db)
-    db.close()
-    return service
+# Очередь асинхронного приема обращений (включается настройкой CRM_INGEST_ENABLED)
+ingest_queue = services.IngestQueue(
+    SessionLocal,
+    maxsize=settings.ingest_queue_size,
+    workers=settings.ingest_workers,
+    batch_size=settings.ingest_batch_size,
+    max_tickets=settings.ingest_max_tickets
+)
+
+# Фоновое назначение операторов обращениям, оставшимся без оператора
+backlog_redistributor = services.BacklogRedistributor(
+    SessionLocal,
+    batch_size=settings.redistribution_batch_size,
+    interval=settings.redistribution_interval,
+    debounce=settings.redistribution_debounce,
+    order=settings.redistribution_order
+)
+
+# Фоновый перенос старых обработанных обращений в архив (включается настройкой CRM_ARCHIVE_ENABLED)
+contact_archiver = services.ContactArchiver(
+    SessionLocal,
+    older_than_days=settings.archive_after_days,
+    batch_size=settings.archive_batch_size,
+    interval=settings.archive_interval
+)
+
+@app.on_event("startup")
+def seed_load_ledger():
+    # Заполняем журнал нагрузки операторов один раз при старте
+    db = SessionLocal()
+    try:
+        services.load_ledger.seed(db)
+        # Последние операторы лидов для закрепления повторных обращений
+        if settings.affinity_enabled:
+            services.lead_affinity.warm(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+async def start_ingest_queue():
+    if settings.ingest_enabled:
+        await ingest_queue.start()
+
+@app.on_event("startup")
+async def start_backlog_redistributor():
+    if settings.redistribution_enabled:
+        await backlog_redistributor.start()
+
+@app.on_event("startup")
+async def start_contact_archiver():
+    if settings.archive_enabled:
+        await contact_archiver.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_queue():
+    # Дожидаемся распределения всех принятых обращений
+    await ingest_queue.stop(drain=True)
+
+@app.on_event("shutdown")
+async def stop_backlog_redistributor():
+    await backlog_redistributor.stop()
+
+@app.on_event("shutdown")
+async def stop_contact_archiver():
+    await contact_archiver.stop()
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    # Соединения aiosqlite держат свои потоки: без закрытия пула процесс не завершится
+    if async_engine is not None:
+        await async_engine.dispose()
 
 # Эндпоинты для управления операторами
 @app.post("/operators/", response_model=schemas.Operator)
@@ -30,16 +123,22 @@ def create_operator(operator: schemas.OperatorCreate, db: Session = Depends(get_
     return operator_crud.create_operator(db=db, operator=operator)
 
 @app.get("/operators/", response_model=List[schemas.Operator])
-def read_operators(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    operators = operator_crud.get_operators(db, skip=skip, limit=limit)
-    return operators
+def read_operators(request: Request, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                   db: Session = Depends(get_db)):
+    # Справочники отдаются из кэша готовых ответов: повторное чтение не обращается к БД
+    def load():
+        operators = operator_crud.get_operators(db, skip=skip, limit=limit, after=parse_cursor(cursor, int))
+        return cached_page(operators, limit, schemas.Operator, "id")
+    return services.response_cache.respond(("operators", "list", skip, limit, cursor), if_none_match(request), load)
 
 @app.get("/operators/{operator_id}", response_model=schemas.Operator)
-def read_operator(operator_id: int, db: Session = Depends(get_db)):
-    db_operator = operator_crud.get_operator(db, operator_id=operator_id)
-    if db_operator is None:
-        raise HTTPException(status_code=404, detail="Operator not found")
-    return db_operator
+def read_operator(operator_id: int, request: Request, db: Session = Depends(get_db)):
+    def load():
+        db_operator = operator_crud.get_operator(db, operator_id=operator_id)
+        if db_operator is None:
+            raise HTTPException(status_code=404, detail="Operator not found")
+        return schemas.Operator.model_validate(db_operator), None
+    return services.response_cache.respond(("operators", operator_id), if_none_match(request), load)
 
 @app.put("/operators/{operator_id}", response_model=schemas.Operator)
 def update_operator(operator_id: int, operator: schemas.OperatorUpdate, db: Session = Depends(get_db)):
@@ -61,19 +160,40 @@ def set_operator_weight(operator_id: int, source_id: int, weight: float, db: Ses
     db_weight = operator_crud.set_operator_weight(db, operator_id=operator_id, source_id=source_id, weight=weight)
     return {"message": "Weight set successfully", "weight": db_weight}
 
+@app.get("/operators/{operator_id}/weights", response_model=List[schemas.OperatorSourceWeight])
+def read_operator_weights(operator_id: int, request: Request, db: Session = Depends(get_db)):
+    def load():
+        weights = operator_crud.get_operator_weights(db, operator_id=operator_id)
+        return [schemas.OperatorSourceWeight.model_validate(weight) for weight in weights], None
+    return services.response_cache.respond(("weights", operator_id), if_none_match(request), load)
+
 # Эндпоинты для управления источниками
 @app.post("/sources/", response_model=schemas.Source)
 def create_source(source: schemas.SourceCreate, db: Session = Depends(get_db)):
+    check_selection_strategy(source)
     return source_crud.create_source(db=db, source=source)
 
 @app.get("/sources/", response_model=List[schemas.Source])
-def read_sources(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    sources = source_crud.get_sources(db, skip=skip, limit=limit)
-    return sources
+def read_sources(request: Request, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                 db: Session = Depends(get_db)):
+    def load():
+        sources = source_crud.get_sources(db, skip=skip, limit=limit, after=parse_cursor(cursor, int))
+        return cached_page(sources, limit, schemas.Source, "id")
+    return services.response_cache.respond(("sources", "list", skip, limit, cursor), if_none_match(request), load)
 
 @app.get("/sources/{source_id}", response_model=schemas.Source)
-def read_source(source_id: int, db: Session = Depends(get_db)):
-    db_source = source_crud.get_source(db, source_id=source_id)
+def read_source(source_id: int, request: Request, db: Session = Depends(get_db)):
+    def load():
+        db_source = source_crud.get_source(db, source_id=source_id)
+        if db_source is None:
+            raise HTTPException(status_code=404, detail="Source not found")
+        return schemas.Source.model_validate(db_source), None
+    return services.response_cache.respond(("sources", source_id), if_none_match(request), load)
+
+@app.put("/sources/{source_id}", response_model=schemas.Source)
+def update_source(source_id: int, source: schemas.SourceCreate, db: Session = Depends(get_db)):
+    check_selection_strategy(source)
+    db_source = source_crud.update_source(db, source_id=source_id, source=source)
     if db_source is None:
         raise HTTPException(status_code=404, detail="Source not found")
     return db_source
@@ -84,8 +204,10 @@ def create_lead(lead: schemas.LeadCreate, db: Session = Depends(get_db)):
     return lead_crud.create_lead(db=db, lead=lead)
 
 @app.get("/leads/", response_model=List[schemas.Lead])
-def read_leads(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    leads = lead_crud.get_leads(db, skip=skip, limit=limit)
+def read_leads(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+               db: Session = Depends(get_db)):
+    leads = lead_crud.get_leads(db, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int))
+    set_next_cursor(response, leads, limit, "created_at", "id")
     return leads
 
 @app.get("/leads/{lead_id}", response_model=schemas.Lead)
@@ -96,28 +218,84 @@ def read_lead(lead_id: int, db: Session = Depends(get_db)):
     return db_lead
 
 @app.get("/leads/{lead_id}/contacts", response_model=List[schemas.Contact])
-def read_lead_contacts(lead_id: int, db: Session = Depends(get_db)):
-    contacts = lead_crud.get_lead_contacts(db, lead_id=lead_id)
+def read_lead_contacts(lead_id: int, include_archived: bool = False, db: Session = Depends(get_db)):
+    # include_archived=true добавляет обработанные обращения, перенесенные в архив
+    contacts = lead_crud.get_lead_contacts(db, lead_id=lead_id, include_archived=include_archived)
     return contacts
 
 # Эндпоинт для регистрации нового обращения
-@app.post("/contacts/register/", response_model=schemas.Contact)
-def register_contact(contact_data: schemas.ContactRegistration, db: Session = Depends(get_db)):
-    distribution_service = get_distribution_service()
+@app.post("/contacts/register/", response_model=schemas.Contact, responses={202: {"model": schemas.IngestTicket}})
+async def register_contact(contact_data: schemas.ContactRegistration,
+                           distribution_service: services.DistributionService = Depends(get_distribution_service)):
+    # В режиме очереди обращение распределяется фоновыми воркерами
+    if ingest_queue.enabled:
+        try:
+            ticket = ingest_queue.submit(contact_data)
+        except services.IngestQueueFull:
+            raise HTTPException(status_code=429, detail="Ingest queue is full", headers={"Retry-After": "1"})
+        return JSONResponse(status_code=202, content=jsonable_encoder(ticket))
     
     try:
-        contact = distribution_service.register_contact(contact_data)
+        contact = await run_in_threadpool(distribution_service.register_contact, contact_data)
         return contact
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
+@app.get("/contacts/register/tickets/{ticket_id}", response_model=schemas.IngestTicket)
+def read_ingest_ticket(ticket_id: str):
+    ticket = ingest_queue.get_ticket(ticket_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return ticket
+
+@app.post("/contacts/register/batch", response_model=List[schemas.ContactRegistrationResult])
+def register_contacts_batch(contacts_data: List[schemas.ContactRegistration],
+                            distribution_service: services.DistributionService = Depends(get_distribution_service)):
+    return distribution_service.register_contacts(contacts_data)
+
+@app.post("/contacts/processed", response_model=schemas.ContactsProcessedResult)
+def mark_contacts_processed(request: schemas.ContactsProcessedRequest, db: Session = Depends(get_db)):
+    # Без условий запрос отметил бы обработанными все обращения
+    if request.ids is None and request.operator_id is None and request.created_before is None:
+        raise HTTPException(status_code=400, detail="Specify ids, operator_id or created_before")
+    return contact_crud.mark_contacts_processed(
+        db, ids=request.ids, operator_id=request.operator_id, created_before=request.created_before
+    )
+
+@app.post("/contacts/redistribute")
+def redistribute_contacts(limit: int = Query(500, ge=1, le=10000), order: Optional[str] = None,
+                          distribution_service: services.DistributionService = Depends(get_distribution_service)):
+    # Внеочередной проход перераспределения, не дожидаясь фоновой задачи
+    order = order or settings.redistribution_order
+    if order not in services.REDISTRIBUTION_ORDERS:
+        raise HTTPException(status_code=400, detail=f"Unknown order: {order}")
+    return distribution_service.redistribute_backlog(limit=limit, order=order)
+
+@app.post("/contacts/archive")
+def archive_contacts(older_than_days: Optional[float] = Query(None, ge=0), limit: int = Query(10000, ge=1, le=1000000),
+                     db: Session = Depends(get_db)):
+    # Внеочередная архивация, не дожидаясь фоновой задачи; по умолчанию - возраст из CRM_ARCHIVE_AFTER_DAYS
+    if older_than_days is None:
+        older_than_days = settings.archive_after_days
+    return services.archive_contacts(db, older_than_days, settings.archive_batch_size, limit)
+
 # Эндпоинты для обращений
-@app.get("/contacts/", response_model=List[schemas.Contact])
-def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    contacts = contact_crud.get_contacts(db, skip=skip, limit=limit)
-    return contacts
+@app.get("/contacts/", response_model=List[schemas.ContactDetails], response_model_exclude_unset=True)
+def read_contacts(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                  ids: Optional[str] = None, expand: Optional[str] = None, db: Session = Depends(get_db)):
+    # expand=lead,source,operator догружает связи всей страницы отдельным запросом на каждую связь
+    expand = parse_expand(expand)
+    contact_ids = parse_contact_ids(ids)
+    if contact_ids is not None:
+        contacts = contact_crud.get_contacts_by_ids(db, contact_ids, expand=expand)
+    else:
+        contacts = contact_crud.get_contacts(
+            db, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int), expand=expand
+        )
+        set_next_cursor(response, contacts, limit, "created_at", "id")
+    return [crud.contact_details(contact, expand) for contact in contacts]
 
-@app.get("/contacts/{contact_id}", response_model=dict)
+@app.get("/contacts/{contact_id}", response_model=schemas.ContactDetails)
 def read_contact_with_details(contact_id: int, db: Session = Depends(get_db)):
     contact = contact_crud.get_contact_with_details(db, contact_id=contact_id)
     if contact is None:
@@ -125,25 +303,113 @@ def read_contact_with_details(contact_id: int, db: Session = Depends(get_db)):
     return contact
 
 @app.get("/operators/{operator_id}/contacts", response_model=List[schemas.Contact])
-def read_operator_contacts(operator_id: int, db: Session = Depends(get_db)):
-    contacts = contact_crud.get_contacts_by_operator(db, operator_id=operator_id)
+def read_operator_contacts(operator_id: int, response: Response, skip: int = 0, limit: int = 100,
+                           cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    contacts = contact_crud.get_contacts_by_operator(
+        db, operator_id=operator_id, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int)
+    )
+    set_next_cursor(response, contacts, limit, "created_at", "id")
     return contacts
 
 @app.get("/sources/{source_id}/contacts", response_model=List[schemas.Contact])
-def read_source_contacts(source_id: int, db: Session = Depends(get_db)):
-    contacts = contact_crud.get_contacts_by_source(db, source_id=source_id)
+def read_source_contacts(source_id: int, response: Response, skip: int = 0, limit: int = 100,
+                         cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    contacts = contact_crud.get_contacts_by_source(
+        db, source_id=source_id, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int)
+    )
+    set_next_cursor(response, contacts, limit, "created_at", "id")
     return contacts
 
 # Эндпоинты для статистики и состояния
 @app.get("/stats/operator-load")
-def get_operator_load_stats(db: Session = Depends(get_db)):
-    distribution_service = get_distribution_service()
-    return distribution_service.get_operator_load_stats()
+def get_operator_load_stats(source_id: Optional[int] = None, is_active: Optional[bool] = None,
+                            by_source: bool = False,
+                            distribution_service: services.DistributionService = Depends(get_distribution_service)):
+    return distribution_service.get_operator_load_stats(source_id=source_id, is_active=is_active, by_source=by_source)
+
+@app.post("/stats/operator-load/reconcile")
+def reconcile_operator_load(db: Session = Depends(get_db)):
+    drift = services.load_ledger.reconcile(db)
+    return {"drift": drift, "reconciled": len(drift)}
+
+def check_rollup_params(granularity: str) -> None:
+    if not settings.rollups_enabled:
+        raise HTTPException(status_code=404, detail="Rollups are disabled")
+    if granularity not in services.ROLLUP_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown granularity: {granularity}")
+
+@app.get("/stats/sources")
+def get_source_stats(date_from: Optional[datetime.datetime] = None, date_to: Optional[datetime.datetime] = None,
+                     source_id: Optional[int] = None, granularity: str = "total", db: Session = Depends(get_db)):
+    # Отчет читает почасовые агрегаты, а не таблицу contacts; границы периода округляются до часа
+    check_rollup_params(granularity)
+    return services.source_stats(
+        db, date_from=date_from, date_to=date_to, source_id=source_id, granularity=granularity
+    )
+
+@app.get("/stats/operators")
+def get_operator_stats(date_from: Optional[datetime.datetime] = None, date_to: Optional[datetime.datetime] = None,
+                       operator_id: Optional[int] = None, granularity: str = "total", db: Session = Depends(get_db)):
+    check_rollup_params(granularity)
+    return services.operator_stats(
+        db, date_from=date_from, date_to=date_to, operator_id=operator_id, granularity=granularity
+    )
 
 @app.get("/stats/unprocessed-contacts")
-def get_unprocessed_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    contacts = contact_crud.get_unprocessed_contacts(db, skip=skip, limit=limit)
-    return {"count": len(contacts), "contacts": contacts}
+def get_unprocessed_contacts(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                             db: Session = Depends(get_db)):
+    contacts = contact_crud.get_unprocessed_contacts(
+        db, skip=skip, limit=limit, after=parse_cursor(cursor, datetime.datetime, int)
+    )
+    next_cursor = set_next_cursor(response, contacts, limit, "created_at", "id")
+    return {"count": len(contacts), "contacts": contacts, "next_cursor": next_cursor}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    # Текстовый формат Prometheus
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# Потоковая выгрузка данных
+def export_response(statement, export_format: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        services.stream_export(SessionLocal, statement, export_format),
+        media_type=services.EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{export_format}"'}
+    )
+
+@app.get("/export/contacts")
+def export_contacts(export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                    source_id: Optional[int] = None, operator_id: Optional[int] = None,
+                    created_from: Optional[datetime.datetime] = None, created_to: Optional[datetime.datetime] = None,
+                    is_processed: Optional[bool] = None, include_archived: bool = False):
+    # include_archived=true добавляет обработанные обращения, перенесенные в архив
+    statement = services.contacts_export_query(
+        source_id=source_id, operator_id=operator_id,
+        created_from=created_from, created_to=created_to, is_processed=is_processed,
+        include_archived=include_archived
+    )
+    return export_response(statement, export_format, "contacts")
+
+@app.get("/export/assignments")
+def export_assignments(export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                       source_id: Optional[int] = None, operator_id: Optional[int] = None,
+                       created_from: Optional[datetime.datetime] = None, created_to: Optional[datetime.datetime] = None,
+                       is_processed: Optional[bool] = None, include_archived: bool = False):
+    # include_archived=true добавляет обработанные обращения, перенесенные в архив
+    statement = services.assignments_export_query(
+        source_id=source_id, operator_id=operator_id,
+        created_from=created_from, created_to=created_to, is_processed=is_processed,
+        include_archived=include_archived
+    )
+    return export_response(statement, export_format, "assignments")
+
+@app.get("/export/leads")
+def export_leads(export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                 created_from: Optional[datetime.datetime] = None, created_to: Optional[datetime.datetime] = None):
+    statement = services.leads_export_query(created_from=created_from, created_to=created_to)
+    return export_response(statement, export_format, "leads")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
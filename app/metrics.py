@@ -0,0 +1,278 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .config import settings
+import threading
+import time
+
+# Метрики процесса в текстовом формате Prometheus без внешних зависимостей.
+# Запись метрики - поиск корзины и увеличение счетчика под коротким локом,
+# поэтому инструментирование можно держать включенным в продакшене.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и метками"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Метки -> [счетчики по корзинам (последняя +Inf), сумма, количество]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def get_count(self, **labels) -> int:
+        series = self._series.get(tuple(str(labels.get(name, "")) for name in self.labelnames))
+        return series[2] if series else 0
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = sorted((key, ([*counts], total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Набор метрик процесса и их вывод для /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# Общий реестр метрик процесса
+registry = MetricsRegistry()
+
+distribution_stage_seconds = registry.histogram(
+    "crm_distribution_stage_seconds",
+    "Duration of contact registration stages (batch_* for batch registration, ingest_wait for the ingest queue)",
+    ("stage",)
+)
+distribution_contacts_total = registry.counter(
+    "crm_distribution_contacts_total",
+    "Registered contacts by source and outcome (assigned, unassigned, error)",
+    ("source_id", "outcome")
+)
+# Метка source_id для обращений с несуществующим источником: id из запроса не становится меткой,
+# иначе любой клиент мог бы создавать новые серии метрики
+UNKNOWN_SOURCE = "unknown"
+redistributed_contacts_total = registry.counter(
+    "crm_redistributed_contacts_total",
+    "Unassigned contacts assigned to operators by backlog redistribution"
+)
+archived_contacts_total = registry.counter(
+    "crm_archived_contacts_total",
+    "Processed contacts moved from contacts to contacts_archive"
+)
+lead_affinity_total = registry.counter(
+    "crm_lead_affinity_total",
+    "Lead affinity checks: hit (last operator), unavailable (last operator full or inactive), miss (not cached)",
+    ("result",)
+)
+response_cache_total = registry.counter(
+    "crm_response_cache_total",
+    "Reads of cached operator, source and weight responses: hit or miss",
+    ("result",)
+)
+http_requests_total = registry.counter(
+    "crm_http_requests_total",
+    "HTTP requests by method, route and status",
+    ("method", "route", "status")
+)
+http_request_duration_seconds = registry.histogram(
+    "crm_http_request_duration_seconds",
+    "HTTP request duration by method and route",
+    ("method", "route")
+)
+sql_statements_total = registry.counter(
+    "crm_sql_statements_total",
+    "SQL statements executed by the application engines"
+)
+sql_statements_per_request = registry.histogram(
+    "crm_sql_statements_per_request",
+    "SQL statements executed while handling one HTTP request",
+    ("method", "route"),
+    buckets=COUNT_BUCKETS
+)
+
+@contextmanager
+def timed_stage(stage: str):
+    """Замеряет длительность этапа распределения"""
+    if not settings.metrics_enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        distribution_stage_seconds.observe(time.perf_counter() - started, stage=stage)
+
+def record_stage(stage: str, seconds: float) -> None:
+    """Записывает длительность этапа, измеренную вне timed_stage"""
+    if settings.metrics_enabled:
+        distribution_stage_seconds.observe(seconds, stage=stage)
+
+def record_outcome(source_id, outcome: str) -> None:
+    if settings.metrics_enabled:
+        distribution_contacts_total.inc(source_id=source_id, outcome=outcome)
+
+def record_redistributed(count: int) -> None:
+    if settings.metrics_enabled and count:
+        redistributed_contacts_total.inc(count)
+
+def record_archived(count: int) -> None:
+    if settings.metrics_enabled and count:
+        archived_contacts_total.inc(count)
+
+def record_affinity(result: str) -> None:
+    if settings.metrics_enabled:
+        lead_affinity_total.inc(result=result)
+
+def record_response_cache(result: str) -> None:
+    if settings.metrics_enabled:
+        response_cache_total.inc(result=result)
+
+# Счетчик SQL-запросов текущего HTTP-запроса. Значение - изменяемый список: обработчики
+# синхронных эндпоинтов выполняются в пуле потоков с копией контекста и увеличивают тот же счетчик
+_request_statements: ContextVar = ContextVar("request_statements", default=None)
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    sql_statements_total.inc()
+    counter = _request_statements.get()
+    if counter is not None:
+        counter[0] += 1
+
+def instrument_engine(engine: Engine) -> None:
+    """Подключает подсчет SQL-запросов к движку (для AsyncEngine - к engine.sync_engine)"""
+    if not event.contains(engine, "before_cursor_execute", _count_statement):
+        event.listen(engine, "before_cursor_execute", _count_statement)
+
+class MetricsMiddleware:
+    """ASGI-middleware: длительность, статус и число SQL-запросов каждого HTTP-запроса"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = {}
+
+    def _route_name(self, scope) -> str:
+        # Метка - шаблон пути маршрута, а не фактический путь: число серий не растет с числом id
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            router = scope.get("router")
+            route = next(
+                (item.path for item in getattr(router, "routes", ()) if getattr(item, "endpoint", None) is endpoint),
+                getattr(endpoint, "__name__", "unknown")
+            )
+            self._routes[endpoint] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        counter = [0]
+        token = _request_statements.set(counter)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_statements.reset(token)
+            method = scope["method"]
+            route = self._route_name(scope)
+            http_requests_total.inc(method=method, route=route, status=status[0])
+            http_request_duration_seconds.observe(elapsed, method=method, route=route)
+            sql_statements_per_request.observe(counter[0], method=method, route=route)
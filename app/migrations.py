@@ -0,0 +1,186 @@
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, select, insert, update, inspect, text, func, case, and_
+from sqlalchemy.engine import Connection, Engine
+from .database import Base
+from .models import ContactArchive
+from .services.lead_identity import identity_keys
+from .services.rollups import backfill_rollups
+import datetime
+
+# Base.metadata.create_all создает только отсутствующие таблицы и не меняет существующие,
+# поэтому изменения схемы уже созданных баз (например, crm.db) выполняются миграциями.
+# run_migrations делает и то и другое: python -m app.migrations обновляет любую базу.
+
+migrations_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations",
+    migrations_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime, default=datetime.datetime.utcnow),
+)
+
+MIGRATIONS = []
+
+def migration(version: int, description: str):
+    """Регистрирует функцию миграции схемы с указанным номером версии"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return decorator
+
+def create_indexes(conn: Connection, table_name: str, *index_names: str) -> None:
+    """Создает объявленные в моделях индексы, если их еще нет в БД"""
+    table = Base.metadata.tables[table_name]
+    indexes = {index.name: index for index in table.indexes}
+    for name in index_names:
+        indexes[name].create(conn, checkfirst=True)
+
+def _has_column(conn: Connection, table: Table, name: str) -> bool:
+    columns = inspect(conn).get_columns(table.name, schema=table.schema)
+    return any(column["name"] == name for column in columns)
+
+def run_migrations(engine: Engine) -> list[int]:
+    """Создает отсутствующие таблицы, применяет еще не выполненные миграции и возвращает их версии"""
+    applied_now = []
+    with engine.begin() as conn:
+        # Миграции читают и заполняют таблицы, появившиеся после создания базы (lead_identities,
+        # contact_rollups, contacts_archive): create_all создает их до миграций, существующие не меняет
+        Base.metadata.create_all(conn)
+        migrations_metadata.create_all(conn)
+        applied = set(conn.execute(select(schema_migrations.c.version)).scalars())
+        for version, description, func in MIGRATIONS:
+            if version in applied:
+                continue
+            func(conn)
+            conn.execute(insert(schema_migrations).values(
+                version=version,
+                description=description,
+                applied_at=datetime.datetime.utcnow()
+            ))
+            applied_now.append(version)
+    return applied_now
+
+@migration(1, "Indexes for hot contact queries and unique operator/source weights")
+def add_contact_and_weight_indexes(conn: Connection) -> None:
+    # Перед уникальным индексом оставляем по одному весу на пару оператор-источник
+    conn.execute(text(
+        "DELETE FROM operator_source_weights WHERE id NOT IN ("
+        "SELECT MIN(id) FROM operator_source_weights GROUP BY operator_id, source_id)"
+    ))
+    create_indexes(
+        conn, "operator_source_weights",
+        "ix_operator_source_weights_source_id",
+        "ux_operator_source_weights_operator_source",
+    )
+    create_indexes(
+        conn, "contacts",
+        "ix_contacts_lead_id",
+        "ix_contacts_operator_unprocessed",
+        "ix_contacts_operator_created",
+        "ix_contacts_source_created",
+        "ix_contacts_unprocessed_created",
+    )
+
+@migration(2, "Indexes for keyset pagination of contacts and leads")
+def add_pagination_indexes(conn: Connection) -> None:
+    create_indexes(conn, "contacts", "ix_contacts_created_id")
+    create_indexes(conn, "leads", "ix_leads_created_id")
+
+@migration(3, "Backfill normalized lead identity keys")
+def backfill_lead_identities(conn: Connection) -> None:
+    leads = Base.metadata.tables["leads"]
+    identities = Base.metadata.tables["lead_identities"]
+    # При совпадении ключей у нескольких лидов ключ получает лид с меньшим id
+    taken = set(conn.execute(select(identities.c.key)).scalars())
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(leads.c.id, leads.c.external_id, leads.c.phone, leads.c.email)
+            .where(leads.c.id > last_id).order_by(leads.c.id).limit(5000)
+        ).all()
+        if not rows:
+            break
+        batch = []
+        for lead_id, external_id, phone, email in rows:
+            for key in identity_keys(external_id, phone, email):
+                if key not in taken:
+                    taken.add(key)
+                    batch.append({"key": key, "lead_id": lead_id})
+        if batch:
+            conn.execute(insert(identities), batch)
+        last_id = rows[-1][0]
+
+@migration(4, "Partial index for the unassigned contact backlog")
+def add_unassigned_contacts_index(conn: Connection) -> None:
+    create_indexes(conn, "contacts", "ix_contacts_unassigned_created")
+
+@migration(5, "Backfill hourly contact rollups")
+def backfill_contact_rollups(conn: Connection) -> None:
+    # Пересчет читает признак created_lead; если его еще нет, агрегаты строит миграция 8
+    if _has_column(conn, Base.metadata.tables["contacts"], "created_lead"):
+        backfill_rollups(conn)
+
+@migration(6, "Per-source operator selection strategy")
+def add_source_selection_strategy(conn: Connection) -> None:
+    columns = {column["name"] for column in inspect(conn).get_columns("sources")}
+    if "selection_strategy" not in columns:
+        conn.execute(text("ALTER TABLE sources ADD COLUMN selection_strategy VARCHAR"))
+
+@migration(7, "Surrogate key for archived contacts")
+def add_archive_contact_id(conn: Connection) -> None:
+    # Первая версия архива использовала id обращения как ключ; SQLite повторно выдает id,
+    # освободившийся после переноса, поэтому таблица пересоздается с собственным ключом и contact_id
+    archive = ContactArchive.__table__
+    columns = {column["name"] for column in inspect(conn).get_columns(archive.name, schema=archive.schema)}
+    if "contact_id" in columns:
+        return
+    prefix = f"{archive.schema}." if archive.schema else ""
+    for index in ("ix_contacts_archive_lead_id", "ix_contacts_archive_created_id"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {prefix}{index}"))
+    conn.execute(text(f"ALTER TABLE {prefix}contacts_archive RENAME TO contacts_archive_old"))
+    archive.create(conn)
+    fields = "lead_id, source_id, operator_id, message, contact_data, created_at, is_processed, archived_at"
+    conn.execute(text(
+        f"INSERT INTO {prefix}contacts_archive (contact_id, {fields}) "
+        f"SELECT id, {fields} FROM {prefix}contacts_archive_old ORDER BY id"
+    ))
+    conn.execute(text(f"DROP TABLE {prefix}contacts_archive_old"))
+
+@migration(8, "Record whether a contact created its lead")
+def add_contact_created_lead(conn: Connection) -> None:
+    contacts = Base.metadata.tables["contacts"]
+    archive = ContactArchive.__table__
+    for table in (contacts, archive):
+        if not _has_column(conn, table, "created_lead"):
+            prefix = f"{table.schema}." if table.schema else ""
+            conn.execute(text(f"ALTER TABLE {prefix}{table.name} ADD COLUMN created_lead BOOLEAN"))
+
+    # Прежние обращения: лида создало первое обращение лида (наименьший id). Ранние обращения
+    # лида могут быть уже в архиве, поэтому в contacts первые обращения ищутся только у остальных лидов
+    archived_leads = select(archive.c.lead_id).where(archive.c.lead_id.isnot(None))
+    first_archived = select(func.min(archive.c.id)).group_by(archive.c.lead_id)
+    first_contacts = select(func.min(contacts.c.id)).group_by(contacts.c.lead_id)
+    conn.execute(update(archive).where(archive.c.created_lead.is_(None)).values(
+        created_lead=case((archive.c.id.in_(first_archived), True), else_=False)
+    ))
+    conn.execute(update(contacts).where(contacts.c.created_lead.is_(None)).values(
+        created_lead=case(
+            (and_(contacts.c.id.in_(first_contacts), contacts.c.lead_id.not_in(archived_leads)), True),
+            else_=False
+        )
+    ))
+    # Агрегаты пересчитываются по признаку, чтобы new_leads совпадал с пересчетом командой
+    backfill_rollups(conn)
+
+@migration(9, "Per-source redistribution priority")
+def add_source_priority(conn: Connection) -> None:
+    if not _has_column(conn, Base.metadata.tables["sources"], "priority"):
+        conn.execute(text("ALTER TABLE sources ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"))
+
+if __name__ == "__main__":
+    from .database import engine
+
+    applied = run_migrations(engine)
+    print(f"Applied migrations: {applied}" if applied else "Database schema is up to date")
@@ -1,6 +1,7 @@
-from .operator import Operator, OperatorSourceWeight
-from .lead import Lead
+from .operator import Operator, OperatorSourceWeight, OperatorCapacity
+from .lead import Lead, LeadIdentity
 from .source import Source
-from .contact import Contact
+from .contact import Contact, ContactArchive
+from .rollup import ContactRollup
 
-__all__ = ["Operator", "Lead", "Source", "Contact", "OperatorSourceWeight"]
+__all__ = ["Operator", "Lead", "LeadIdentity", "Source", "Contact", "ContactArchive", "OperatorSourceWeight", "OperatorCapacity", "ContactRollup"]
@@ -1,21 +1,78 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Index, and_
 from sqlalchemy.orm import relationship
-from ..database import Base
+from ..database import Base, ARCHIVE_SCHEMA
 import datetime
 
 class Contact(Base):
     __tablename__ = "contacts"
     
     id = Column(Integer, primary_key=True, index=True)
-    lead_id = Column(Integer, ForeignKey("leads.id"))
+    lead_id = Column(Integer, ForeignKey("leads.id"), index=True)
     source_id = Column(Integer, ForeignKey("sources.id"))
     operator_id = Column(Integer, ForeignKey("operators.id"), nullable=True)
     message = Column(String, nullable=True)
     contact_data = Column(String, nullable=True)  # Дополнительные данные обращения
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     is_processed = Column(Boolean, default=False)
+    # Обращение создало лида при регистрации (new_leads в агрегатах)
+    created_lead = Column(Boolean, default=False)
     
     # Связи
     lead = relationship("Lead", back_populates="contacts")
     source = relationship("Source", back_populates="contacts")
     operator = relationship("Operator", back_populates="contacts")
+    
+    __table_args__ = (
+        # Текущая нагрузка операторов: только необработанные обращения
+        Index(
+            "ix_contacts_operator_unprocessed", "operator_id",
+            sqlite_where=is_processed == False,
+            postgresql_where=is_processed == False
+        ),
+        # Обращения в порядке создания (постраничный вывод по курсору)
+        Index("ix_contacts_created_id", "created_at", "id"),
+        # Обращения оператора и источника в порядке создания
+        Index("ix_contacts_operator_created", "operator_id", "created_at"),
+        Index("ix_contacts_source_created", "source_id", "created_at"),
+        # Очередь необработанных обращений в порядке создания
+        Index(
+            "ix_contacts_unprocessed_created", "created_at", "id",
+            sqlite_where=is_processed == False,
+            postgresql_where=is_processed == False
+        ),
+        # Необработанные обращения без оператора, ожидающие перераспределения
+        Index(
+            "ix_contacts_unassigned_created", "created_at", "id",
+            sqlite_where=and_(operator_id.is_(None), is_processed == False),
+            postgresql_where=and_(operator_id.is_(None), is_processed == False)
+        ),
+    )
+
+class ContactArchive(Base):
+    """Обработанные обращения, перенесенные из contacts архивацией"""
+    __tablename__ = "contacts_archive"
+    
+    # Собственный ключ архива: SQLite выдает освободившийся после переноса наибольший id
+    # новому обращению, поэтому id обращения в архиве может повторяться
+    id = Column(Integer, primary_key=True)
+    contact_id = Column(Integer, nullable=False)
+    # Без внешних ключей: архив может лежать в отдельном файле SQLite
+    lead_id = Column(Integer, nullable=False)
+    source_id = Column(Integer)
+    operator_id = Column(Integer, nullable=True)
+    message = Column(String, nullable=True)
+    contact_data = Column(String, nullable=True)
+    created_at = Column(DateTime)
+    is_processed = Column(Boolean, default=True)
+    created_lead = Column(Boolean, default=False)
+    archived_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    __table_args__ = (
+        # История обращений лида
+        Index("ix_contacts_archive_lead_id", "lead_id"),
+        # Проверка, перенесено ли уже обращение
+        Index("ix_contacts_archive_contact_id", "contact_id"),
+        # Пересчет агрегатов и выгрузка за период
+        Index("ix_contacts_archive_created_id", "created_at", "id"),
+        {"schema": ARCHIVE_SCHEMA},
+    )
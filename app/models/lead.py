@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index, ForeignKey
 from sqlalchemy.orm import relationship
 from ..database import Base
 import datetime
@@ -15,3 +15,19 @@ class Lead(Base):
     
     # Связи
     contacts = relationship("Contact", back_populates="lead")
+    identities = relationship("LeadIdentity", back_populates="lead")
+    
+    __table_args__ = (
+        # Лиды в порядке создания (постраничный вывод по курсору)
+        Index("ix_leads_created_id", "created_at", "id"),
+    )
+
+class LeadIdentity(Base):
+    __tablename__ = "lead_identities"
+    
+    # Нормализованный ключ идентификации: external_id:..., phone:... или email:...
+    key = Column(String, primary_key=True)
+    lead_id = Column(Integer, ForeignKey("leads.id"), index=True)
+    
+    # Связи
+    lead = relationship("Lead", back_populates="identities")
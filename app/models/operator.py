@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from ..database import Base
 
@@ -19,9 +19,22 @@ class OperatorSourceWeight(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     operator_id = Column(Integer, ForeignKey("operators.id"))
-    source_id = Column(Integer, ForeignKey("sources.id"))
+    source_id = Column(Integer, ForeignKey("sources.id"), index=True)
     weight = Column(Float, default=1.0)
     
     # Связи
     operator = relationship("Operator", back_populates="source_weights")
     source = relationship("Source", back_populates="operator_weights")
+    
+    __table_args__ = (
+        # Один вес на пару оператор-источник
+        Index("ux_operator_source_weights_operator_source", "operator_id", "source_id", unique=True),
+    )
+
+class OperatorCapacity(Base):
+    """Общая нагрузка оператора для нескольких процессов приложения (CRM_CAPACITY_BACKEND=database)"""
+    __tablename__ = "operator_capacity"
+    
+    # Без внешнего ключа: строка удаляется после удаления оператора и не должна мешать его удалению
+    operator_id = Column(Integer, primary_key=True)
+    load = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, DateTime, Index
+from ..database import Base
+
+class ContactRollup(Base):
+    """Почасовые агрегаты обращений по источнику и оператору"""
+    __tablename__ = "contact_rollups"
+    
+    id = Column(Integer, primary_key=True)
+    # Начало часа создания обращений (UTC)
+    bucket = Column(DateTime, nullable=False)
+    source_id = Column(Integer, nullable=False)
+    # 0 - обращения без оператора: NULL не участвовал бы в уникальности ключа
+    operator_id = Column(Integer, nullable=False, default=0)
+    contacts = Column(Integer, nullable=False, default=0)
+    processed = Column(Integer, nullable=False, default=0)
+    new_leads = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        Index("ux_contact_rollups_bucket_source_operator", "bucket", "source_id", "operator_id", unique=True),
+        Index("ix_contact_rollups_operator_bucket", "operator_id", "bucket"),
+    )
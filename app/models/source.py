@@ -8,6 +8,10 @@ class Source(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, unique=True)  # Название бота/источника
     description = Column(String, nullable=True)
+    # Стратегия выбора оператора (random, seeded, smooth, least_loaded); NULL - настройка selection_strategy
+    selection_strategy = Column(String, nullable=True)
+    # Приоритет при перераспределении очереди (order=priority): больше - раньше
+    priority = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Связи
     contacts = relationship("Contact", back_populates="source")
@@ -10,7 +10,16 @@ from .schemas import (
     OperatorSourceWeight,
     ContactCreate,
     Contact,
+    ContactLead,
+    ContactSource,
+    ContactOperator,
+    ContactDetails,
     ContactRegistration,
+    ContactRegistrationResult,
+    ContactsProcessedRequest,
+    ReleasedCapacity,
+    ContactsProcessedResult,
+    IngestTicket,
     OperatorBase,
     LeadBase,
     SourceBase,
@@ -30,7 +39,16 @@ __all__ = [
     "OperatorSourceWeight",
     "ContactCreate",
     "Contact",
+    "ContactLead",
+    "ContactSource",
+    "ContactOperator",
+    "ContactDetails",
     "ContactRegistration",
+    "ContactRegistrationResult",
+    "ContactsProcessedRequest",
+    "ReleasedCapacity",
+    "ContactsProcessedResult",
+    "IngestTicket",
     "OperatorBase",
     "LeadBase",
     "SourceBase",
@@ -41,6 +41,10 @@ class Lead(LeadBase):
 class SourceBase(BaseModel):
     name: str
     description: Optional[str] = None
+    # None - стратегия по умолчанию (настройка selection_strategy)
+    selection_strategy: Optional[str] = None
+    # Приоритет при перераспределении очереди: обращения источников с большим приоритетом назначаются раньше
+    priority: int = 0
 
 class SourceCreate(SourceBase):
     pass
@@ -86,6 +90,31 @@ class Contact(ContactBase):
     class Config:
         from_attributes = True
 
+# Связанные записи в подробностях обращения
+class ContactLead(BaseModel):
+    id: int
+    external_id: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    name: Optional[str] = None
+
+class ContactSource(BaseModel):
+    id: int
+    name: str
+    description: Optional[str] = None
+
+class ContactOperator(BaseModel):
+    id: int
+    name: str
+    is_active: bool
+    max_load: int
+
+# Обращение с лидом, источником и оператором (в списках - только запрошенные в expand)
+class ContactDetails(Contact):
+    lead: Optional[ContactLead] = None
+    source: Optional[ContactSource] = None
+    operator: Optional[ContactOperator] = None
+
 # Схема для регистрации нового обращения
 class ContactRegistration(BaseModel):
     external_id: Optional[str] = None
@@ -95,3 +124,34 @@ class ContactRegistration(BaseModel):
     source_id: int
     message: Optional[str] = None
     contact_data: Optional[str] = None
+
+# Результат регистрации обращения в пакетном режиме
+class ContactRegistrationResult(BaseModel):
+    index: int
+    status: str  # assigned, unassigned или error
+    contact: Optional[Contact] = None
+    error: Optional[str] = None
+
+# Отметка обращений обработанными: по списку id и/или фильтрам (условия объединяются через И)
+class ContactsProcessedRequest(BaseModel):
+    ids: Optional[List[int]] = None
+    operator_id: Optional[int] = None
+    created_before: Optional[datetime] = None
+
+class ReleasedCapacity(BaseModel):
+    operator_id: int
+    released: int
+    current_load: int
+
+class ContactsProcessedResult(BaseModel):
+    processed: int
+    released: List[ReleasedCapacity]
+
+# Тикет обращения, принятого в очередь
+class IngestTicket(BaseModel):
+    ticket_id: str
+    status: str  # queued, assigned, unassigned или error
+    contact_id: Optional[int] = None
+    operator_id: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
@@ -1,3 +1,105 @@
-from .distribution import DistributionService
+from .distribution import DistributionService, REDISTRIBUTION_ORDERS
+from .async_distribution import AsyncDistributionService
+from .load_ledger import OperatorLoadLedger, load_ledger
+from .capacity import (
+    CAPACITY_BACKENDS,
+    CapacityStore,
+    MemoryCapacityStore,
+    DatabaseCapacityStore,
+    NetworkCapacityStore,
+    LocalCapacityClient,
+    RedisCapacityClient,
+    create_capacity_store
+)
+from .selection import (
+    SELECTION_STRATEGIES,
+    SelectionStrategy,
+    WeightedRandomStrategy,
+    SeededRandomStrategy,
+    SmoothWeightedStrategy,
+    LeastLoadedStrategy,
+    register_strategy,
+    create_strategy
+)
+from .routing import RoutingTable, RoutingTableCache, routing_cache
+from .lead_identity import (
+    LeadIdentityResolver,
+    lead_identity_resolver,
+    identity_keys,
+    normalize_phone,
+    normalize_email
+)
+from .affinity import LeadAffinityCache, lead_affinity
+from .rollups import (
+    ROLLUP_GRANULARITIES,
+    RollupDelta,
+    apply_rollups,
+    backfill_rollups,
+    source_stats,
+    operator_stats
+)
+from .response_cache import CachedResponse, ResponseCache, response_cache
+from .ingest import IngestQueue, IngestQueueFull
+from .redistribution import BacklogRedistributor
+from .archive import ContactArchiver, archive_contacts, lead_history
+from .export import (
+    EXPORT_FORMATS,
+    contacts_export_query,
+    assignments_export_query,
+    leads_export_query,
+    stream_export
+)
 
-__all__ = ["DistributionService"]
+__all__ = [
+    "DistributionService",
+    "REDISTRIBUTION_ORDERS",
+    "AsyncDistributionService",
+    "OperatorLoadLedger",
+    "load_ledger",
+    "CAPACITY_BACKENDS",
+    "CapacityStore",
+    "MemoryCapacityStore",
+    "DatabaseCapacityStore",
+    "NetworkCapacityStore",
+    "LocalCapacityClient",
+    "RedisCapacityClient",
+    "create_capacity_store",
+    "SELECTION_STRATEGIES",
+    "SelectionStrategy",
+    "WeightedRandomStrategy",
+    "SeededRandomStrategy",
+    "SmoothWeightedStrategy",
+    "LeastLoadedStrategy",
+    "register_strategy",
+    "create_strategy",
+    "RoutingTable",
+    "RoutingTableCache",
+    "routing_cache",
+    "LeadIdentityResolver",
+    "lead_identity_resolver",
+    "identity_keys",
+    "normalize_phone",
+    "normalize_email",
+    "LeadAffinityCache",
+    "lead_affinity",
+    "ROLLUP_GRANULARITIES",
+    "RollupDelta",
+    "apply_rollups",
+    "backfill_rollups",
+    "source_stats",
+    "operator_stats",
+    "CachedResponse",
+    "ResponseCache",
+    "response_cache",
+    "IngestQueue",
+    "IngestQueueFull",
+    "BacklogRedistributor",
+    "ContactArchiver",
+    "archive_contacts",
+    "lead_history",
+    "EXPORT_FORMATS",
+    "contacts_export_query",
+    "assignments_export_query",
+    "leads_export_query",
+    "stream_export"
+]
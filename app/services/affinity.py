@@ -0,0 +1,58 @@
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from ..models import Contact
+from ..config import settings
+import threading
+
+class LeadAffinityCache:
+    """Последний оператор лида (lead_id -> operator_id) в LRU-кэше ограниченного размера.
+
+    Заполняется по последним обращениям при старте и обновляется после каждого назначения,
+    поэтому проверка закрепления при регистрации не требует запросов к БД.
+    """
+
+    def __init__(self, cache_size: int = 100000):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, lead_id: int) -> int:
+        with self._lock:
+            operator_id = self._cache.get(lead_id)
+            if operator_id is not None:
+                self._cache.move_to_end(lead_id)
+            return operator_id
+
+    def remember(self, assignments: list[tuple[int, int]]) -> None:
+        """Запоминает назначения (lead_id, operator_id) в порядке их выполнения"""
+        with self._lock:
+            for lead_id, operator_id in assignments:
+                self._cache[lead_id] = operator_id
+                self._cache.move_to_end(lead_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def warm(self, db: Session) -> int:
+        """Заполняет кэш операторами последних обращений (не больше cache_size лидов); возвращает число лидов"""
+        # Последнее назначенное обращение каждого лида, затем лимит по лидам: лиды с множеством
+        # обращений не вытесняют остальных из выборки
+        latest_ids = select(func.max(Contact.id)).where(Contact.operator_id.isnot(None)).group_by(Contact.lead_id)
+        rows = db.query(Contact.lead_id, Contact.operator_id).filter(
+            Contact.id.in_(latest_ids)
+        ).order_by(Contact.created_at.desc(), Contact.id.desc()).limit(self.cache_size).yield_per(10000)
+
+        latest = dict(rows)
+        # Самые свежие назначения попадают в конец LRU и вытесняются последними
+        self.remember(list(reversed(latest.items())))
+        return len(latest)
+
+# Общий кэш закрепления лидов за операторами
+lead_affinity = LeadAffinityCache(settings.affinity_cache_size)
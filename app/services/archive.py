@@ -0,0 +1,157 @@
+from sqlalchemy import select, insert, delete, literal, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
+from ..models import Contact, ContactArchive
+from ..metrics import record_archived
+import asyncio
+import datetime
+import logging
+
+# Архивация обработанных обращений: contacts хранит необработанные и недавние обращения,
+# старые обработанные переносятся в contacts_archive (в той же БД или в отдельном файле SQLite).
+# Каждый пакет - отдельная транзакция, поэтому архивация не держит блокировку записи дольше одного пакета.
+# Почасовые агрегаты (contact_rollups) при переносе не меняются.
+
+logger = logging.getLogger(__name__)
+
+# Поля обращения в ответах API; в архиве id обращения хранится в contact_id
+CONTACT_FIELDS = ("id", "lead_id", "source_id", "operator_id", "message", "contact_data", "created_at", "is_processed")
+ARCHIVE_COLUMNS = ("contact_id", *CONTACT_FIELDS[1:], "created_lead")
+
+def archive_contacts(db: Session, older_than_days: float, batch_size: int = 1000, limit: int = None) -> dict:
+    """Переносит в архив обработанные обращения, созданные раньше older_than_days дней назад.
+
+    Обращения переносятся в порядке создания пакетами по batch_size; limit ограничивает число за вызов.
+    """
+    now = datetime.datetime.utcnow()
+    cutoff = now - datetime.timedelta(days=older_than_days)
+    archive = ContactArchive.__table__
+    # Архив в другом файле: транзакция SQLite в режиме WAL атомарна только в пределах файла,
+    # поэтому строки сначала фиксируются в архиве и только потом удаляются из contacts
+    separate = archive.schema is not None
+    columns = [getattr(Contact, name) for name in (*CONTACT_FIELDS, "created_lead")]
+    # Обращение уже в архиве (пакет, прерванный между транзакциями); id может повторяться,
+    # поэтому совпадать должны и лид, и время создания
+    already_archived = select(archive.c.id).where(
+        archive.c.contact_id == Contact.id,
+        archive.c.lead_id == Contact.lead_id,
+        archive.c.created_at == Contact.created_at
+    ).exists()
+
+    moved = 0
+    batches = 0
+    after = None
+    while limit is None or moved < limit:
+        size = batch_size if limit is None else min(batch_size, limit - moved)
+        statement = select(Contact.id, Contact.created_at).where(
+            Contact.is_processed == True, Contact.created_at < cutoff
+        )
+        if after is not None:
+            # Продолжение после последнего пакета: старые необработанные обращения не просматриваются повторно
+            statement = statement.where(or_(
+                Contact.created_at > after[0], and_(Contact.created_at == after[0], Contact.id > after[1])
+            ))
+        rows = db.execute(statement.order_by(Contact.created_at, Contact.id).limit(size)).all()
+        if not rows:
+            break
+        ids = [row.id for row in rows]
+        # Строки архива не удаляются: повторный перенос пропускает уже перенесенные обращения
+        db.execute(insert(archive).from_select(
+            [*ARCHIVE_COLUMNS, "archived_at"], select(*columns, literal(now)).where(Contact.id.in_(ids), ~already_archived)
+        ))
+        if separate:
+            db.commit()
+        db.execute(delete(Contact).where(Contact.id.in_(ids)))
+        db.commit()
+
+        moved += len(ids)
+        batches += 1
+        record_archived(len(ids))
+        after = (rows[-1].created_at, rows[-1].id)
+        if len(rows) < size:
+            break
+    return {"archived": moved, "batches": batches, "cutoff": cutoff}
+
+def _merge_history(contacts: list, archived: list) -> list[dict]:
+    history = {}
+    for contact in contacts:
+        item = {name: getattr(contact, name) for name in CONTACT_FIELDS}
+        history[(contact.id, contact.lead_id, contact.created_at)] = item
+    for contact in archived:
+        # Между транзакциями переноса в отдельный файл обращение может оказаться в обеих таблицах
+        key = (contact.contact_id, contact.lead_id, contact.created_at)
+        if key not in history:
+            history[key] = {"id": contact.contact_id, **{name: getattr(contact, name) for name in CONTACT_FIELDS[1:]}}
+    return sorted(history.values(), key=lambda item: (item["created_at"], item["id"]))
+
+def lead_history(db: Session, lead_id: int, contacts: list) -> list[dict]:
+    """Обращения лида вместе с архивными в порядке создания"""
+    archived = db.query(ContactArchive).filter(ContactArchive.lead_id == lead_id).all()
+    return _merge_history(contacts, archived)
+
+async def lead_history_async(db: AsyncSession, lead_id: int, contacts: list) -> list[dict]:
+    archived = list(await db.scalars(select(ContactArchive).where(ContactArchive.lead_id == lead_id)))
+    return _merge_history(contacts, archived)
+
+class ContactArchiver:
+    """Фоновая архивация: раз в interval секунд переносит обработанные обращения старше older_than_days"""
+
+    def __init__(self, session_factory: sessionmaker, older_than_days: float = 30, batch_size: int = 1000,
+                 interval: float = 3600):
+        self.session_factory = session_factory
+        self.older_than_days = older_than_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    def run_once(self, limit: int = None) -> dict:
+        """Один проход архивации в отдельной сессии"""
+        db = self.session_factory()
+        try:
+            return archive_contacts(db, self.older_than_days, self.batch_size, limit)
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                result = await run_in_threadpool(self.run_once)
+                if result["archived"]:
+                    logger.info("Archived %s contacts created before %s", result["archived"], result["cutoff"])
+            except Exception:
+                logger.exception("Contact archival failed")
+            await asyncio.sleep(self.interval)
+
+if __name__ == "__main__":
+    import argparse
+    from ..config import settings
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Перенос старых обработанных обращений в архив")
+    parser.add_argument("--older-than-days", type=float, default=settings.archive_after_days)
+    parser.add_argument("--batch-size", type=int, default=settings.archive_batch_size)
+    parser.add_argument("--limit", type=int, help="не больше обращений за запуск")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        result = archive_contacts(db, args.older_than_days, args.batch_size, args.limit)
+    finally:
+        db.close()
+    print(f"Archived {result['archived']} contacts in {result['batches']} batches (created before {result['cutoff']})")
@@ -0,0 +1,57 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from ..models import Contact
+from ..schemas import ContactRegistration
+from .distribution import DistributionService
+from .load_ledger import OperatorLoadLedger
+from .routing import RoutingTableCache
+from .lead_identity import LeadIdentityResolver
+from .affinity import LeadAffinityCache
+
+class AsyncDistributionService:
+    """Асинхронный фасад DistributionService для AsyncSession.
+
+    Логика распределения (журнал нагрузки, таблицы маршрутизации, идентификация лидов, единица работы)
+    общая с синхронным сервисом: она выполняется через AsyncSession.run_sync, где каждый запрос к БД
+    ожидается асинхронно и не блокирует цикл событий. Блокирующие вызовы хранилища нагрузки
+    (свой движок БД, Redis) хранилище само выполняет в пуле потоков.
+    """
+
+    def __init__(self, db: AsyncSession, ledger: OperatorLoadLedger = None, routing: RoutingTableCache = None,
+                 identity: LeadIdentityResolver = None, affinity: LeadAffinityCache = None,
+                 affinity_enabled: bool = None):
+        self.db = db
+        self.ledger = ledger
+        self.routing = routing
+        self.identity = identity
+        self.affinity = affinity
+        self.affinity_enabled = affinity_enabled
+
+    def _service(self, session: Session) -> DistributionService:
+        return DistributionService(
+            session, ledger=self.ledger, routing=self.routing, identity=self.identity,
+            affinity=self.affinity, affinity_enabled=self.affinity_enabled
+        )
+
+    async def find_or_create_lead_id(self, external_id: str = None, phone: str = None, email: str = None,
+                                     name: str = None) -> int:
+        return await self.db.run_sync(
+            lambda session: self._service(session).find_or_create_lead_id(external_id, phone, email, name)
+        )
+
+    async def register_contact(self, contact_data: ContactRegistration) -> Contact:
+        """Регистрирует новое обращение и распределяет его между операторами"""
+        return await self.db.run_sync(lambda session: self._service(session).register_contact(contact_data))
+
+    async def register_contacts(self, contacts_data: list[ContactRegistration]) -> list[dict]:
+        """Регистрирует пакет обращений одной транзакцией и возвращает результат по каждому"""
+        return await self.db.run_sync(lambda session: self._service(session).register_contacts(contacts_data))
+
+    async def get_operator_load_stats(self, source_id: int = None, is_active: bool = None,
+                                      by_source: bool = False) -> list[dict]:
+        """Возвращает статистику нагрузки по операторам одним агрегирующим запросом"""
+        return await self.db.run_sync(
+            lambda session: self._service(session).get_operator_load_stats(
+                source_id=source_id, is_active=is_active, by_source=by_source
+            )
+        )
@@ -0,0 +1,374 @@
+from abc import ABC, abstractmethod
+from sqlalchemy import select, update, insert, delete, case, func, bindparam
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, MissingGreenlet
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+from starlette.concurrency import run_in_threadpool
+from multiprocessing.managers import BaseManager
+from urllib.parse import urlsplit
+from ..models import Contact, OperatorCapacity
+import asyncio
+import threading
+
+# Хранилища общей нагрузки операторов для нескольких процессов (воркеры uvicorn, несколько хостов).
+# Журнал нагрузки процесса (OperatorLoadLedger) резервирует место у оператора через хранилище,
+# а свою копию нагрузки использует только для выбора доступных операторов.
+
+CAPACITY_BACKENDS = ("memory", "database", "network")
+
+def _blocking(func, *args):
+    """Вызывает блокирующую операцию хранилища (свой движок БД, Redis, менеджер).
+
+    В асинхронном режиме сервис распределения работает в AsyncSession.run_sync на потоке цикла событий:
+    там вызов уходит в пул потоков, а цикл событий обслуживает другие запросы, пока он выполняется.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return func(*args)
+    try:
+        return await_only(run_in_threadpool(func, *args))
+    except MissingGreenlet:
+        # Синхронный код на потоке цикла вне run_sync (обработчики старта): ждать выполнения не через что
+        return func(*args)
+
+class CapacityStore(ABC):
+    """Интерфейс хранилища нагрузки: атомарный резерв места с проверкой max_load"""
+
+    # Резерв выполняется в транзакции сессии db и откатывается вместе с ней
+    transactional = False
+    # Нагрузку меняют и другие процессы: копия в журнале процесса может устареть
+    shared = True
+
+    @abstractmethod
+    def acquire(self, db: Session, operator_id: int, max_load: int) -> tuple[bool, int]:
+        """Увеличивает нагрузку, только если она меньше max_load; возвращает (зарезервировано, текущая нагрузка)"""
+
+    @abstractmethod
+    def release(self, operator_id: int, amount: int = 1) -> int:
+        """Уменьшает нагрузку (не ниже нуля) и возвращает новое значение"""
+
+    @abstractmethod
+    def loads(self, db: Session = None) -> dict[int, int]:
+        """Текущая нагрузка операторов"""
+
+    @abstractmethod
+    def initialize(self, loads: dict[int, int]) -> None:
+        """Задает нагрузку операторам, которых еще нет в хранилище"""
+
+    @abstractmethod
+    def reset(self, loads: dict[int, int]) -> None:
+        """Заменяет нагрузку всех операторов (сверка с БД)"""
+
+    @abstractmethod
+    def forget(self, operator_id: int) -> None:
+        """Удаляет оператора из хранилища"""
+
+class MemoryCapacityStore(CapacityStore):
+    """Нагрузка в памяти процесса: max_load соблюдается только в пределах одного процесса"""
+
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loads: dict[int, int] = {}
+
+    def acquire(self, db: Session, operator_id: int, max_load: int) -> tuple[bool, int]:
+        with self._lock:
+            load = self._loads.get(operator_id, 0)
+            if load >= max_load:
+                return False, load
+            self._loads[operator_id] = load + 1
+            return True, load + 1
+
+    def release(self, operator_id: int, amount: int = 1) -> int:
+        with self._lock:
+            load = max(self._loads.get(operator_id, 0) - amount, 0)
+            self._loads[operator_id] = load
+            return load
+
+    def loads(self, db: Session = None) -> dict[int, int]:
+        with self._lock:
+            return dict(self._loads)
+
+    def initialize(self, loads: dict[int, int]) -> None:
+        with self._lock:
+            for operator_id, load in loads.items():
+                self._loads.setdefault(operator_id, load)
+
+    def reset(self, loads: dict[int, int]) -> None:
+        with self._lock:
+            self._loads = dict(loads)
+
+    def forget(self, operator_id: int) -> None:
+        with self._lock:
+            self._loads.pop(operator_id, None)
+
+class DatabaseCapacityStore(CapacityStore):
+    """Нагрузка в таблице operator_capacity общей БД.
+
+    Резерв - условный UPDATE ... WHERE load < max_load в транзакции регистрации обращения:
+    БД сериализует конкурирующие обновления строки, а откат транзакции снимает резерв.
+    """
+
+    transactional = True
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.table = OperatorCapacity.__table__
+
+    def _count(self, db, operator_id: int) -> int:
+        return db.scalar(select(func.count(Contact.id)).where(
+            Contact.operator_id == operator_id, Contact.is_processed == False
+        ))
+
+    def acquire(self, db: Session, operator_id: int, max_load: int) -> tuple[bool, int]:
+        if db is None:
+            return _blocking(self._acquire_committed, operator_id, max_load)
+
+        table = self.table
+        statement = update(table).where(
+            table.c.operator_id == operator_id, table.c.load < max_load
+        ).values(load=table.c.load + 1).returning(table.c.load)
+        for _ in range(2):
+            load = db.scalar(statement)
+            if load is not None:
+                return True, load
+            load = db.scalar(select(table.c.load).where(table.c.operator_id == operator_id))
+            if load is not None:
+                return False, load
+            # Первый резерв нового оператора: строка создается по числу его необработанных обращений
+            try:
+                with db.begin_nested():
+                    db.execute(insert(table).values(operator_id=operator_id, load=self._count(db, operator_id)))
+            except IntegrityError:
+                pass
+        return False, max_load
+
+    def _acquire_committed(self, operator_id: int, max_load: int) -> tuple[bool, int]:
+        with self.engine.begin() as conn:
+            return self.acquire(conn, operator_id, max_load)
+
+    def release(self, operator_id: int, amount: int = 1) -> int:
+        return _blocking(self._release, operator_id, amount)
+
+    def _release(self, operator_id: int, amount: int) -> int:
+        table = self.table
+        with self.engine.begin() as conn:
+            load = conn.scalar(
+                update(table).where(table.c.operator_id == operator_id)
+                .values(load=case((table.c.load > amount, table.c.load - amount), else_=0))
+                .returning(table.c.load)
+            )
+        return load or 0
+
+    def loads(self, db: Session = None) -> dict[int, int]:
+        if db is None:
+            return _blocking(self._committed_loads)
+        return dict(db.execute(select(self.table.c.operator_id, self.table.c.load)).all())
+
+    def _committed_loads(self) -> dict[int, int]:
+        with self.engine.connect() as conn:
+            return self.loads(conn)
+
+    def _write(self, loads: dict[int, int], overwrite: bool) -> None:
+        table = self.table
+        with self.engine.begin() as conn:
+            existing = set(conn.scalars(select(table.c.operator_id)))
+            if overwrite and existing:
+                conn.execute(
+                    update(table).where(table.c.operator_id == bindparam("id")).values(load=bindparam("value")),
+                    [{"id": operator_id, "value": loads.get(operator_id, 0)} for operator_id in existing]
+                )
+            missing = [
+                {"operator_id": operator_id, "load": load}
+                for operator_id, load in loads.items() if operator_id not in existing
+            ]
+            if missing:
+                conn.execute(insert(table), missing)
+
+    def initialize(self, loads: dict[int, int]) -> None:
+        _blocking(self._write, loads, False)
+
+    def reset(self, loads: dict[int, int]) -> None:
+        _blocking(self._write, loads, True)
+
+    def forget(self, operator_id: int) -> None:
+        _blocking(self._forget, operator_id)
+
+    def _forget(self, operator_id: int) -> None:
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.operator_id == operator_id))
+
+class NetworkCapacityStore(CapacityStore):
+    """Нагрузка во внешнем хранилище (Redis и т.п.) через клиент с интерфейсом LocalCapacityClient"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def acquire(self, db: Session, operator_id: int, max_load: int) -> tuple[bool, int]:
+        acquired, load = _blocking(self.client.acquire, str(operator_id), max_load)
+        return bool(acquired), int(load)
+
+    def release(self, operator_id: int, amount: int = 1) -> int:
+        return int(_blocking(self.client.release, str(operator_id), amount))
+
+    def loads(self, db: Session = None) -> dict[int, int]:
+        return {int(operator_id): int(load) for operator_id, load in _blocking(self.client.get_all).items()}
+
+    def initialize(self, loads: dict[int, int]) -> None:
+        _blocking(self.client.set_missing, {str(operator_id): load for operator_id, load in loads.items()})
+
+    def reset(self, loads: dict[int, int]) -> None:
+        _blocking(self.client.set_all, {str(operator_id): load for operator_id, load in loads.items()})
+
+    def forget(self, operator_id: int) -> None:
+        _blocking(self.client.delete, str(operator_id))
+
+class LocalCapacityClient:
+    """Клиент сетевого хранилища нагрузки в памяти: заменяет Redis в тестах и в одном процессе.
+
+    Через CapacityManager тот же объект обслуживает несколько процессов по сети.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loads: dict[str, int] = {}
+
+    def acquire(self, field: str, limit: int) -> tuple[int, int]:
+        with self._lock:
+            load = self._loads.get(field, 0)
+            if load >= limit:
+                return 0, load
+            self._loads[field] = load + 1
+            return 1, load + 1
+
+    def release(self, field: str, amount: int = 1) -> int:
+        with self._lock:
+            load = max(self._loads.get(field, 0) - amount, 0)
+            self._loads[field] = load
+            return load
+
+    def get_all(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._loads)
+
+    def set_missing(self, mapping: dict[str, int]) -> None:
+        with self._lock:
+            for field, load in mapping.items():
+                self._loads.setdefault(field, load)
+
+    def set_all(self, mapping: dict[str, int]) -> None:
+        with self._lock:
+            self._loads = dict(mapping)
+
+    def delete(self, field: str) -> None:
+        with self._lock:
+            self._loads.pop(field, None)
+
+class RedisCapacityClient:
+    """Клиент сетевого хранилища нагрузки на Redis: нагрузки операторов - поля одного хэша"""
+
+    ACQUIRE_SCRIPT = """
+local load = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+if load >= tonumber(ARGV[2]) then
+    return {0, load}
+end
+return {1, redis.call('HINCRBY', KEYS[1], ARGV[1], 1)}
+"""
+    RELEASE_SCRIPT = """
+local load = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0') - tonumber(ARGV[2])
+if load < 0 then
+    load = 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], load)
+return load
+"""
+
+    def __init__(self, redis_client, key: str = "crm:operator_load"):
+        self.redis = redis_client
+        self.key = key
+        self._acquire = redis_client.register_script(self.ACQUIRE_SCRIPT)
+        self._release = redis_client.register_script(self.RELEASE_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, key: str = "crm:operator_load") -> "RedisCapacityClient":
+        # Пакет redis нужен только для CRM_CAPACITY_BACKEND=network с адресом redis://
+        import redis
+
+        return cls(redis.Redis.from_url(url), key)
+
+    def acquire(self, field: str, limit: int) -> tuple[int, int]:
+        acquired, load = self._acquire(keys=[self.key], args=[field, limit])
+        return int(acquired), int(load)
+
+    def release(self, field: str, amount: int = 1) -> int:
+        return int(self._release(keys=[self.key], args=[field, amount]))
+
+    def get_all(self) -> dict[str, int]:
+        return {field.decode(): int(load) for field, load in self.redis.hgetall(self.key).items()}
+
+    def set_missing(self, mapping: dict[str, int]) -> None:
+        pipeline = self.redis.pipeline()
+        for field, load in mapping.items():
+            pipeline.hsetnx(self.key, field, load)
+        pipeline.execute()
+
+    def set_all(self, mapping: dict[str, int]) -> None:
+        pipeline = self.redis.pipeline(transaction=True)
+        pipeline.delete(self.key)
+        if mapping:
+            pipeline.hset(self.key, mapping=mapping)
+        pipeline.execute()
+
+    def delete(self, field: str) -> None:
+        self.redis.hdel(self.key, field)
+
+class CapacityManager(BaseManager):
+    """Сервер LocalCapacityClient для нескольких процессов (адрес manager://host:port)"""
+
+_local_client = None
+
+def _shared_local_client() -> LocalCapacityClient:
+    global _local_client
+    if _local_client is None:
+        _local_client = LocalCapacityClient()
+    return _local_client
+
+CapacityManager.register("capacity_client", callable=_shared_local_client)
+
+def _manager_address(url: str) -> tuple[str, int]:
+    parts = urlsplit(url)
+    return parts.hostname or "127.0.0.1", parts.port
+
+def serve_local_capacity(url: str, authkey: bytes) -> CapacityManager:
+    """Запускает сервер LocalCapacityClient в дочернем процессе; остановка - manager.shutdown()"""
+    manager = CapacityManager(address=_manager_address(url), authkey=authkey)
+    manager.start()
+    return manager
+
+def connect_capacity_client(url: str, authkey: bytes = b"", key: str = "crm:operator_load"):
+    """Клиент сетевого хранилища по адресу redis://... или manager://host:port"""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisCapacityClient.from_url(url, key)
+    if url.startswith("manager://"):
+        manager = CapacityManager(address=_manager_address(url), authkey=authkey)
+        manager.connect()
+        return manager.capacity_client()
+    raise ValueError(f"Unsupported capacity store url: {url}")
+
+def create_capacity_store(config, engine: Engine) -> CapacityStore:
+    """Хранилище нагрузки по настройке capacity_backend"""
+    backend = config.capacity_backend
+    if backend == "memory":
+        return MemoryCapacityStore()
+    if backend == "database":
+        return DatabaseCapacityStore(engine)
+    if backend == "network":
+        if not config.capacity_network_url:
+            raise ValueError("CRM_CAPACITY_NETWORK_URL is required for the network capacity backend")
+        return NetworkCapacityStore(connect_capacity_client(
+            config.capacity_network_url, config.capacity_network_authkey.encode(), config.capacity_network_key
+        ))
+    raise ValueError(f"Unknown capacity backend: {backend}; allowed: {', '.join(CAPACITY_BACKENDS)}")
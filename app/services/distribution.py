@@ -1,158 +1,412 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, func, select, update
+from sqlalchemy.exc import IntegrityError
 from ..models import Operator, Lead, Source, Contact, OperatorSourceWeight
-from ..schemas import ContactRegistration, Contact
-import random
+from ..schemas import ContactRegistration, Contact as ContactSchema
+from .load_ledger import OperatorLoadLedger, load_ledger
+from .routing import RoutingTable, RoutingTableCache, routing_cache
+from .lead_identity import LeadIdentityResolver, lead_identity_resolver, identity_keys
+from .affinity import LeadAffinityCache, lead_affinity
+from .rollups import RollupDelta, apply_rollups
+from .selection import SelectionStrategy, WeightedRandomStrategy
+from ..metrics import timed_stage, record_outcome, record_redistributed, record_affinity, UNKNOWN_SOURCE
+from ..config import settings
+from contextlib import contextmanager
+from itertools import accumulate
+
+# Порядок перераспределения обращений без оператора
+REDISTRIBUTION_ORDERS = ("fifo", "lifo", "priority")
+
+class UnitOfWork:
+    """Изменения одной транзакции сервиса: резервы нагрузки, новые ключи лидов, назначения лидов операторам
+    и изменения почасовых агрегатов"""
+
+    def __init__(self):
+        self.reserved = []
+        self.new_leads = []
+        self.assignments = []
+        self.rollups = RollupDelta()
+        # Нагрузка уже перечитана из общего хранилища в этой транзакции
+        self.refreshed = False
 
 class DistributionService:
-    def __init__(self, db: Session):
+    # Максимальное число значений в одном условии IN (...)
+    IN_CHUNK_SIZE = 500
+    # Число попыток создать лида при конфликте с параллельной регистрацией
+    LEAD_CREATE_ATTEMPTS = 3
+    
+    def __init__(self, db: Session, ledger: OperatorLoadLedger = None, routing: RoutingTableCache = None,
+                 identity: LeadIdentityResolver = None, affinity: LeadAffinityCache = None,
+                 affinity_enabled: bool = None):
         self.db = db
+        self.ledger = ledger or load_ledger
+        self.routing = routing or routing_cache
+        self.identity = identity or lead_identity_resolver
+        self.affinity = affinity or lead_affinity
+        self.affinity_enabled = settings.affinity_enabled if affinity_enabled is None else affinity_enabled
     
-    def find_or_create_lead(self, external_id: str = None, phone: str = None, email: str = None, name: str = None) -> Lead:
-        """Находит существующего лида или создает нового"""
-        
-        # Ищем лид по внешнему ID, если он указан
-        if external_id:
-            lead = self.db.query(Lead).filter(Lead.external_id == external_id).first()
-            if lead:
-                return lead
-        
-        # Ищем лид по комбинации phone и email
-        if phone or email:
-            conditions = []
-            if phone:
-                conditions.append(Lead.phone == phone)
-            if email:
-                conditions.append(Lead.email == email)
-            
-            if conditions:
-                lead = self.db.query(Lead).filter(or_(*conditions)).first()
-                if lead:
-                    return lead
-        
-        # Создаем нового лида
-        lead_data = {}
-        if external_id:
-            lead_data["external_id"] = external_id
-        if phone:
-            lead_data["phone"] = phone
-        if email:
-            lead_data["email"] = email
-        if name:
-            lead_data["name"] = name
-        
-        lead = Lead(**lead_data)
-        self.db.add(lead)
-        self.db.commit()
-        self.db.refresh(lead)
-        return lead
+    @contextmanager
+    def unit_of_work(self, commit_stage: str = None):
+        """Единственный коммит операции: при ошибке откатывает транзакцию и снимает резервы нагрузки,
+        после коммита подтверждает резервы и запоминает ключи новых лидов"""
+        work = UnitOfWork()
+        try:
+            yield work
+            apply_rollups(self.db, work.rollups)
+            if commit_stage:
+                with timed_stage(commit_stage):
+                    self.db.commit()
+            else:
+                self.db.commit()
+        except Exception:
+            self.db.rollback()
+            for operator_id in work.reserved:
+                self.ledger.release(operator_id)
+            raise
+        for operator_id in work.reserved:
+            self.ledger.confirm(operator_id)
+        for lead_id, keys in work.new_leads:
+            self.identity.remember(keys, lead_id)
+        if self.affinity_enabled and work.assignments:
+            self.affinity.remember(work.assignments)
     
-    def get_available_operators_for_source(self, source_id: int) -> list[Operator]:
-        """Возвращает список доступных операторов для источника"""
-        
-        # Получаем всех активных операторов для данного источника
-        operator_weights = self.db.query(OperatorSourceWeight).filter(
-            OperatorSourceWeight.source_id == source_id
-        ).join(
-            Operator, OperatorSourceWeight.operator_id == Operator.id
-        ).filter(
-            Operator.is_active == True
-        ).all()
-        
-        if not operator_weights:
-            return []
-        
-        # Фильтруем операторов, которые не превышают лимит нагрузки
-        available_operators = []
-        for ow in operator_weights:
-            # Считаем текущую нагрузку оператора
-            current_load = self.db.query(Contact).filter(
-                Contact.operator_id == ow.operator_id,
-                Contact.is_processed == False
-            ).count()
+    def _upsert_lead(self, keys: list[str], external_id: str = None, phone: str = None,
+                     email: str = None, name: str = None) -> tuple[int, bool]:
+        """Находит лида по ключам или вставляет нового в точке сохранения; возвращает (lead_id, создан ли)"""
+        for _ in range(self.LEAD_CREATE_ATTEMPTS):
+            # Один запрос к таблице ключей, а для повторных лидов обычно только кэш
+            lead_id = self.identity.resolve(self.db, keys)
+            if lead_id is not None:
+                return lead_id, False
             
-            if current_load < ow.operator.max_load:
-                available_operators.append((ow.operator, ow.weight))
+            # Если параллельный запрос успел создать лида с теми же ключами,
+            # уникальность ключей откатывает вставку и лид находится на следующей попытке
+            try:
+                with self.db.begin_nested():
+                    lead = Lead(
+                        external_id=external_id or None,
+                        phone=phone or None,
+                        email=email or None,
+                        name=name or None
+                    )
+                    self.db.add(lead)
+                    self.db.flush()
+                    lead_id = lead.id
+                    self.identity.add_identities(self.db, lead_id, keys)
+                    self.db.flush()
+            except IntegrityError:
+                continue
+            return lead_id, True
         
-        return available_operators
+        raise RuntimeError("Could not create lead: identity keys keep conflicting")
     
-    def select_operator_by_weights(self, available_operators: list) -> Operator:
-        """Выбирает оператора с учетом весов"""
+    def find_or_create_lead_id(self, external_id: str = None, phone: str = None, email: str = None, name: str = None) -> int:
+        """Находит лида по нормализованным external_id, телефону и email или создает нового; возвращает его id"""
+        keys = identity_keys(external_id, phone, email)
+        with self.unit_of_work() as work:
+            lead_id, created = self._upsert_lead(keys, external_id, phone, email, name)
+            if created:
+                work.new_leads.append((lead_id, keys))
+        return lead_id
+    
+    def find_or_create_lead(self, external_id: str = None, phone: str = None, email: str = None, name: str = None) -> Lead:
+        """Находит существующего лида или создает нового"""
+        return self.db.get(Lead, self.find_or_create_lead_id(external_id, phone, email, name))
+    
+    def get_available_operators_for_source(self, source_id: int) -> list[tuple[int, float]]:
+        """Возвращает список доступных операторов источника в виде (operator_id, weight)"""
+        operator_ids, weights, _ = self.routing.get_table(self.db, source_id).eligible()
+        return list(zip(operator_ids, weights))
+    
+    def select_operator_by_weights(self, available_operators: list, strategy: SelectionStrategy = None):
+        """Выбирает оператора из списка (operator_id, weight) стратегией выбора (по умолчанию - случайно по весам).
+
+        Регистрация обращений выбирает по таблицам маршрутизации со стратегией источника.
+        """
         if not available_operators:
             return None
         
-        # Вычисляем общий вес
-        total_weight = sum(weight for _, weight in available_operators)
-        
-        # Генерируем случайное число
-        random_value = random.uniform(0, total_weight)
-        
-        # Находим оператора
-        current_weight = 0
-        for operator, weight in available_operators:
-            current_weight += weight
-            if random_value <= current_weight:
-                return operator
-        
-        # Возвращаем последнего оператора (на случай погрешностей округления)
-        return available_operators[-1][0]
+        strategy = strategy or WeightedRandomStrategy()
+        operator_ids = [operator_id for operator_id, _ in available_operators]
+        weights = [weight for _, weight in available_operators]
+        cumulative = list(accumulate(weights))
+        return strategy.pick(strategy.prepare(operator_ids, weights, cumulative), operator_ids, cumulative, None)
+    
+    def reserve_operator(self, work: UnitOfWork, table: RoutingTable, lead_id: int) -> int:
+        """Резервирует оператора для обращения лида: в режиме закрепления - последнего оператора лида,
+        если он активен, обслуживает источник и не заполнен, иначе - выбором по весам"""
+        operator_id = None
+        if self.affinity_enabled:
+            last_operator_id = self.affinity.get(lead_id)
+            if last_operator_id is None:
+                record_affinity("miss")
+            elif table.try_reserve_operator(last_operator_id, self.db):
+                operator_id = last_operator_id
+                record_affinity("hit")
+            else:
+                record_affinity("unavailable")
+        if operator_id is None:
+            operator_id = table.pick_and_reserve(db=self.db)
+        if operator_id is None and self.ledger.shared and not work.refreshed:
+            # Копия нагрузки в журнале могла устареть: места освобождают и другие процессы
+            work.refreshed = True
+            self.ledger.refresh(self.db)
+            operator_id = table.pick_and_reserve(db=self.db)
+        if operator_id is not None:
+            work.reserved.append(operator_id)
+            work.assignments.append((lead_id, operator_id))
+        return operator_id
     
     def register_contact(self, contact_data: ContactRegistration) -> Contact:
         """Регистрирует новое обращение и распределяет его между операторами"""
+        with timed_stage("total"), self.unit_of_work(commit_stage="commit") as work:
+            # Находим источник
+            with timed_stage("source"):
+                source = self.db.get(Source, contact_data.source_id)
+            if not source:
+                record_outcome(UNKNOWN_SOURCE, "error")
+                raise ValueError(f"Source with id {contact_data.source_id} not found")
+            
+            # Находим или создаем лида (без отдельного коммита)
+            with timed_stage("lead"):
+                keys = identity_keys(contact_data.external_id, contact_data.phone, contact_data.email)
+                lead_id, created = self._upsert_lead(
+                    keys, contact_data.external_id, contact_data.phone, contact_data.email, contact_data.name
+                )
+            if created:
+                work.new_leads.append((lead_id, keys))
+            
+            # Выбираем оператора по таблице маршрутизации источника и резервируем за ним обращение
+            with timed_stage("routing"):
+                table = self.routing.get_table(self.db, source.id)
+            with timed_stage("select"):
+                operator_id = self.reserve_operator(work, table, lead_id)
+            
+            # Создаем обращение; id и created_at заполняются при flush, поэтому после коммита
+            # повторно читать запись из БД не нужно
+            contact = Contact(
+                lead_id=lead_id,
+                source_id=source.id,
+                operator_id=operator_id,
+                message=contact_data.message,
+                contact_data=contact_data.contact_data,
+                created_lead=created
+            )
+            with timed_stage("flush"):
+                self.db.add(contact)
+                self.db.flush()
+            work.rollups.add(contact.created_at, source.id, operator_id, contacts=1, new_leads=int(created))
         
-        # Находим или создаем лида
-        lead = self.find_or_create_lead(
-            external_id=contact_data.external_id,
-            phone=contact_data.phone,
-            email=contact_data.email,
-            name=contact_data.name
-        )
-        
-        # Находим источник
-        source = self.db.query(Source).filter(Source.id == contact_data.source_id).first()
-        if not source:
-            raise ValueError(f"Source with id {contact_data.source_id} not found")
+        record_outcome(source.id, "assigned" if operator_id is not None else "unassigned")
+        return contact
+    
+    def _query_in_chunks(self, column, values: set) -> list:
+        """Выбирает записи по условию column IN (...), разбивая список значений на части"""
+        values = list(values)
+        rows = []
+        for start in range(0, len(values), self.IN_CHUNK_SIZE):
+            chunk = values[start:start + self.IN_CHUNK_SIZE]
+            rows.extend(self.db.query(column.class_).filter(column.in_(chunk)).all())
+        return rows
+    
+    def register_contacts(self, contacts_data: list[ContactRegistration]) -> list[dict]:
+        """Регистрирует пакет обращений одной транзакцией и возвращает результат по каждому.
+
+        Этапы пакета замеряются с префиксом batch_: поиск лидов и источников, создание лида и выбор оператора
+        для каждого обращения, flush, commit и весь пакет.
+        """
+        results = []
+        with timed_stage("batch_total"):
+            # Разрешаем лидов по нормализованным ключам и источники запросами IN (...)
+            with timed_stage("batch_lookup"):
+                keys_by_item = [identity_keys(c.external_id, c.phone, c.email) for c in contacts_data]
+                lead_ids_by_key = self.identity.lookup(self.db, [key for keys in keys_by_item for key in keys])
+                source_ids = {
+                    source.id for source in self._query_in_chunks(
+                        Source.id, {c.source_id for c in contacts_data}
+                    )
+                }
+            
+            with self.unit_of_work(commit_stage="batch_commit") as work:
+                for index, contact_data in enumerate(contacts_data):
+                    if contact_data.source_id not in source_ids:
+                        results.append({
+                            "index": index,
+                            "status": "error",
+                            "error": f"Source with id {contact_data.source_id} not found"
+                        })
+                        continue
+                    
+                    # Находим лида среди загруженных или созданных в этом пакете (по приоритету ключей)
+                    keys = keys_by_item[index]
+                    lead_id = next((lead_ids_by_key[key] for key in keys if key in lead_ids_by_key), None)
+                    created = False
+                    if lead_id is None:
+                        with timed_stage("batch_lead"):
+                            lead_id, created = self._upsert_lead(
+                                keys, contact_data.external_id, contact_data.phone, contact_data.email,
+                                contact_data.name
+                            )
+                        if created:
+                            work.new_leads.append((lead_id, keys))
+                        for key in keys:
+                            lead_ids_by_key.setdefault(key, lead_id)
+                    
+                    # Резервируем нагрузку в журнале сразу, чтобы следующие обращения пакета ее учитывали
+                    with timed_stage("batch_select"):
+                        table = self.routing.get_table(self.db, contact_data.source_id)
+                        operator_id = self.reserve_operator(work, table, lead_id)
+                    
+                    contact = Contact(
+                        lead_id=lead_id,
+                        source_id=contact_data.source_id,
+                        operator_id=operator_id,
+                        message=contact_data.message,
+                        contact_data=contact_data.contact_data,
+                        created_lead=created
+                    )
+                    self.db.add(contact)
+                    results.append({
+                        "index": index,
+                        "status": "assigned" if operator_id is not None else "unassigned",
+                        "contact": contact
+                    })
+                
+                with timed_stage("batch_flush"):
+                    self.db.flush()
+                for result in results:
+                    if "contact" in result:
+                        contact = result["contact"]
+                        work.rollups.add(
+                            contact.created_at, contact.source_id, contact.operator_id,
+                            contacts=1, new_leads=int(contact.created_lead)
+                        )
+                        result["contact"] = ContactSchema.model_validate(contact)
         
-        # Получаем доступных операторов
-        available_operators = self.get_available_operators_for_source(contact_data.source_id)
+        for result in results:
+            # Ошибка пакета - только неизвестный источник
+            source_id = contacts_data[result["index"]].source_id if "contact" in result else UNKNOWN_SOURCE
+            record_outcome(source_id, result["status"])
+        return results
+    
+    def redistribute_backlog(self, limit: int = 500, order: str = "fifo") -> dict:
+        """Назначает операторов необработанным обращениям без оператора (не более limit за вызов).
+
+        order: "fifo" - сначала самые старые обращения, "lifo" - сначала самые новые,
+        "priority" - сначала обращения источников с большим Source.priority, внутри приоритета - самые старые.
+        Назначения записываются одним UPDATE на оператора; возвращает число просмотренных и назначенных.
+        """
+        if order not in REDISTRIBUTION_ORDERS:
+            raise ValueError(f"Unknown redistribution order: {order}")
+        unassigned = and_(Contact.operator_id.is_(None), Contact.is_processed == False)
+        if self.ledger.shared:
+            self.ledger.refresh(self.db)
         
-        # Выбираем оператора
-        operator = None
-        if available_operators:
-            operator = self.select_operator_by_weights(available_operators)
+        # Берем только источники, у которых сейчас есть доступные операторы,
+        # иначе обращения источников без свободных мест занимали бы весь пакет
+        source_ids = [
+            source_id for source_id in self.db.scalars(select(Contact.source_id).where(unassigned).distinct())
+            if source_id is not None and self.routing.get_table(self.db, source_id).eligible()[0]
+        ]
+        if not source_ids:
+            return {"scanned": 0, "assigned": 0}
         
-        # Создаем обращение
-        contact = Contact(
-            lead_id=lead.id,
-            source_id=source.id,
-            operator_id=operator.id if operator else None,
-            message=contact_data.message,
-            contact_data=contact_data.contact_data
+        query = select(Contact.id, Contact.source_id, Contact.lead_id).where(
+            unassigned, Contact.source_id.in_(source_ids)
         )
+        if order == "priority":
+            query = query.join(Source, Source.id == Contact.source_id).order_by(
+                Source.priority.desc(), Contact.created_at.asc(), Contact.id.asc()
+            )
+        elif order == "fifo":
+            query = query.order_by(Contact.created_at.asc(), Contact.id.asc())
+        else:
+            query = query.order_by(Contact.created_at.desc(), Contact.id.desc())
+        rows = self.db.execute(query.limit(limit)).all()
         
-        self.db.add(contact)
-        self.db.commit()
-        self.db.refresh(contact)
+        contact_ids_by_operator = {}
+        lost = {}
+        with self.unit_of_work() as work:
+            exhausted = set()
+            for contact_id, source_id, lead_id in rows:
+                if source_id in exhausted:
+                    continue
+                operator_id = self.reserve_operator(work, self.routing.get_table(self.db, source_id), lead_id)
+                if operator_id is None:
+                    exhausted.add(source_id)
+                    continue
+                contact_ids_by_operator.setdefault(operator_id, []).append(contact_id)
+            
+            # Обращение могли обработать или назначить параллельно: условие UPDATE это учитывает
+            for operator_id, contact_ids in contact_ids_by_operator.items():
+                updated = 0
+                for start in range(0, len(contact_ids), self.IN_CHUNK_SIZE):
+                    for source_id, created_at, created_lead in self.db.execute(
+                        update(Contact)
+                        .where(Contact.id.in_(contact_ids[start:start + self.IN_CHUNK_SIZE]), unassigned)
+                        .values(operator_id=operator_id)
+                        .returning(Contact.source_id, Contact.created_at, Contact.created_lead)
+                        .execution_options(synchronize_session=False)
+                    ):
+                        # Обращение (и созданный им лид) переходит в агрегатах из строки "без оператора" к оператору
+                        new_leads = int(bool(created_lead))
+                        work.rollups.add(created_at, source_id, None, contacts=-1, new_leads=-new_leads)
+                        work.rollups.add(created_at, source_id, operator_id, contacts=1, new_leads=new_leads)
+                        updated += 1
+                if updated < len(contact_ids):
+                    lost[operator_id] = len(contact_ids) - updated
         
-        return contact
+        # Снимаем нагрузку за обращения, которые не удалось назначить
+        for operator_id, amount in lost.items():
+            self.ledger.decrement(operator_id, amount)
+        assigned = sum(len(contact_ids) for contact_ids in contact_ids_by_operator.values()) - sum(lost.values())
+        record_redistributed(assigned)
+        return {"scanned": len(rows), "assigned": assigned}
     
-    def get_operator_load_stats(self) -> dict:
-        """Возвращает статистику нагрузки по операторам"""
-        stats = []
+    def get_operator_load_stats(self, source_id: int = None, is_active: bool = None, by_source: bool = False) -> list[dict]:
+        """Возвращает статистику нагрузки по операторам одним агрегирующим запросом"""
         
-        operators = self.db.query(Operator).all()
-        for operator in operators:
-            current_load = self.db.query(Contact).filter(
-                Contact.operator_id == operator.id,
-                Contact.is_processed == False
-            ).count()
-            
-            stats.append({
-                "operator_id": operator.id,
-                "operator_name": operator.name,
-                "max_load": operator.max_load,
-                "current_load": current_load,
-                "load_percentage": (current_load / operator.max_load * 100) if operator.max_load > 0 else 0
-            })
+        # Сначала агрегируем необработанные обращения (по частичному индексу), затем присоединяем к операторам
+        load_columns = [Contact.operator_id.label("operator_id")]
+        if by_source:
+            load_columns.append(Contact.source_id.label("source_id"))
+        loads = select(*load_columns, func.count(Contact.id).label("load")).where(
+            Contact.is_processed == False
+        ).group_by(*load_columns).subquery()
+        
+        columns = [Operator.id, Operator.name, Operator.max_load, Operator.is_active, func.coalesce(loads.c.load, 0)]
+        if by_source:
+            columns.append(loads.c.source_id)
+        
+        query = self.db.query(*columns).outerjoin(loads, loads.c.operator_id == Operator.id)
+        if source_id is not None:
+            query = query.filter(Operator.id.in_(
+                select(OperatorSourceWeight.operator_id).where(OperatorSourceWeight.source_id == source_id)
+            ))
+        if is_active is not None:
+            query = query.filter(Operator.is_active == is_active)
+        rows = query.order_by(Operator.id).all()
+        
+        stats = {}
+        for row in rows:
+            operator_id, name, max_load, active, count = row[:5]
+            item = stats.get(operator_id)
+            if item is None:
+                item = stats[operator_id] = {
+                    "operator_id": operator_id,
+                    "operator_name": name,
+                    "is_active": active,
+                    "max_load": max_load,
+                    "current_load": 0
+                }
+                if by_source:
+                    item["by_source"] = {}
+            item["current_load"] += count
+            if by_source and count:
+                item["by_source"][row[5]] = count
+        
+        for item in stats.values():
+            max_load = item["max_load"]
+            item["load_percentage"] = (item["current_load"] / max_load * 100) if max_load and max_load > 0 else 0
         
-        return stats
+        return list(stats.values())
@@ -0,0 +1,122 @@
+from sqlalchemy import select, union_all, Select
+from sqlalchemy.orm import sessionmaker
+from ..models import Contact, ContactArchive, Lead, Operator, Source
+from typing import Iterator
+import csv
+import datetime
+import io
+import json
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def _contact_filters(statement: Select, columns, source_id: int = None, operator_id: int = None,
+                     created_from: datetime.datetime = None, created_to: datetime.datetime = None,
+                     is_processed: bool = None) -> Select:
+    if source_id is not None:
+        statement = statement.where(columns.source_id == source_id)
+    if operator_id is not None:
+        statement = statement.where(columns.operator_id == operator_id)
+    if created_from is not None:
+        statement = statement.where(columns.created_at >= created_from)
+    if created_to is not None:
+        statement = statement.where(columns.created_at < created_to)
+    if is_processed is not None:
+        statement = statement.where(columns.is_processed == is_processed)
+    return statement
+
+def _contacts_query(build, include_archived: bool = False, **filters) -> Select:
+    """Запрос build(колонки, id обращения) по contacts, а с include_archived - и по архиву, в порядке создания"""
+    contacts = Contact.__table__
+    statement = _contact_filters(build(contacts.c, contacts.c.id), contacts.c, **filters)
+    if not include_archived:
+        return statement.order_by(contacts.c.created_at, contacts.c.id)
+    archive = ContactArchive.__table__
+    history = union_all(
+        statement, _contact_filters(build(archive.c, archive.c.contact_id), archive.c, **filters)
+    ).subquery()
+    # Первая колонка выгрузки - id обращения
+    return select(history).order_by(history.c.created_at, list(history.c)[0])
+
+def contacts_export_query(include_archived: bool = False, **filters) -> Select:
+    """Запрос выгрузки обращений с фильтрами по источнику, оператору, дате и статусу"""
+    return _contacts_query(lambda columns, contact_id: select(
+        contact_id.label("id"),
+        columns.lead_id,
+        columns.source_id,
+        columns.operator_id,
+        columns.message,
+        columns.contact_data,
+        columns.created_at,
+        columns.is_processed
+    ), include_archived, **filters)
+
+def assignments_export_query(include_archived: bool = False, **filters) -> Select:
+    """Запрос выгрузки назначений обращений операторам"""
+    return _contacts_query(lambda columns, contact_id: select(
+        contact_id.label("contact_id"),
+        columns.lead_id,
+        columns.source_id,
+        Source.name.label("source_name"),
+        columns.operator_id,
+        Operator.name.label("operator_name"),
+        columns.created_at,
+        columns.is_processed
+    ).select_from(
+        contact_id.table
+    ).outerjoin(
+        Source, columns.source_id == Source.id
+    ).outerjoin(
+        Operator, columns.operator_id == Operator.id
+    ), include_archived, **filters)
+
+def leads_export_query(created_from: datetime.datetime = None, created_to: datetime.datetime = None) -> Select:
+    """Запрос выгрузки лидов с фильтром по дате создания"""
+    statement = select(Lead.id, Lead.external_id, Lead.phone, Lead.email, Lead.name, Lead.created_at)
+    if created_from is not None:
+        statement = statement.where(Lead.created_at >= created_from)
+    if created_to is not None:
+        statement = statement.where(Lead.created_at < created_to)
+    return statement.order_by(Lead.created_at, Lead.id)
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _csv_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+def stream_export(session_factory: sessionmaker, statement: Select, export_format: str = "ndjson",
+                  chunk_size: int = 1000) -> Iterator[str]:
+    """Построчно выгружает результат запроса в NDJSON или CSV с постоянным расходом памяти.
+
+    Генератор открывает собственную сессию: он выполняется уже после выхода из обработчика запроса.
+    """
+    db = session_factory()
+    try:
+        result = db.execute(statement.execution_options(yield_per=chunk_size))
+        fields = list(result.keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == "csv" else None
+
+        if writer:
+            writer.writerow(fields)
+            yield buffer.getvalue()
+
+        for rows in result.partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            for row in rows:
+                if writer:
+                    writer.writerow([_csv_value(value) for value in row])
+                else:
+                    buffer.write(json.dumps(dict(zip(fields, row)), default=_json_default, ensure_ascii=False))
+                    buffer.write("\n")
+            yield buffer.getvalue()
+    finally:
+        db.close()
@@ -0,0 +1,126 @@
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+from collections import OrderedDict
+from ..schemas import ContactRegistration
+from .distribution import DistributionService
+from ..metrics import record_stage
+import asyncio
+import datetime
+import threading
+import time
+import uuid
+
+class IngestQueueFull(Exception):
+    pass
+
+class IngestQueue:
+    """Очередь приема обращений с фоновыми воркерами распределения"""
+
+    def __init__(self, session_factory: sessionmaker, maxsize: int = 10000, workers: int = 2,
+                 batch_size: int = 100, max_tickets: int = 100000):
+        self.session_factory = session_factory
+        self.maxsize = maxsize
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_tickets = max_tickets
+        self._queue = None
+        self._tasks = []
+        self._tickets = OrderedDict()
+        self._tickets_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._queue is not None
+
+    async def start(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        # Очередь передается воркерам сразу: stop() может обнулить self._queue до их первого запуска
+        self._tasks = [asyncio.create_task(self._worker(self._queue)) for _ in range(self.workers)]
+
+    async def stop(self, drain: bool = True) -> None:
+        """Останавливает воркеров, предварительно дождавшись обработки очереди"""
+        if self._queue is None:
+            return
+        queue, self._queue = self._queue, None
+        if drain:
+            await queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, contact_data: ContactRegistration) -> dict:
+        """Ставит обращение в очередь и возвращает тикет; при переполнении бросает IngestQueueFull"""
+        if self._queue is None:
+            raise RuntimeError("Ingest queue is not running")
+
+        ticket = {
+            "ticket_id": uuid.uuid4().hex,
+            "status": "queued",
+            "contact_id": None,
+            "operator_id": None,
+            "error": None,
+            "created_at": datetime.datetime.utcnow()
+        }
+        try:
+            self._queue.put_nowait((ticket["ticket_id"], contact_data, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise IngestQueueFull()
+
+        with self._tickets_lock:
+            self._tickets[ticket["ticket_id"]] = ticket
+            while len(self._tickets) > self.max_tickets:
+                self._tickets.popitem(last=False)
+        return dict(ticket)
+
+    def get_ticket(self, ticket_id: str) -> dict:
+        with self._tickets_lock:
+            ticket = self._tickets.get(ticket_id)
+            return dict(ticket) if ticket else None
+
+    def _update_ticket(self, ticket_id: str, **fields) -> None:
+        with self._tickets_lock:
+            ticket = self._tickets.get(ticket_id)
+            if ticket:
+                ticket.update(fields)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                await run_in_threadpool(self._process_batch, batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    def _process_batch(self, batch: list) -> None:
+        # Время в очереди до начала распределения; этапы самого пакета замеряет register_contacts
+        started = time.perf_counter()
+        for _, _, enqueued in batch:
+            record_stage("ingest_wait", started - enqueued)
+        db = self.session_factory()
+        try:
+            results = DistributionService(db).register_contacts([contact_data for _, contact_data, _ in batch])
+        except Exception as e:
+            for ticket_id, _, _ in batch:
+                self._update_ticket(ticket_id, status="error", error=str(e))
+            return
+        finally:
+            db.close()
+
+        for (ticket_id, _, _), result in zip(batch, results):
+            contact = result.get("contact")
+            self._update_ticket(
+                ticket_id,
+                status=result["status"],
+                contact_id=contact.id if contact else None,
+                operator_id=contact.operator_id if contact else None,
+                error=result.get("error")
+            )
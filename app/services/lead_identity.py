@@ -0,0 +1,107 @@
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from ..models import LeadIdentity
+from ..config import settings
+import re
+import threading
+
+def normalize_phone(phone: str) -> str:
+    """Приводит телефон к цифрам в формате 7XXXXXXXXXX: "+7 900 ...", "8900..." и "900..." совпадают"""
+    if not phone:
+        return None
+    digits = re.sub(r"\D", "", phone)
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10 and digits[0] == "9":
+        digits = "7" + digits
+    return digits or None
+
+def normalize_email(email: str) -> str:
+    if not email:
+        return None
+    return email.strip().lower() or None
+
+def identity_keys(external_id: str = None, phone: str = None, email: str = None) -> list[str]:
+    """Ключи идентификации лида в порядке приоритета: external_id, телефон, email"""
+    keys = []
+    if external_id:
+        keys.append(f"external_id:{external_id}")
+    phone = normalize_phone(phone)
+    if phone:
+        keys.append(f"phone:{phone}")
+    email = normalize_email(email)
+    if email:
+        keys.append(f"email:{email}")
+    return keys
+
+class LeadIdentityResolver:
+    """Поиск лида по нормализованным ключам через таблицу lead_identities и LRU-кэш"""
+
+    # Максимальное число ключей в одном условии IN (...)
+    IN_CHUNK_SIZE = 500
+
+    def __init__(self, cache_size: int = 100000):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_get(self, key: str) -> int:
+        with self._lock:
+            lead_id = self._cache.get(key)
+            if lead_id is not None:
+                self._cache.move_to_end(key)
+            return lead_id
+
+    def remember(self, keys: list[str], lead_id: int) -> None:
+        with self._lock:
+            for key in keys:
+                self._cache[key] = lead_id
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def lookup(self, db: Session, keys: list[str]) -> dict[str, int]:
+        """Возвращает lead_id для найденных ключей: сначала из кэша, остальные одним запросом"""
+        found = {}
+        missing = []
+        for key in keys:
+            lead_id = self._cache_get(key)
+            if lead_id is not None:
+                found[key] = lead_id
+            else:
+                missing.append(key)
+
+        missing = list(dict.fromkeys(missing))
+        for start in range(0, len(missing), self.IN_CHUNK_SIZE):
+            rows = db.query(LeadIdentity.key, LeadIdentity.lead_id).filter(
+                LeadIdentity.key.in_(missing[start:start + self.IN_CHUNK_SIZE])
+            ).all()
+            for key, lead_id in rows:
+                found[key] = lead_id
+                self.remember([key], lead_id)
+        return found
+
+    def resolve(self, db: Session, keys: list[str]) -> int:
+        """Возвращает lead_id по ключу с наивысшим приоритетом или None"""
+        if not keys:
+            return None
+        # Ключ с наивысшим приоритетом уже в кэше - запрос к БД не нужен
+        lead_id = self._cache_get(keys[0])
+        if lead_id is not None:
+            return lead_id
+        found = self.lookup(db, keys)
+        for key in keys:
+            if key in found:
+                return found[key]
+        return None
+
+    def add_identities(self, db: Session, lead_id: int, keys: list[str]) -> None:
+        """Добавляет в сессию ключи лида; кэш обновляется вызовом remember после коммита"""
+        db.add_all([LeadIdentity(key=key, lead_id=lead_id) for key in keys])
+
+# Общий резолвер лидов процесса
+lead_identity_resolver = LeadIdentityResolver(settings.lead_identity_cache_size)
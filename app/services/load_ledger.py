@@ -0,0 +1,176 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from ..models import Contact
+from ..config import settings
+from ..database import engine
+from .capacity import CapacityStore, MemoryCapacityStore, create_capacity_store
+import threading
+
+class OperatorLoadLedger:
+    """Учет текущей нагрузки операторов (число необработанных обращений) в памяти.
+
+    Резерв места выполняет хранилище нагрузки (store, по умолчанию - в памяти процесса); с общим хранилищем
+    max_load соблюдается для всех процессов приложения, а журнал процесса хранит последнюю известную нагрузку
+    для выбора операторов.
+    """
+
+    def __init__(self, store: CapacityStore = None):
+        self.store = store or MemoryCapacityStore()
+        self._lock = threading.Lock()
+        self._seed_lock = threading.Lock()
+        self._loads: dict[int, int] = {}
+        # Зарезервированные, но еще не закоммиченные обращения: их нет в БД, но они входят в нагрузку
+        self._pending: dict[int, int] = {}
+        self._seeded = False
+        self._listeners = []
+
+    @property
+    def is_seeded(self) -> bool:
+        return self._seeded
+
+    @property
+    def shared(self) -> bool:
+        """Нагрузку меняют и другие процессы: копия в журнале может устареть"""
+        return self.store.shared
+
+    def add_listener(self, listener) -> None:
+        """Подписывает listener(operator_id, old_load, new_load) на изменения нагрузки.
+
+        После полной перезагрузки журнала listener вызывается с operator_id=None.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, operator_id, old_load, new_load) -> None:
+        for listener in self._listeners:
+            listener(operator_id, old_load, new_load)
+
+    def _count_from_db(self, db: Session) -> dict[int, int]:
+        rows = db.query(Contact.operator_id, func.count(Contact.id)).filter(
+            Contact.operator_id.isnot(None),
+            Contact.is_processed == False
+        ).group_by(Contact.operator_id).all()
+        return {operator_id: count for operator_id, count in rows}
+
+    def _with_pending(self, loads: dict[int, int]) -> dict[int, int]:
+        for operator_id, pending in self._pending.items():
+            if pending:
+                loads[operator_id] = loads.get(operator_id, 0) + pending
+        return loads
+
+    def seed(self, db: Session) -> None:
+        """Заполняет журнал нагрузки одним агрегирующим запросом к БД"""
+        loads = self._count_from_db(db)
+        if self.store.shared:
+            # Значения, уже записанные другими процессами, не перезаписываются: в них есть их резервы
+            self.store.initialize(loads)
+        else:
+            # Незакоммиченные резервы процесса еще не видны в БД
+            with self._lock:
+                loads = self._with_pending(loads)
+            self.store.reset(loads)
+        loads = self.store.loads()
+        with self._lock:
+            self._loads = loads
+            self._seeded = True
+        self._notify(None, None, None)
+
+    def refresh(self, db: Session = None) -> None:
+        """Перечитывает нагрузку из общего хранилища (места могли освободить другие процессы)"""
+        if not self.store.shared:
+            return
+        loads = self.store.loads(db)
+        with self._lock:
+            self._loads = loads
+        self._notify(None, None, None)
+
+    def ensure_seeded(self, db: Session) -> None:
+        if self._seeded:
+            return
+        with self._seed_lock:
+            if not self._seeded:
+                self.seed(db)
+
+    def reconcile(self, db: Session) -> dict[int, dict]:
+        """Сверяет журнал с БД, исправляет расхождения и возвращает их"""
+        actual = self._count_from_db(db)
+        # Незакоммиченные резервы транзакционного хранилища не видны в нем до коммита
+        if not self.store.transactional:
+            with self._lock:
+                actual = self._with_pending(actual)
+        cached_loads = self.store.loads()
+        self.store.reset(actual)
+        with self._lock:
+            drift = {}
+            for operator_id in set(actual) | set(cached_loads):
+                cached = cached_loads.get(operator_id, 0)
+                real = actual.get(operator_id, 0)
+                if cached != real:
+                    drift[operator_id] = {"cached": cached, "actual": real}
+            self._loads = actual
+            self._seeded = True
+        if drift:
+            self._notify(None, None, None)
+        return drift
+
+    def get_load(self, operator_id: int) -> int:
+        return self._loads.get(operator_id, 0)
+
+    def get_loads(self) -> dict[int, int]:
+        with self._lock:
+            return dict(self._loads)
+
+    def _set_load(self, operator_id: int, load: int, pending: int = 0) -> None:
+        with self._lock:
+            old_load = self._loads.get(operator_id, 0)
+            self._loads[operator_id] = load
+            if pending:
+                self._pending[operator_id] = max(self._pending.get(operator_id, 0) + pending, 0)
+        self._notify(operator_id, old_load, load)
+
+    def try_reserve(self, operator_id: int, max_load: int, db: Session = None) -> bool:
+        """Атомарно резервирует обращение за оператором, только если его нагрузка меньше max_load.
+
+        После коммита резерв подтверждается через confirm, при откате снимается через release.
+        Транзакционное хранилище резервирует в транзакции сессии db.
+        """
+        acquired, load = self.store.acquire(db, operator_id, max_load)
+        self._set_load(operator_id, load, 1 if acquired else 0)
+        return acquired
+
+    def confirm(self, operator_id: int, amount: int = 1) -> None:
+        with self._lock:
+            self._pending[operator_id] = max(self._pending.get(operator_id, 0) - amount, 0)
+
+    def release(self, operator_id: int, amount: int = 1) -> int:
+        """Снимает незакоммиченный резерв после отката транзакции"""
+        if self.store.transactional:
+            # Резерв в хранилище откатился вместе с транзакцией
+            load = max(self.get_load(operator_id) - amount, 0)
+            self._set_load(operator_id, load, -amount)
+            return load
+        with self._lock:
+            self._pending[operator_id] = max(self._pending.get(operator_id, 0) - amount, 0)
+        return self.decrement(operator_id, amount)
+
+    def decrement(self, operator_id: int, amount: int = 1) -> int:
+        load = self.store.release(operator_id, amount)
+        self._set_load(operator_id, load)
+        return load
+
+    def forget(self, operator_id: int) -> None:
+        self.store.forget(operator_id)
+        with self._lock:
+            self._loads.pop(operator_id, None)
+            self._pending.pop(operator_id, None)
+
+    def clear(self) -> None:
+        if not self.store.shared:
+            self.store.reset({})
+        with self._lock:
+            self._loads = {}
+            self._pending = {}
+            self._seeded = False
+        self._notify(None, None, None)
+
+# Общий журнал нагрузки процесса; CRM_CAPACITY_BACKEND задает общее хранилище нагрузки для нескольких процессов
+load_ledger = OperatorLoadLedger(create_capacity_store(settings, engine))
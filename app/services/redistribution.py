@@ -0,0 +1,105 @@
+from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
+from .distribution import DistributionService, REDISTRIBUTION_ORDERS
+from .load_ledger import OperatorLoadLedger, load_ledger
+from .routing import RoutingTableCache, routing_cache
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BacklogRedistributor:
+    """Фоновое перераспределение обращений без оператора.
+
+    Запускается по таймеру и досрочно, когда у операторов освобождается место: обращение обработано,
+    оператор снова активен, увеличен max_load или добавлен вес. За один проход назначается
+    не больше batch_size обращений; полный пакет сразу запускает следующий проход.
+    """
+
+    def __init__(self, session_factory: sessionmaker, ledger: OperatorLoadLedger = None,
+                 routing: RoutingTableCache = None, batch_size: int = 500, interval: float = 30,
+                 debounce: float = 1.0, order: str = "fifo"):
+        if order not in REDISTRIBUTION_ORDERS:
+            raise ValueError(f"Unknown redistribution order: {order}")
+        self.session_factory = session_factory
+        self.ledger = ledger or load_ledger
+        self.routing = routing or routing_cache
+        self.batch_size = batch_size
+        self.interval = interval
+        self.debounce = debounce
+        self.order = order
+        self._loop = None
+        self._event = None
+        self._task = None
+        self._listening = False
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._event = asyncio.Event()
+        # Первый проход - сразу после старта: обращения без оператора могли остаться с прошлого запуска
+        self._event.set()
+        if not self._listening:
+            self.ledger.add_listener(self.on_load_changed)
+            self.routing.add_listener(self.wake)
+            self._listening = True
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        self._loop = None
+        self._event = None
+
+    def wake(self) -> None:
+        """Запускает проход досрочно; можно вызывать из любого потока"""
+        loop, event = self._loop, self._event
+        if loop is None or event is None or event.is_set():
+            return
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # Цикл событий уже закрыт
+            pass
+
+    def on_load_changed(self, operator_id, old_load, new_load) -> None:
+        # Место освобождается при уменьшении нагрузки или после перезагрузки журнала
+        if operator_id is None or new_load < old_load:
+            self.wake()
+
+    def run_once(self, limit: int = None) -> dict:
+        """Один проход перераспределения в отдельной сессии"""
+        db = self.session_factory()
+        try:
+            return DistributionService(db, self.ledger, self.routing).redistribute_backlog(
+                limit=limit or self.batch_size, order=self.order
+            )
+        finally:
+            db.close()
+
+    async def _run(self) -> None:
+        event = self._event
+        while True:
+            try:
+                await asyncio.wait_for(event.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            # Несколько освобождений подряд (например, пакет обработанных обращений) - один проход
+            if self.debounce:
+                await asyncio.sleep(self.debounce)
+            event.clear()
+            try:
+                result = await run_in_threadpool(self.run_once)
+            except Exception:
+                logger.exception("Backlog redistribution failed")
+                continue
+            if result["assigned"] >= self.batch_size:
+                event.set()
@@ -0,0 +1,123 @@
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from collections import OrderedDict
+from ..config import settings
+from ..metrics import record_response_cache
+import hashlib
+import threading
+import time
+
+class CachedResponse:
+    """Готовый к отправке JSON-ответ: тело, ETag и дополнительные заголовки"""
+
+    __slots__ = ("body", "etag", "headers", "expires_at")
+
+    def __init__(self, body: bytes, headers: dict = None, expires_at: float = 0):
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.headers = headers or {}
+        self.expires_at = expires_at
+
+    def matches(self, if_none_match: str) -> bool:
+        if not if_none_match:
+            return False
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags
+
+    def to_response(self, if_none_match: str = None) -> Response:
+        headers = {"ETag": self.etag, **self.headers}
+        if self.matches(if_none_match):
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+class ResponseCache:
+    """LRU-кэш сериализованных ответов редко меняющихся справочников (операторы, источники, веса).
+
+    Ключ - кортеж, первый элемент которого - раздел ("operators", "sources", "weights").
+    Записи сбрасываются по разделам при изменениях через CRUD; TTL ограничивает устаревание
+    в других процессах, которые об изменении не знают.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 60, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> CachedResponse:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def version(self, namespace: str) -> tuple:
+        """Версия раздела; ее нужно взять до чтения из БД и передать в put"""
+        with self._lock:
+            return self._epoch, self._versions.get(namespace, 0)
+
+    def put(self, key: tuple, content, headers: dict = None, version: tuple = None) -> CachedResponse:
+        """Сериализует ответ и сохраняет его, если раздел не менялся с момента version"""
+        entry = CachedResponse(
+            JSONResponse(jsonable_encoder(content)).body, headers, time.monotonic() + self.ttl
+        )
+        if not self.enabled:
+            return entry
+        with self._lock:
+            # Чтение, начатое до изменения, не должно вернуть в кэш устаревший ответ
+            if version is not None and version != (self._epoch, self._versions.get(key[0], 0)):
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, *namespaces: str) -> None:
+        with self._lock:
+            for namespace in namespaces:
+                self._versions[namespace] = self._versions.get(namespace, 0) + 1
+            for key in [key for key in self._entries if key[0] in namespaces]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def respond(self, key: tuple, if_none_match: str, load) -> Response:
+        """Ответ из кэша или из load() -> (content, headers); при совпадении If-None-Match - 304 без тела"""
+        entry = self.get(key)
+        record_response_cache("hit" if entry is not None else "miss")
+        if entry is None:
+            version = self.version(key[0])
+            content, headers = load()
+            entry = self.put(key, content, headers, version)
+        return entry.to_response(if_none_match)
+
+    async def respond_async(self, key: tuple, if_none_match: str, load) -> Response:
+        """То же для async-эндпоинтов: load - корутинная функция"""
+        entry = self.get(key)
+        record_response_cache("hit" if entry is not None else "miss")
+        if entry is None:
+            version = self.version(key[0])
+            content, headers = await load()
+            entry = self.put(key, content, headers, version)
+        return entry.to_response(if_none_match)
+
+# Общий кэш ответов справочников
+response_cache = ResponseCache(
+    settings.response_cache_size, settings.response_cache_ttl, settings.response_cache_enabled
+)
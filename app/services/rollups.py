@@ -0,0 +1,198 @@
+from sqlalchemy import select, delete, insert, func, case, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from ..models import Contact, ContactArchive, ContactRollup
+from ..config import settings
+import datetime
+
+# Почасовые агрегаты обращений (contact_rollups) по часу создания обращения, источнику и оператору:
+# число обращений, сколько из них обработано и сколько создали нового лида. Агрегаты обновляются
+# в транзакциях регистрации, перераспределения и обработки, поэтому отчеты за любой период
+# читают сотни строк агрегатов вместо всей таблицы contacts.
+
+ROLLUP_GRANULARITIES = ("total", "day", "hour")
+
+def hour_bucket(moment: datetime.datetime) -> datetime.datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+class RollupDelta:
+    """Изменения агрегатов одной транзакции: (час, источник, оператор) -> счетчики"""
+
+    def __init__(self):
+        self._rows = {}
+
+    def __bool__(self) -> bool:
+        return bool(self._rows)
+
+    def add(self, created_at: datetime.datetime, source_id: int, operator_id: int = None,
+            contacts: int = 0, processed: int = 0, new_leads: int = 0) -> None:
+        key = (hour_bucket(created_at), source_id, operator_id or 0)
+        counters = self._rows.get(key)
+        if counters is None:
+            counters = self._rows[key] = [0, 0, 0]
+        counters[0] += contacts
+        counters[1] += processed
+        counters[2] += new_leads
+
+    def rows(self) -> list[dict]:
+        return [
+            {"bucket": bucket, "source_id": source_id, "operator_id": operator_id,
+             "contacts": contacts, "processed": processed, "new_leads": new_leads}
+            for (bucket, source_id, operator_id), (contacts, processed, new_leads) in self._rows.items()
+        ]
+
+def upsert_statement(dialect_name: str):
+    """INSERT ... ON CONFLICT DO UPDATE, прибавляющий счетчики к существующей строке агрегата"""
+    if dialect_name == "postgresql":
+        statement = postgresql.insert(ContactRollup.__table__)
+    elif dialect_name == "sqlite":
+        statement = sqlite.insert(ContactRollup.__table__)
+    else:
+        raise ValueError(f"Rollups are not supported for {dialect_name}")
+    table = ContactRollup.__table__
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.bucket, table.c.source_id, table.c.operator_id],
+        set_={
+            "contacts": table.c.contacts + statement.excluded.contacts,
+            "processed": table.c.processed + statement.excluded.processed,
+            "new_leads": table.c.new_leads + statement.excluded.new_leads,
+        }
+    )
+
+def apply_rollups(db: Session, delta: RollupDelta) -> None:
+    """Записывает изменения агрегатов в текущей транзакции сессии"""
+    if settings.rollups_enabled and delta:
+        db.execute(upsert_statement(db.get_bind().dialect.name), delta.rows())
+
+async def apply_rollups_async(db: AsyncSession, delta: RollupDelta) -> None:
+    if settings.rollups_enabled and delta:
+        await db.execute(upsert_statement(db.bind.dialect.name), delta.rows())
+
+def _bucket_expression(dialect_name: str, column):
+    if dialect_name == "sqlite":
+        # Тот же текстовый формат, в котором SQLAlchemy хранит DateTime в SQLite
+        return func.strftime("%Y-%m-%d %H:00:00.000000", column)
+    if dialect_name == "postgresql":
+        return func.date_trunc("hour", column)
+    raise ValueError(f"Rollups are not supported for {dialect_name}")
+
+def backfill_rollups(conn: Connection, start: datetime.datetime = None, end: datetime.datetime = None) -> int:
+    """Пересчитывает агрегаты за часы [start, end) по contacts и архиву обращений; возвращает число строк агрегатов.
+
+    Новые лиды - обращения с признаком created_lead, который записывает регистрация.
+    """
+    table = ContactRollup.__table__
+    if start is not None:
+        start = hour_bucket(start)
+    if end is not None and end != hour_bucket(end):
+        end = hour_bucket(end) + datetime.timedelta(hours=1)
+
+    archive = ContactArchive.__table__
+    rollup_range = []
+    contact_filters = [[], []]
+    for filters, created_at in zip(contact_filters, (Contact.created_at, archive.c.created_at)):
+        if start is not None:
+            filters.append(created_at >= start)
+        if end is not None:
+            filters.append(created_at < end)
+    if start is not None:
+        rollup_range.append(table.c.bucket >= start)
+    if end is not None:
+        rollup_range.append(table.c.bucket < end)
+    conn.execute(delete(table).where(*rollup_range))
+
+    # Перенесенные в архив обращения тоже учитываются: агрегаты описывают всю историю
+    history = union_all(
+        select(Contact.id, Contact.source_id, Contact.operator_id, Contact.created_at,
+               Contact.is_processed, Contact.created_lead).where(*contact_filters[0]),
+        select(archive.c.contact_id, archive.c.source_id, archive.c.operator_id, archive.c.created_at,
+               archive.c.is_processed, archive.c.created_lead).where(*contact_filters[1])
+    ).subquery()
+    bucket = _bucket_expression(conn.dialect.name, history.c.created_at)
+    operator_id = func.coalesce(history.c.operator_id, 0)
+    aggregates = select(
+        bucket,
+        history.c.source_id,
+        operator_id,
+        func.count(history.c.id),
+        func.sum(case((history.c.is_processed == True, 1), else_=0)),
+        # Тот же признак, что при регистрации: обращение создало лида
+        func.sum(case((history.c.created_lead == True, 1), else_=0))
+    ).where(
+        history.c.source_id.isnot(None)
+    ).group_by(bucket, history.c.source_id, operator_id)
+
+    return conn.execute(insert(table).from_select(
+        ["bucket", "source_id", "operator_id", "contacts", "processed", "new_leads"], aggregates
+    )).rowcount
+
+def _rollup_stats(db: Session, key, columns: list, filters: list, date_from: datetime.datetime,
+                  date_to: datetime.datetime, granularity: str) -> list[dict]:
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise ValueError(f"Unknown granularity: {granularity}; allowed: {', '.join(ROLLUP_GRANULARITIES)}")
+    if date_from is not None:
+        filters.append(ContactRollup.bucket >= hour_bucket(date_from))
+    if date_to is not None:
+        filters.append(ContactRollup.bucket < date_to)
+
+    group_by = [key] if granularity == "total" else [key, ContactRollup.bucket]
+    rows = db.execute(
+        select(*group_by, *(column for _, column in columns)).where(*filters).group_by(*group_by).order_by(*group_by)
+    ).all()
+
+    names = [name for name, _ in columns]
+    if granularity == "total":
+        return [{key.key: row[0], **dict(zip(names, (value or 0 for value in row[1:])))} for row in rows]
+
+    # Часы складываются в дни здесь: строк агрегатов немного, а усечение даты в SQL зависит от диалекта
+    stats = {}
+    for row in rows:
+        bucket = row[1].date().isoformat() if granularity == "day" else row[1].isoformat()
+        item = stats.get((row[0], bucket))
+        if item is None:
+            item = stats[(row[0], bucket)] = {key.key: row[0], "bucket": bucket, **dict.fromkeys(names, 0)}
+        for name, value in zip(names, row[2:]):
+            item[name] += value or 0
+    return list(stats.values())
+
+def source_stats(db: Session, date_from: datetime.datetime = None, date_to: datetime.datetime = None,
+                 source_id: int = None, granularity: str = "total") -> list[dict]:
+    """Обращения источников за период по агрегатам: всего, назначено, без оператора, обработано, новых лидов"""
+    assigned = func.sum(case((ContactRollup.operator_id != 0, ContactRollup.contacts), else_=0))
+    columns = [
+        ("contacts", func.sum(ContactRollup.contacts)),
+        ("assigned", assigned),
+        ("unassigned", func.sum(ContactRollup.contacts) - assigned),
+        ("processed", func.sum(ContactRollup.processed)),
+        ("new_leads", func.sum(ContactRollup.new_leads)),
+    ]
+    filters = [] if source_id is None else [ContactRollup.source_id == source_id]
+    return _rollup_stats(db, ContactRollup.source_id, columns, filters, date_from, date_to, granularity)
+
+def operator_stats(db: Session, date_from: datetime.datetime = None, date_to: datetime.datetime = None,
+                   operator_id: int = None, granularity: str = "total") -> list[dict]:
+    """Назначенные операторам обращения за период по агрегатам: всего, обработано, новых лидов"""
+    columns = [
+        ("contacts", func.sum(ContactRollup.contacts)),
+        ("processed", func.sum(ContactRollup.processed)),
+        ("new_leads", func.sum(ContactRollup.new_leads)),
+    ]
+    filters = [ContactRollup.operator_id != 0]
+    if operator_id is not None:
+        filters.append(ContactRollup.operator_id == operator_id)
+    return _rollup_stats(db, ContactRollup.operator_id, columns, filters, date_from, date_to, granularity)
+
+if __name__ == "__main__":
+    import argparse
+    from ..database import engine
+
+    parser = argparse.ArgumentParser(description="Пересчет почасовых агрегатов обращений")
+    parser.add_argument("--from", dest="start", type=datetime.datetime.fromisoformat)
+    parser.add_argument("--to", dest="end", type=datetime.datetime.fromisoformat)
+    args = parser.parse_args()
+
+    with engine.begin() as conn:
+        rows = backfill_rollups(conn, args.start, args.end)
+    print(f"Rebuilt {rows} rollup rows")
@@ -0,0 +1,166 @@
+from sqlalchemy.orm import Session
+from ..models import Operator, OperatorSourceWeight, Source
+from ..config import settings
+from .load_ledger import OperatorLoadLedger, load_ledger
+from .selection import SelectionStrategy, WeightedRandomStrategy, create_strategy
+from itertools import accumulate
+import random
+import threading
+
+class RoutingTable:
+    """Таблица маршрутизации источника: операторы с весами, накопленные веса доступных
+    и состояние стратегии выбора оператора"""
+
+    def __init__(self, source_id: int, entries: list[tuple[int, float, int, bool]], ledger: OperatorLoadLedger,
+                 strategy: SelectionStrategy = None):
+        # entries: (operator_id, weight, max_load, is_active)
+        self.source_id = source_id
+        self.strategy = strategy or WeightedRandomStrategy(source_id)
+        self.entries = entries
+        self.max_loads = {operator_id: max_load for operator_id, _, max_load, _ in entries}
+        self.active = {operator_id for operator_id, weight, _, is_active in entries if is_active and weight > 0}
+        self.ledger = ledger
+        self._eligible = None
+        self._version = 0
+
+    def reset_eligible(self) -> None:
+        self._version += 1
+        self._eligible = None
+
+    def _build_eligible(self) -> tuple:
+        operator_ids = []
+        weights = []
+        for operator_id, weight, max_load, is_active in self.entries:
+            if is_active and weight > 0 and self.ledger.get_load(operator_id) < max_load:
+                operator_ids.append(operator_id)
+                weights.append(weight)
+        cumulative = list(accumulate(weights))
+        return operator_ids, weights, cumulative, self.strategy.prepare(operator_ids, weights, cumulative)
+
+    def _eligible_state(self) -> tuple:
+        eligible = self._eligible
+        if eligible is None:
+            version = self._version
+            eligible = self._build_eligible()
+            # Не сохраняем результат, если нагрузка изменилась во время построения
+            if version == self._version:
+                self._eligible = eligible
+        return eligible
+
+    def eligible(self) -> tuple[list[int], list[float], list[float]]:
+        """Возвращает (operator_ids, weights, cumulative) операторов, которые могут принять обращение"""
+        return self._eligible_state()[:3]
+
+    def pick(self, rng: random.Random = None) -> int:
+        """Выбирает оператора среди доступных стратегией таблицы (rng заменяет генератор случайных стратегий)"""
+        operator_ids, _, cumulative, state = self._eligible_state()
+        if not operator_ids:
+            return None
+        return self.strategy.pick(state, operator_ids, cumulative, self, rng)
+
+    def pick_and_reserve(self, rng: random.Random = None, db: Session = None) -> int:
+        """Выбирает оператора и атомарно резервирует за ним обращение в журнале нагрузки.
+
+        Если параллельный запрос успел заполнить выбранного оператора, выбор повторяется.
+        """
+        for _ in range(len(self.entries) + 1):
+            operator_id = self.pick(rng)
+            if operator_id is None:
+                return None
+            if self.ledger.try_reserve(operator_id, self.max_loads[operator_id], db):
+                return operator_id
+            self.reset_eligible()
+        return None
+
+    def try_reserve_operator(self, operator_id: int, db: Session = None) -> bool:
+        """Резервирует обращение за конкретным оператором, если он активен, обслуживает источник и не заполнен"""
+        return (
+            operator_id in self.active and self.ledger.get_load(operator_id) < self.max_loads[operator_id]
+            and self.ledger.try_reserve(operator_id, self.max_loads[operator_id], db)
+        )
+
+class RoutingTableCache:
+    """Кэш таблиц маршрутизации по source_id"""
+
+    def __init__(self, ledger: OperatorLoadLedger = None):
+        self.ledger = ledger or load_ledger
+        self._lock = threading.Lock()
+        self._tables: dict[int, RoutingTable] = {}
+        self._operator_sources: dict[int, set[int]] = {}
+        self._max_loads: dict[int, int] = {}
+        self._listeners = []
+        self.ledger.add_listener(self.on_load_changed)
+
+    def add_listener(self, listener) -> None:
+        """Подписывает listener() на сброс таблиц: изменились веса, оператор или его лимит"""
+        self._listeners.append(listener)
+
+    def _notify(self) -> None:
+        for listener in self._listeners:
+            listener()
+
+    def get_table(self, db: Session, source_id: int) -> RoutingTable:
+        table = self._tables.get(source_id)
+        if table is not None:
+            return table
+
+        rows = db.query(
+            OperatorSourceWeight.operator_id,
+            OperatorSourceWeight.weight,
+            Operator.max_load,
+            Operator.is_active
+        ).join(
+            Operator, OperatorSourceWeight.operator_id == Operator.id
+        ).filter(
+            OperatorSourceWeight.source_id == source_id
+        ).order_by(OperatorSourceWeight.operator_id).all()
+        strategy = db.query(Source.selection_strategy).filter(Source.id == source_id).scalar()
+
+        self.ledger.ensure_seeded(db)
+        table = RoutingTable(
+            source_id, [tuple(row) for row in rows], self.ledger,
+            create_strategy(strategy or settings.selection_strategy, source_id, settings.selection_seed)
+        )
+        with self._lock:
+            self._tables[source_id] = table
+            for operator_id, _, max_load, _ in table.entries:
+                self._operator_sources.setdefault(operator_id, set()).add(source_id)
+                self._max_loads[operator_id] = max_load
+        return table
+
+    def invalidate_source(self, source_id: int) -> None:
+        with self._lock:
+            self._tables.pop(source_id, None)
+        self._notify()
+
+    def invalidate_operator(self, operator_id: int) -> None:
+        with self._lock:
+            for source_id in self._operator_sources.pop(operator_id, set()):
+                self._tables.pop(source_id, None)
+            self._max_loads.pop(operator_id, None)
+        self._notify()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tables = {}
+            self._operator_sources = {}
+            self._max_loads = {}
+        self._notify()
+
+    def on_load_changed(self, operator_id, old_load, new_load) -> None:
+        """Сбрасывает доступных операторов, когда оператор заполняется или освобождается"""
+        if operator_id is None:
+            for table in list(self._tables.values()):
+                table.reset_eligible()
+            return
+
+        max_load = self._max_loads.get(operator_id)
+        if max_load is None or (old_load < max_load) == (new_load < max_load):
+            return
+        for source_id in list(self._operator_sources.get(operator_id, ())):
+            table = self._tables.get(source_id)
+            if table is not None:
+                table.reset_eligible()
+
+# Общий кэш таблиц маршрутизации процесса
+routing_cache = RoutingTableCache(load_ledger)
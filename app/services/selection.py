@@ -0,0 +1,147 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from heapq import heapify, heapreplace
+import inspect
+import random
+import threading
+
+# Стратегии выбора оператора среди доступных операторов таблицы маршрутизации источника.
+# Состояние стратегии (накопленные веса, куча) строится заново только при изменении состава
+# доступных операторов, поэтому сам выбор выполняется за O(log n).
+
+class SelectionStrategy(ABC):
+    """Интерфейс стратегии: prepare строит состояние по доступным операторам, pick выбирает оператора"""
+
+    name = None
+
+    def __init__(self, source_id: int = None, seed: int = None):
+        self.source_id = source_id
+        self.seed = seed
+
+    @abstractmethod
+    def prepare(self, operator_ids: list[int], weights: list[float], cumulative: list[float]):
+        """Состояние стратегии для текущего состава доступных операторов (None, если не нужно)"""
+
+    @abstractmethod
+    def pick(self, state, operator_ids: list[int], cumulative: list[float], table, rng: random.Random = None) -> int:
+        """Оператор из operator_ids; table - таблица маршрутизации (нагрузка и max_load) или None"""
+
+def _source_rng(seed: int, source_id: int) -> random.Random:
+    # Отдельная последовательность на источник: выбор в одном источнике не сдвигает другие
+    return random.Random(f"{seed}:{source_id}")
+
+def _weighted_index(cumulative: list[float], rng) -> int:
+    index = bisect_right(cumulative, rng.random() * cumulative[-1])
+    # Последний оператор - на случай погрешностей округления
+    return min(index, len(cumulative) - 1)
+
+class WeightedRandomStrategy(SelectionStrategy):
+    """Случайный выбор пропорционально весам: бинарный поиск по накопленным весам"""
+
+    name = "random"
+
+    def __init__(self, source_id: int = None, seed: int = None):
+        super().__init__(source_id, seed)
+        self.rng = random if seed is None else _source_rng(seed, source_id)
+
+    def prepare(self, operator_ids, weights, cumulative):
+        # Достаточно накопленных весов таблицы
+        return None
+
+    def pick(self, state, operator_ids, cumulative, table, rng=None):
+        return operator_ids[_weighted_index(cumulative, rng or self.rng)]
+
+class SeededRandomStrategy(WeightedRandomStrategy):
+    """Случайный выбор по весам с воспроизводимой последовательностью (seed и id источника)"""
+
+    name = "seeded"
+
+    def __init__(self, source_id: int = None, seed: int = None):
+        super().__init__(source_id, seed or 0)
+
+class SmoothWeightedStrategy(SelectionStrategy):
+    """Плавный взвешенный round-robin без случайности (stride scheduling).
+
+    У оператора есть "проход" (pass), который после выбора увеличивается на 1 / weight; выбирается
+    оператор с наименьшим проходом из кучи. Как и в smooth weighted round-robin nginx, операторы
+    чередуются, и на любом отрезке число выборов отличается от доли веса не больше чем на единицы.
+    Проходы сохраняются между перестроениями кучи, поэтому освободившийся оператор не получает пачку обращений.
+    """
+
+    name = "smooth"
+
+    def __init__(self, source_id: int = None, seed: int = None):
+        super().__init__(source_id, seed)
+        self._lock = threading.Lock()
+        self._passes: dict[int, float] = {}
+        self._clock = 0.0
+
+    def prepare(self, operator_ids, weights, cumulative):
+        with self._lock:
+            heap = []
+            for index, (operator_id, weight) in enumerate(zip(operator_ids, weights)):
+                stride = 1.0 / weight
+                current = self._passes.get(operator_id)
+                # Новый или долго недоступный оператор встает в очередь от текущего момента
+                if current is None or current < self._clock:
+                    current = self._clock + stride
+                heap.append((current, index, operator_id, stride))
+            heapify(heap)
+            return heap
+
+    def pick(self, state, operator_ids, cumulative, table, rng=None):
+        with self._lock:
+            current, index, operator_id, stride = state[0]
+            heapreplace(state, (current + stride, index, operator_id, stride))
+            self._clock = current
+            self._passes[operator_id] = current + stride
+            return operator_id
+
+class LeastLoadedStrategy(SelectionStrategy):
+    """Наименее загруженный из двух кандидатов, выбранных по весам (power of two choices).
+
+    Загрузка - доля нагрузки от max_load по журналу; случайные кандидаты делают выбор O(log n)
+    без сортировки операторов по нагрузке, которая меняется при каждом резерве.
+    """
+
+    name = "least_loaded"
+
+    def __init__(self, source_id: int = None, seed: int = None):
+        super().__init__(source_id, seed)
+        self.rng = random if seed is None else _source_rng(seed, source_id)
+
+    def prepare(self, operator_ids, weights, cumulative):
+        return None
+
+    def pick(self, state, operator_ids, cumulative, table, rng=None):
+        rng = rng or self.rng
+        first = operator_ids[_weighted_index(cumulative, rng)]
+        second = operator_ids[_weighted_index(cumulative, rng)]
+        # Без таблицы (список операторов без нагрузки) - обычный выбор по весам
+        if first == second or table is None:
+            return first
+        load = table.ledger.get_load
+        # Сравнение load / max_load без деления
+        if load(second) * table.max_loads[first] < load(first) * table.max_loads[second]:
+            return second
+        return first
+
+SELECTION_STRATEGIES = {
+    strategy.name: strategy
+    for strategy in (WeightedRandomStrategy, SeededRandomStrategy, SmoothWeightedStrategy, LeastLoadedStrategy)
+}
+
+def register_strategy(strategy: type) -> type:
+    """Добавляет стратегию выбора под ее именем (name); можно использовать как декоратор класса"""
+    # Стратегия без prepare или pick отклоняется сразу, а не при первом распределенном обращении
+    if inspect.isabstract(strategy):
+        missing = ", ".join(sorted(strategy.__abstractmethods__))
+        raise TypeError(f"Selection strategy {strategy.__name__} does not implement: {missing}")
+    SELECTION_STRATEGIES[strategy.name] = strategy
+    return strategy
+
+def create_strategy(name: str, source_id: int = None, seed: int = None) -> SelectionStrategy:
+    strategy = SELECTION_STRATEGIES.get(name)
+    if strategy is None:
+        raise ValueError(f"Unknown selection strategy: {name}; allowed: {', '.join(SELECTION_STRATEGIES)}")
+    return strategy(source_id, seed)
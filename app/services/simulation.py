@@ -0,0 +1,388 @@
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from ..models import Operator, OperatorSourceWeight, Source, Contact, ContactRollup
+from ..config import settings
+from .selection import SELECTION_STRATEGIES
+from .rollups import hour_bucket
+import datetime
+import time
+
+import numpy as np
+
+# Офлайн-симулятор распределения обращений для планирования емкости операторов.
+# Операторы, веса, стратегии источников и текущая нагрузка загружаются из БД в массивы NumPy;
+# поток обращений - записанный (почасовые агрегаты contact_rollups за период) или синтетический
+# (пуассоновский с заданной интенсивностью). Время моделируется шагами: на каждом шаге обращения
+# источников распределяются векторно той же логикой, что и в DistributionService (стратегия источника,
+# лимит max_load, обращения без оператора ждут перераспределения), а каждое необработанное обращение
+# обрабатывается с вероятностью по среднему времени обработки. NumPy нужен только симулятору,
+# приложение этот модуль не импортирует.
+
+class SimulationModel:
+    """Операторы и источники в массивах: индекс оператора - позиция в operator_ids"""
+
+    def __init__(self, operator_ids, max_loads, loads, source_ids, strategies, routes, backlog):
+        self.operator_ids = np.asarray(operator_ids, dtype=np.int64)
+        self.max_loads = np.asarray(max_loads, dtype=np.int64)
+        self.loads = np.asarray(loads, dtype=np.int64)
+        self.source_ids = np.asarray(source_ids, dtype=np.int64)
+        self.strategies = strategies
+        # routes[s] = (индексы активных операторов источника с весом > 0, их веса)
+        self.routes = routes
+        self.backlog = np.asarray(backlog, dtype=np.int64)
+
+    def source_index(self) -> dict[int, int]:
+        return {int(source_id): index for index, source_id in enumerate(self.source_ids)}
+
+    def operator_index(self) -> dict[int, int]:
+        return {int(operator_id): index for index, operator_id in enumerate(self.operator_ids)}
+
+    def set_max_load(self, operator_id: int, max_load: int) -> None:
+        self.max_loads[self.operator_index()[operator_id]] = max_load
+
+    def scale_max_loads(self, factor: float) -> None:
+        self.max_loads = np.maximum(np.rint(self.max_loads * factor).astype(np.int64), 0)
+
+    def set_weight(self, operator_id: int, source_id: int, weight: float) -> None:
+        """Меняет вес оператора в источнике (0 - убрать оператора из источника)"""
+        operator = self.operator_index()[operator_id]
+        source = self.source_index()[source_id]
+        indexes, weights = self.routes[source]
+        keep = indexes != operator
+        indexes, weights = indexes[keep], weights[keep]
+        if weight > 0:
+            indexes, weights = np.append(indexes, operator), np.append(weights, float(weight))
+        self.routes[source] = (indexes, weights)
+
+def load_model(db: Session) -> SimulationModel:
+    """Текущее состояние из БД: операторы, веса, стратегии источников, нагрузка и обращения без оператора"""
+    operators = db.execute(select(Operator.id, Operator.max_load, Operator.is_active).order_by(Operator.id)).all()
+    operator_index = {operator_id: index for index, (operator_id, _, _) in enumerate(operators)}
+    active = {operator_id for operator_id, _, is_active in operators if is_active}
+
+    loads = np.zeros(len(operators), dtype=np.int64)
+    for operator_id, load in db.execute(
+        select(Contact.operator_id, func.count(Contact.id))
+        .where(Contact.operator_id.isnot(None), Contact.is_processed == False)
+        .group_by(Contact.operator_id)
+    ):
+        if operator_id in operator_index:
+            loads[operator_index[operator_id]] = load
+
+    sources = db.execute(select(Source.id, Source.selection_strategy).order_by(Source.id)).all()
+    source_index = {source_id: index for index, (source_id, _) in enumerate(sources)}
+    routes = [([], []) for _ in sources]
+    for operator_id, source_id, weight in db.execute(
+        select(OperatorSourceWeight.operator_id, OperatorSourceWeight.source_id, OperatorSourceWeight.weight)
+    ):
+        if operator_id in active and source_id in source_index and weight and weight > 0:
+            indexes, weights = routes[source_index[source_id]]
+            indexes.append(operator_index[operator_id])
+            weights.append(weight)
+
+    backlog = np.zeros(len(sources), dtype=np.int64)
+    for source_id, count in db.execute(
+        select(Contact.source_id, func.count(Contact.id))
+        .where(Contact.operator_id.is_(None), Contact.is_processed == False)
+        .group_by(Contact.source_id)
+    ):
+        if source_id in source_index:
+            backlog[source_index[source_id]] = count
+
+    return SimulationModel(
+        [operator_id for operator_id, _, _ in operators],
+        [max_load or 0 for _, max_load, _ in operators],
+        loads,
+        [source_id for source_id, _ in sources],
+        [strategy or settings.selection_strategy for _, strategy in sources],
+        [(np.asarray(indexes, dtype=np.int64), np.asarray(weights, dtype=np.float64)) for indexes, weights in routes],
+        backlog
+    )
+
+def recorded_arrivals(db: Session, model: SimulationModel, start: datetime.datetime, end: datetime.datetime,
+                      tick_minutes: float, rng: np.random.Generator) -> np.ndarray:
+    """Обращения по шагам (ticks x источники) из почасовых агрегатов за [start, end).
+
+    Внутри часа обращения равномерно случайно распределяются по шагам этого часа.
+    """
+    start = hour_bucket(start)
+    ticks_per_hour = max(int(round(60 / tick_minutes)), 1)
+    hours = max(int(np.ceil((end - start).total_seconds() / 3600)), 1)
+    source_index = model.source_index()
+    arrivals = np.zeros((hours * ticks_per_hour, len(model.source_ids)), dtype=np.int64)
+    for bucket, source_id, contacts in db.execute(
+        select(ContactRollup.bucket, ContactRollup.source_id, func.sum(ContactRollup.contacts))
+        .where(ContactRollup.bucket >= start, ContactRollup.bucket < end)
+        .group_by(ContactRollup.bucket, ContactRollup.source_id)
+    ):
+        if source_id not in source_index or not contacts or contacts <= 0:
+            continue
+        hour = int((bucket - start).total_seconds() // 3600)
+        first = hour * ticks_per_hour
+        arrivals[first:first + ticks_per_hour, source_index[source_id]] += rng.multinomial(
+            contacts, np.full(ticks_per_hour, 1 / ticks_per_hour)
+        )
+    return arrivals
+
+def synthetic_arrivals(model: SimulationModel, rate_per_hour: float, hours: float, tick_minutes: float,
+                       rng: np.random.Generator, shares: np.ndarray = None) -> np.ndarray:
+    """Пуассоновский поток rate_per_hour обращений в час, разделенный по источникам в долях shares"""
+    ticks = max(int(round(hours * 60 / tick_minutes)), 1)
+    if shares is None or not shares.sum():
+        shares = np.ones(len(model.source_ids))
+    shares = shares / shares.sum()
+    return rng.poisson(rate_per_hour * tick_minutes / 60 * shares, size=(ticks, len(model.source_ids)))
+
+def source_shares(db: Session, model: SimulationModel) -> np.ndarray:
+    """Доли источников в записанных обращениях (для синтетического потока)"""
+    source_index = model.source_index()
+    shares = np.zeros(len(model.source_ids))
+    for source_id, contacts in db.execute(
+        select(ContactRollup.source_id, func.sum(ContactRollup.contacts)).group_by(ContactRollup.source_id)
+    ):
+        if source_id in source_index and contacts:
+            shares[source_index[source_id]] = max(contacts, 0)
+    return shares
+
+class _Allocator:
+    """Векторный аналог стратегий SELECTION_STRATEGIES: распределяет count обращений между доступными операторами"""
+
+    def __init__(self, strategy: str, size: int, rng: np.random.Generator):
+        if strategy not in SELECTION_STRATEGIES:
+            raise ValueError(f"Unknown selection strategy: {strategy}")
+        self.strategy = strategy
+        self.rng = rng
+        # Накопленная недоданная доля операторов для smooth (аналог проходов stride scheduling)
+        self.credit = np.zeros(size)
+
+    def allocate(self, count: int, eligible: np.ndarray, weights: np.ndarray, loads: np.ndarray,
+                 max_loads: np.ndarray) -> np.ndarray:
+        probabilities = weights / weights.sum()
+        if self.strategy == "smooth":
+            credit = self.credit[eligible] + count * probabilities
+            counts = np.floor(credit).astype(np.int64)
+            remainder = count - counts.sum()
+            if remainder > 0:
+                counts[np.argsort(counts - credit, kind="stable")[:remainder]] += 1
+            self.credit[eligible] = credit - counts
+            return counts
+        if self.strategy == "least_loaded":
+            # Два кандидата по весам на обращение, выбирается меньшая доля load / max_load на начало шага
+            first = self.rng.choice(len(weights), size=count, p=probabilities)
+            second = self.rng.choice(len(weights), size=count, p=probabilities)
+            ratio = loads / max_loads
+            chosen = np.where(ratio[second] < ratio[first], second, first)
+            return np.bincount(chosen, minlength=len(weights))
+        # random и seeded: count независимых выборов пропорционально весам
+        return self.rng.multinomial(count, probabilities)
+
+def _assign(allocator: _Allocator, count: int, indexes: np.ndarray, weights: np.ndarray,
+            loads: np.ndarray, max_loads: np.ndarray) -> int:
+    """Назначает до count обращений операторам источника с учетом max_load; возвращает число назначенных.
+
+    Обращения, выбравшие заполнившегося оператора, распределяются повторно среди оставшихся - как
+    повторный выбор в RoutingTable.pick_and_reserve.
+    """
+    assigned = 0
+    while count > 0:
+        free = max_loads[indexes] - loads[indexes]
+        mask = free > 0
+        if not mask.any():
+            break
+        eligible = indexes[mask]
+        wanted = allocator.allocate(count, mask.nonzero()[0], weights[mask], loads[eligible], max_loads[eligible])
+        taken = np.minimum(wanted, free[mask])
+        loads[eligible] += taken
+        got = int(taken.sum())
+        assigned += got
+        count -= got
+        if got == wanted.sum():
+            break
+    return assigned
+
+def simulate(model: SimulationModel, arrivals: np.ndarray, tick_minutes: float = 1.0, handle_minutes: float = 60.0,
+             redistribute: bool = True, curve_every: int = 60, seed: int = None) -> dict:
+    """Прогоняет поток обращений (ticks x источники) через модель; нагрузка модели не меняется.
+
+    handle_minutes - среднее время обработки обращения (0 - обращения не обрабатываются).
+    Кривые нагрузки операторов сохраняются каждые curve_every шагов.
+    """
+    rng = np.random.default_rng(seed)
+    loads = model.loads.copy()
+    max_loads = model.max_loads
+    backlog = model.backlog.copy()
+    allocators = [
+        _Allocator(strategy, len(indexes), rng) for strategy, (indexes, _) in zip(model.strategies, model.routes)
+    ]
+    done_probability = 1 - np.exp(-tick_minutes / handle_minutes) if handle_minutes > 0 else 0.0
+    active = np.zeros(len(loads), dtype=bool)
+    for indexes, _ in model.routes:
+        active[indexes] = True
+    capacity = max(int(max_loads[active].sum()), 1)
+
+    ticks = len(arrivals)
+    utilization = np.zeros(ticks)
+    backlog_curve = np.zeros(ticks, dtype=np.int64)
+    full_ticks = np.zeros(len(loads), dtype=np.int64)
+    utilization_sum = np.zeros(len(loads))
+    curve_ticks, curves = [], []
+    assigned_on_arrival = 0
+    redistributed = 0
+    processed = 0
+
+    started = time.perf_counter()
+    for tick in range(ticks):
+        if done_probability:
+            done = rng.binomial(loads, done_probability)
+            loads -= done
+            processed += int(done.sum())
+        for source, (indexes, weights) in enumerate(model.routes):
+            count = int(arrivals[tick, source])
+            if not len(indexes):
+                backlog[source] += count
+                continue
+            if count:
+                got = _assign(allocators[source], count, indexes, weights, loads, max_loads)
+                assigned_on_arrival += got
+                backlog[source] += count - got
+            # Фоновое перераспределение: обращения без оператора получают освободившиеся места
+            if redistribute and backlog[source]:
+                got = _assign(allocators[source], int(backlog[source]), indexes, weights, loads, max_loads)
+                redistributed += got
+                backlog[source] -= got
+        utilization[tick] = loads[active].sum() / capacity
+        backlog_curve[tick] = backlog.sum()
+        full_ticks += loads >= max_loads
+        utilization_sum += np.divide(loads, max_loads, out=np.ones(len(loads)), where=max_loads > 0)
+        if tick % curve_every == 0 or tick == ticks - 1:
+            curve_ticks.append(tick)
+            curves.append(loads.copy())
+    elapsed = time.perf_counter() - started
+
+    events = int(arrivals.sum())
+    return {
+        "events": events,
+        "ticks": ticks,
+        "elapsed": elapsed,
+        "assigned_on_arrival": assigned_on_arrival,
+        "unassigned_rate": 1 - assigned_on_arrival / events if events else 0.0,
+        "redistributed": redistributed,
+        "processed": processed,
+        "backlog_peak": int(backlog_curve.max()) if ticks else 0,
+        "backlog_final": int(backlog.sum()),
+        "utilization": utilization,
+        "backlog": backlog_curve,
+        "operator_utilization": utilization_sum / max(ticks, 1),
+        "operator_full_share": full_ticks / max(ticks, 1),
+        "curve_ticks": np.asarray(curve_ticks),
+        "curves": np.asarray(curves),
+        "final_loads": loads,
+    }
+
+def write_curves(path: str, model: SimulationModel, result: dict, tick_minutes: float) -> None:
+    """Кривые нагрузки операторов: .npz (массивы) или .csv (minute, operator_id, load, max_load)"""
+    minutes = result["curve_ticks"] * tick_minutes
+    if path.endswith(".npz"):
+        np.savez_compressed(
+            path, minutes=minutes, operator_ids=model.operator_ids, max_loads=model.max_loads,
+            loads=result["curves"], utilization=result["utilization"], backlog=result["backlog"]
+        )
+        return
+    with open(path, "w") as output:
+        output.write("minute,operator_id,load,max_load\n")
+        for minute, loads in zip(minutes, result["curves"]):
+            for operator_id, load, max_load in zip(model.operator_ids, loads, model.max_loads):
+                output.write(f"{minute:g},{operator_id},{load},{max_load}\n")
+
+def print_report(model: SimulationModel, result: dict, top: int = 10) -> None:
+    utilization = result["utilization"]
+    print(
+        f"Simulated {result['events']} contacts over {result['ticks']} ticks in {result['elapsed']:.2f}s "
+        f"({result['events'] / max(result['elapsed'], 1e-9):.0f} contacts/s)"
+    )
+    print(f"Unassigned on arrival: {result['unassigned_rate']:.2%}; redistributed later: {result['redistributed']}")
+    print(f"Backlog without operator: peak {result['backlog_peak']}, final {result['backlog_final']}")
+    if len(utilization):
+        print(
+            f"Utilization (load / max_load of active operators): mean {utilization.mean():.1%}, "
+            f"p95 {np.percentile(utilization, 95):.1%}, peak {utilization.max():.1%}"
+        )
+    if top <= 0:
+        return
+    order = np.argsort(-result["operator_full_share"], kind="stable")[:top]
+    print(f"{'operator':>10}{'max_load':>10}{'mean util':>11}{'time full':>11}{'final load':>12}")
+    for index in order:
+        print(
+            f"{model.operator_ids[index]:>10}{model.max_loads[index]:>10}{result['operator_utilization'][index]:>11.1%}"
+            f"{result['operator_full_share'][index]:>11.1%}{result['final_loads'][index]:>12}"
+        )
+
+def _assignment(value: str) -> tuple[str, str]:
+    key, _, number = value.partition("=")
+    if not number:
+        raise ValueError(f"Expected KEY=VALUE: {value}")
+    return key, number
+
+if __name__ == "__main__":
+    import argparse
+    from ..database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Симуляция распределения обращений по текущим операторам и весам")
+    parser.add_argument("--from", dest="start", type=datetime.datetime.fromisoformat, help="начало записанного потока")
+    parser.add_argument("--to", dest="end", type=datetime.datetime.fromisoformat, help="конец записанного потока")
+    parser.add_argument("--rate", type=float, help="синтетический поток: обращений в час")
+    parser.add_argument("--hours", type=float, default=24, help="длительность синтетического потока")
+    parser.add_argument("--speedup", type=float, default=1.0, help="множитель записанного потока")
+    parser.add_argument("--tick", type=float, default=1.0, help="шаг моделирования, минут")
+    parser.add_argument("--handle-time", type=float, default=60.0, help="среднее время обработки обращения, минут")
+    parser.add_argument("--no-redistribute", action="store_true", help="без фонового перераспределения")
+    parser.add_argument("--max-load-scale", type=float, help="умножить max_load всех операторов")
+    parser.add_argument("--max-load", action="append", default=[], type=_assignment, metavar="OPERATOR=MAX_LOAD")
+    parser.add_argument("--weight", action="append", default=[], type=_assignment, metavar="OPERATOR:SOURCE=WEIGHT")
+    parser.add_argument("--strategy", choices=list(SELECTION_STRATEGIES), help="стратегия для всех источников")
+    parser.add_argument("--curve-every", type=int, default=60, help="шагов между точками кривых нагрузки")
+    parser.add_argument("--curves", help="файл кривых нагрузки операторов (.csv или .npz)")
+    parser.add_argument("--top", type=int, default=10, help="операторов в отчете")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    loading = time.perf_counter()
+    db = SessionLocal()
+    try:
+        model = load_model(db)
+        if args.rate is not None:
+            arrivals = synthetic_arrivals(model, args.rate, args.hours, args.tick, rng, source_shares(db, model))
+        else:
+            end = args.end or datetime.datetime.utcnow()
+            start = args.start or end - datetime.timedelta(days=1)
+            arrivals = recorded_arrivals(db, model, start, end, args.tick, rng)
+    finally:
+        db.close()
+    if args.speedup < 1:
+        arrivals = rng.binomial(arrivals, args.speedup)
+    elif args.speedup > 1:
+        arrivals = rng.poisson(arrivals * args.speedup)
+
+    if args.max_load_scale is not None:
+        model.scale_max_loads(args.max_load_scale)
+    for operator_id, max_load in args.max_load:
+        model.set_max_load(int(operator_id), int(max_load))
+    for key, weight in args.weight:
+        operator_id, _, source_id = key.partition(":")
+        model.set_weight(int(operator_id), int(source_id), float(weight))
+    if args.strategy:
+        model.strategies = [args.strategy] * len(model.source_ids)
+    print(
+        f"Loaded {len(model.operator_ids)} operators, {len(model.source_ids)} sources, "
+        f"{int(arrivals.sum())} contacts in {time.perf_counter() - loading:.2f}s"
+    )
+
+    result = simulate(
+        model, arrivals, tick_minutes=args.tick, handle_minutes=args.handle_time,
+        redistribute=not args.no_redistribute, curve_every=args.curve_every, seed=args.seed
+    )
+    print_report(model, result, args.top)
+    if args.curves:
+        write_curves(args.curves, model, result, args.tick)
+        print(f"Load curves written to {args.curves}")
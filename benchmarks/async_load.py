@@ -0,0 +1,128 @@
+"""Нагрузочный тест: синхронный и асинхронный (CRM_ASYNC_DB_ENABLED) слой БД под сотнями клиентов.
+
+Для каждого режима запускается отдельный сервер uvicorn на временной базе, затем --clients
+одновременных клиентов отправляют смесь запросов: регистрацию обращений и чтение списков.
+Нужен httpx (он же используется TestClient).
+
+Запуск: python -m benchmarks.async_load --clients 500 --requests 10000
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await client.get("/operators/")
+            return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+async def seed(client: httpx.AsyncClient, operators: int, sources: int, max_load: int) -> None:
+    for i in range(operators):
+        await client.post("/operators/", json={"name": f"Operator {i}", "max_load": max_load})
+    for i in range(sources):
+        await client.post("/sources/", json={"name": f"Source {i}"})
+    for operator_id in range(1, operators + 1):
+        for source_id in range(1, sources + 1):
+            await client.post(
+                f"/operators/{operator_id}/sources/{source_id}/weight",
+                params={"weight": random.uniform(0.5, 3)}
+            )
+
+async def run_load(base_url: str, args) -> dict:
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await wait_ready(client)
+        await seed(client, args.operators, args.sources, args.requests)
+
+        latencies = []
+        errors = 0
+        counter = iter(range(args.requests))
+
+        async def worker() -> None:
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                if random.random() < args.write_ratio:
+                    response = await client.post("/contacts/register/", json={
+                        "phone": f"+7 900 {random.randrange(args.requests):07d}",
+                        "source_id": random.randint(1, args.sources),
+                        "message": f"Message {i}"
+                    })
+                else:
+                    response = await client.get(random.choice(["/operators/", "/sources/", "/contacts/?limit=20"]))
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.clients)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": args.requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+    }
+
+def run_mode(async_db: bool, args) -> dict:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            CRM_DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'load.db')}",
+            CRM_ASYNC_DB_ENABLED=str(async_db).lower(),
+            CRM_INGEST_ENABLED="false",
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--log-level", "warning", "--backlog", str(max(2048, args.clients * 2))],
+            env=env, cwd=ROOT
+        )
+        try:
+            return asyncio.run(run_load(f"http://127.0.0.1:{port}", args))
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--write-ratio", type=float, default=0.3, help="доля запросов регистрации обращений")
+    parser.add_argument("--operators", type=int, default=20)
+    parser.add_argument("--sources", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"clients: {args.clients}, requests: {args.requests}, write ratio: {args.write_ratio}")
+    print(f"{'mode':<8}{'rps':>9}{'p50, ms':>10}{'p95, ms':>10}{'p99, ms':>10}{'errors':>8}")
+    for name, async_db in (("sync", False), ("async", True)):
+        result = run_mode(async_db, args)
+        print(f"{name:<8}{result['rps']:>9.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}{result['errors']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Сравнение двух JSON-результатов benchmarks.suite.
+
+Запуск: python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import json
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "rps", "contacts_per_second")
+# Для этих метрик больше - лучше
+HIGHER_IS_BETTER = {"rps", "contacts_per_second"}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="изменение в процентах, которое отмечается")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"before: {before['meta'].get('revision')}  after: {after['meta'].get('revision')}")
+    print(f"{'scenario':<32}{'metric':<22}{'before':>12}{'after':>12}{'change':>10}")
+    for scenario, old in before["results"].items():
+        new = after["results"].get(scenario)
+        if not new:
+            continue
+        for metric in METRICS:
+            if metric not in old or metric not in new or not old[metric]:
+                continue
+            change = (new[metric] - old[metric]) / old[metric] * 100
+            worse = change < 0 if metric in HIGHER_IS_BETTER else change > 0
+            mark = ("  worse" if worse else "  better") if abs(change) >= args.threshold else ""
+            print(f"{scenario:<32}{metric:<22}{old[metric]:>12.2f}{new[metric]:>12.2f}{change:>+9.1f}%{mark}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Стресс-тест параллельной регистрации обращений.
+
+Много потоков одновременно регистрируют обращения с повторяющимися external_id и телефонами
+при суммарной емкости операторов меньше числа обращений. Проверяется, что ни один оператор
+не превысил max_load и что для одного ключа идентификации не создано несколько лидов.
+
+Запуск: python -m benchmarks.concurrency_stress --registrations 5000 --threads 64
+"""
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+from app.database import Base, create_db_engine
+from app.models import Operator, Source, Lead, Contact, OperatorSourceWeight
+from app.schemas import ContactRegistration
+from app.services import DistributionService, OperatorLoadLedger, RoutingTableCache, LeadIdentityResolver
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--registrations", type=int, default=3000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--operators", type=int, default=20)
+    parser.add_argument("--max-load", type=int, default=50)
+    parser.add_argument("--sources", type=int, default=3)
+    parser.add_argument("--distinct-leads", type=int, default=300)
+    parser.add_argument("--batch-ratio", type=float, default=0.2, help="доля обращений, отправляемых пакетами")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Движок с настройками приложения (PRAGMA, явный BEGIN), чтобы проверялись и его транзакции
+        engine = create_db_engine(
+            database_url=f"sqlite:///{os.path.join(tmp, 'stress.db')}",
+            archive_database_path=None,
+            sqlite_busy_timeout=60000,
+            db_pool_size=args.threads,
+            db_max_overflow=0
+        )
+        Base.metadata.create_all(engine)
+        Session = sessionmaker(bind=engine, autoflush=False)
+
+        with Session() as db:
+            db.add_all([Operator(name=f"Operator {i}", max_load=args.max_load) for i in range(args.operators)])
+            db.add_all([Source(name=f"Source {i}") for i in range(args.sources)])
+            db.flush()
+            db.add_all([
+                OperatorSourceWeight(operator_id=operator_id, source_id=source_id, weight=random.uniform(0.5, 3))
+                for operator_id in range(1, args.operators + 1)
+                for source_id in range(1, args.sources + 1)
+            ])
+            db.commit()
+
+        ledger = OperatorLoadLedger()
+        routing = RoutingTableCache(ledger)
+        identity = LeadIdentityResolver()
+        errors = []
+        errors_lock = threading.Lock()
+
+        def registration(i: int) -> ContactRegistration:
+            lead = random.randrange(args.distinct_leads)
+            return ContactRegistration(
+                external_id=f"ext-{lead}" if lead % 2 else None,
+                phone=f"+7 900 {lead:07d}",
+                source_id=random.randint(1, args.sources),
+                message=f"Message {i}"
+            )
+
+        def worker(i: int) -> None:
+            db = Session()
+            try:
+                service = DistributionService(db, ledger=ledger, routing=routing, identity=identity)
+                if random.random() < args.batch_ratio:
+                    service.register_contacts([registration(i) for _ in range(5)])
+                else:
+                    service.register_contact(registration(i))
+            except Exception as e:
+                with errors_lock:
+                    errors.append(repr(e))
+            finally:
+                db.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            list(executor.map(worker, range(args.registrations)))
+        elapsed = time.perf_counter() - started
+
+        with Session() as db:
+            overloaded = db.execute(
+                select(Contact.operator_id, func.count(Contact.id))
+                .where(Contact.operator_id.isnot(None), Contact.is_processed == False)
+                .group_by(Contact.operator_id)
+                .having(func.count(Contact.id) > args.max_load)
+            ).all()
+            duplicate_external_ids = db.execute(
+                select(Lead.external_id).where(Lead.external_id.isnot(None))
+                .group_by(Lead.external_id).having(func.count(Lead.id) > 1)
+            ).all()
+            duplicate_phones = db.execute(
+                select(Lead.phone).group_by(Lead.phone).having(func.count(Lead.id) > 1)
+            ).all()
+            total_contacts = db.scalar(select(func.count(Contact.id)))
+            assigned = db.scalar(select(func.count(Contact.id)).where(Contact.operator_id.isnot(None)))
+            total_leads = db.scalar(select(func.count(Lead.id)))
+            drift = ledger.reconcile(db)
+        engine.dispose()
+
+    print(f"Requests: {args.registrations} in {elapsed:.2f}s ({args.registrations / elapsed:.0f}/s), threads: {args.threads}")
+    print(f"Contacts: {total_contacts}, assigned: {assigned}, capacity: {args.operators * args.max_load}")
+    print(f"Leads: {total_leads} (distinct keys: {args.distinct_leads})")
+    print(f"Errors: {len(errors)}" + (f", first: {errors[0]}" if errors else ""))
+
+    failures = []
+    if overloaded:
+        failures.append(f"operators over max_load: {overloaded}")
+    if duplicate_external_ids or duplicate_phones:
+        failures.append(f"duplicate leads: {duplicate_external_ids + duplicate_phones}")
+    if drift:
+        failures.append(f"load ledger drift: {drift}")
+    if assigned != min(total_contacts, args.operators * args.max_load):
+        failures.append(f"capacity left unused: {assigned} assigned")
+    for failure in failures:
+        print("FAIL: " + failure)
+    if not failures:
+        print("OK")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Планы и время горячих запросов к обращениям до и после миграции индексов.
+
+Запуск: python -m benchmarks.index_plans --contacts 200000
+"""
+from sqlalchemy import create_engine, insert, text
+from app.database import Base
+from app.migrations import run_migrations
+from app.models import Operator, Source, Lead, Contact, OperatorSourceWeight
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+QUERIES = {
+    "load_ledger_seed": (
+        "SELECT contacts.operator_id, count(contacts.id) FROM contacts "
+        "WHERE contacts.operator_id IS NOT NULL AND contacts.is_processed = 0 "
+        "GROUP BY contacts.operator_id",
+        {}
+    ),
+    "operator_unprocessed_count": (
+        "SELECT count(*) FROM contacts WHERE contacts.operator_id = :operator_id AND contacts.is_processed = 0",
+        {"operator_id": 7}
+    ),
+    "operator_load_stats": (
+        "SELECT operators.id, coalesce(anon_1.load, 0) FROM operators LEFT OUTER JOIN ("
+        "SELECT contacts.operator_id AS operator_id, count(contacts.id) AS load FROM contacts "
+        "WHERE contacts.is_processed = 0 GROUP BY contacts.operator_id) AS anon_1 "
+        "ON anon_1.operator_id = operators.id",
+        {}
+    ),
+    "contacts_by_operator": (
+        "SELECT contacts.id FROM contacts WHERE contacts.operator_id = :operator_id",
+        {"operator_id": 7}
+    ),
+    "contacts_by_source": (
+        "SELECT contacts.id FROM contacts WHERE contacts.source_id = :source_id "
+        "ORDER BY contacts.created_at LIMIT 100",
+        {"source_id": 3}
+    ),
+    "contacts_by_lead": (
+        "SELECT contacts.id FROM contacts WHERE contacts.lead_id = :lead_id",
+        {"lead_id": 42}
+    ),
+    "unprocessed_contacts": (
+        "SELECT contacts.id FROM contacts WHERE contacts.is_processed = 0 "
+        "ORDER BY contacts.created_at, contacts.id LIMIT 100",
+        {}
+    ),
+    "operator_source_weight": (
+        "SELECT operator_source_weights.id FROM operator_source_weights "
+        "WHERE operator_source_weights.operator_id = :operator_id AND operator_source_weights.source_id = :source_id",
+        {"operator_id": 7, "source_id": 3}
+    ),
+    "source_routing_table": (
+        "SELECT operator_source_weights.operator_id, operator_source_weights.weight FROM operator_source_weights "
+        "WHERE operator_source_weights.source_id = :source_id",
+        {"source_id": 3}
+    ),
+}
+
+def seed(engine, operators: int, sources: int, leads: int, contacts: int, processed_ratio: float) -> None:
+    rng = random.Random(42)
+    now = datetime.datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(Operator), [
+            {"name": f"Operator {i}", "is_active": True, "max_load": 50} for i in range(1, operators + 1)
+        ])
+        conn.execute(insert(Source), [{"name": f"Source {i}"} for i in range(1, sources + 1)])
+        conn.execute(insert(OperatorSourceWeight), [
+            {"operator_id": operator_id, "source_id": source_id, "weight": rng.uniform(0.5, 5)}
+            for operator_id in range(1, operators + 1)
+            for source_id in range(1, sources + 1)
+            if rng.random() < 0.3
+        ])
+        conn.execute(insert(Lead), [
+            {"external_id": f"ext-{i}", "phone": f"+7900{i:07d}", "created_at": now} for i in range(1, leads + 1)
+        ])
+        chunk = 50000
+        for start in range(0, contacts, chunk):
+            conn.execute(insert(Contact), [
+                {
+                    "lead_id": rng.randint(1, leads),
+                    "source_id": rng.randint(1, sources),
+                    "operator_id": rng.randint(1, operators),
+                    "created_at": now - datetime.timedelta(seconds=contacts - i),
+                    "is_processed": rng.random() < processed_ratio,
+                }
+                for i in range(start, min(start + chunk, contacts))
+            ])
+
+def measure(engine, repeat: int) -> dict:
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, params) in QUERIES.items():
+            plan = [row[-1] for row in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params)]
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = {"plan": plan, "median_ms": statistics.median(timings)}
+    return results
+
+def drop_migrated_indexes(engine) -> None:
+    """Приводит только что созданную схему к состоянию до миграций"""
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name.startswith("ux_") or index.name in {
+                    "ix_contacts_lead_id",
+                    "ix_contacts_operator_unprocessed",
+                    "ix_contacts_operator_created",
+                    "ix_contacts_source_created",
+                    "ix_contacts_unprocessed_created",
+                    "ix_operator_source_weights_source_id",
+                }:
+                    conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--operators", type=int, default=500)
+    parser.add_argument("--sources", type=int, default=50)
+    parser.add_argument("--leads", type=int, default=50000)
+    parser.add_argument("--contacts", type=int, default=200000)
+    parser.add_argument("--processed-ratio", type=float, default=0.9)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", dest="json_path", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        drop_migrated_indexes(engine)
+        seed(engine, args.operators, args.sources, args.leads, args.contacts, args.processed_ratio)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+
+        before = measure(engine, args.repeat)
+        applied = run_migrations(engine)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        after = measure(engine, args.repeat)
+        engine.dispose()
+
+    print(f"Applied migrations: {applied}")
+    for name in QUERIES:
+        print(f"\n{name}: {before[name]['median_ms']:.3f} ms -> {after[name]['median_ms']:.3f} ms")
+        print("  before: " + " | ".join(before[name]["plan"]))
+        print("  after:  " + " | ".join(after[name]["plan"]))
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "before": before, "after": after}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Пропускная способность POST /contacts/register/ при разных режимах журнала SQLite.
+
+Каждый режим запускается в отдельном процессе: настройки движка читаются из переменных окружения
+CRM_* при импорте приложения. Запросы отправляются параллельно из нескольких потоков.
+
+Запуск: python -m benchmarks.journal_modes --requests 2000 --threads 16
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (journal_mode, synchronous); delete/full - поведение SQLite по умолчанию
+MODES = [
+    ("delete", "full"),
+    ("delete", "normal"),
+    ("wal", "full"),
+    ("wal", "normal"),
+]
+
+def run_mode(args) -> dict:
+    """Выполняет замер в текущем процессе; движок уже настроен через окружение"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    latencies = []
+    errors = []
+    with TestClient(app) as client:
+        for i in range(args.operators):
+            client.post("/operators/", json={"name": f"Operator {i}", "max_load": args.requests})
+        client.post("/sources/", json={"name": "Benchmark"})
+        for operator_id in range(1, args.operators + 1):
+            client.post(f"/operators/{operator_id}/sources/1/weight", params={"weight": operator_id})
+
+        def register(i: int) -> None:
+            started = time.perf_counter()
+            response = client.post("/contacts/register/", json={
+                "phone": f"+7 900 {i:07d}",
+                "source_id": 1,
+                "message": f"Message {i}"
+            })
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            list(executor.map(register, range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": args.requests,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "rps": round(args.requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--operators", type=int, default=10)
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args)))
+        return
+
+    print(f"{'journal_mode':<13}{'synchronous':<13}{'rps':>9}{'p50, ms':>10}{'p95, ms':>10}{'errors':>8}")
+    for journal_mode, synchronous in MODES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(
+                os.environ,
+                CRM_DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                CRM_SQLITE_JOURNAL_MODE=journal_mode,
+                CRM_SQLITE_SYNCHRONOUS=synchronous,
+                CRM_INGEST_ENABLED="false",
+            )
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmarks.journal_modes", "--run-mode", f"{journal_mode}:{synchronous}",
+                 "--requests", str(args.requests), "--threads", str(args.threads),
+                 "--operators", str(args.operators)],
+                env=env, cwd=ROOT, capture_output=True, text=True
+            )
+        if process.returncode != 0:
+            sys.exit(process.stderr)
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        print(f"{journal_mode:<13}{synchronous:<13}{result['rps']:>9}{result['p50_ms']:>10}"
+              f"{result['p95_ms']:>10}{result['errors']:>8}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Проверка лимитов операторов при нескольких процессах приложения.
+
+Для каждого хранилища нагрузки (CRM_CAPACITY_BACKEND) запускается uvicorn с несколькими воркерами
+на общей базе SQLite; параллельные клиенты регистрируют обращений больше суммарной емкости операторов
+и отмечают часть из них обработанными. Во время нагрузки и после нее проверяется, что число
+необработанных обращений ни одного оператора не превышало max_load.
+
+Хранилище memory учитывает нагрузку только внутри процесса, поэтому при нескольких воркерах
+превышения ожидаемы; для database и network (локальная замена Redis через manager://) их быть не должно.
+
+Запуск: python -m benchmarks.multiprocess_capacity --workers 4 --registrations 3000
+"""
+from sqlalchemy import create_engine, func, select, text
+from . import seed as seed_module
+from .async_load import free_port, wait_ready
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def max_overload(engine, max_load: int) -> int:
+    """Наибольшее превышение max_load среди операторов (0 - лимиты соблюдены)"""
+    with engine.connect() as conn:
+        peak = conn.scalar(text(
+            "SELECT MAX(load) FROM (SELECT COUNT(*) AS load FROM contacts "
+            "WHERE operator_id IS NOT NULL AND is_processed = 0 GROUP BY operator_id)"
+        ))
+    return max((peak or 0) - max_load, 0)
+
+async def run_load(base_url: str, engine, args) -> dict:
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await wait_ready(client)
+        contact_ids = []
+        errors = 0
+        counter = iter(range(args.registrations))
+        done = asyncio.Event()
+        peak_overload = 0
+
+        async def worker() -> None:
+            nonlocal errors
+            for i in counter:
+                if contact_ids and rng.random() < args.process_ratio:
+                    ids = rng.sample(contact_ids, min(len(contact_ids), args.process_batch))
+                    response = await client.post("/contacts/processed", json={"ids": ids})
+                else:
+                    response = await client.post("/contacts/register/", json={
+                        "phone": f"+7 900 {rng.randrange(args.registrations):07d}",
+                        "source_id": rng.randint(1, args.sources),
+                        "message": f"Message {i}"
+                    })
+                    if response.status_code == 200:
+                        contact_ids.append(response.json()["id"])
+                if response.status_code != 200:
+                    errors += 1
+
+        async def sampler() -> None:
+            # Лимиты проверяются и во время нагрузки: обработка обращений могла бы скрыть превышение к концу
+            nonlocal peak_overload
+            while not done.is_set():
+                overload = await asyncio.to_thread(max_overload, engine, args.max_load)
+                peak_overload = max(peak_overload, overload)
+                await asyncio.sleep(args.sample_interval)
+
+        sampling = asyncio.create_task(sampler())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.clients)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampling
+
+    return {"elapsed": elapsed, "errors": errors, "peak_overload": peak_overload}
+
+def run_backend(backend: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        url = f"sqlite:///{os.path.join(tmp, 'capacity.db')}"
+        engine = create_engine(url)
+        seed_module.seed_database(
+            engine, sources=args.sources, operators=args.operators, weight_density=1.0,
+            leads=0, contacts=0, max_load=args.max_load, seed=args.seed
+        )
+
+        env = dict(
+            os.environ, CRM_DATABASE_URL=url, CRM_CAPACITY_BACKEND=backend, CRM_INGEST_ENABLED="false",
+            CRM_METRICS_ENABLED="false"
+        )
+        manager = None
+        if backend == "network":
+            from app.services.capacity import serve_local_capacity
+
+            network_url = f"manager://127.0.0.1:{free_port()}"
+            manager = serve_local_capacity(network_url, b"crm-benchmark")
+            env.update(CRM_CAPACITY_NETWORK_URL=network_url, CRM_CAPACITY_NETWORK_AUTHKEY="crm-benchmark")
+
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(args.workers), "--log-level", "warning"],
+            env=env, cwd=ROOT
+        )
+        try:
+            result = asyncio.run(run_load(f"http://127.0.0.1:{port}", engine, args))
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+            if manager is not None:
+                manager.shutdown()
+
+        with engine.connect() as conn:
+            from app.models import Contact
+
+            result["contacts"] = conn.scalar(select(func.count(Contact.id)))
+            result["assigned"] = conn.scalar(select(func.count(Contact.id)).where(Contact.operator_id.isnot(None)))
+        result["final_overload"] = max_overload(engine, args.max_load)
+        engine.dispose()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="memory,database,network")
+    parser.add_argument("--workers", type=int, default=4, help="воркеров uvicorn")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--registrations", type=int, default=3000, help="запросов на один бэкенд")
+    parser.add_argument("--operators", type=int, default=10)
+    parser.add_argument("--sources", type=int, default=3)
+    parser.add_argument("--max-load", type=int, default=40)
+    parser.add_argument("--process-ratio", type=float, default=0.05, help="доля запросов POST /contacts/processed")
+    parser.add_argument("--process-batch", type=int, default=10, help="обращений в одном запросе обработки")
+    parser.add_argument("--sample-interval", type=float, default=0.2, help="период проверки лимитов, секунд")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'backend':<10}{'rps':>8}{'contacts':>10}{'assigned':>10}{'peak over':>11}{'final over':>12}{'errors':>8}")
+    for backend in args.backends.split(","):
+        result = run_backend(backend, args)
+        print(
+            f"{backend:<10}{args.registrations / result['elapsed']:>8.0f}{result['contacts']:>10}"
+            f"{result['assigned']:>10}{result['peak_overload']:>11}{result['final_overload']:>12}{result['errors']:>8}"
+        )
+        violated = max(result["peak_overload"], result["final_overload"])
+        if backend != "memory" and (violated or result["errors"]):
+            failures.append(f"{backend}: max_load exceeded by {violated}, errors: {result['errors']}")
+        elif backend == "memory" and violated and args.workers > 1:
+            print(f"  memory: per-process ledgers exceeded max_load by up to {violated} (expected with several workers)")
+
+    for failure in failures:
+        print("FAIL: " + failure)
+    if not failures:
+        print("OK")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Генератор синтетических данных для бенчмарков.
+
+Заполняет БД операторами, источниками, весами, лидами (с ключами идентификации) и историческими
+обращениями заданного масштаба. Данные воспроизводимы: одинаковые параметры и --seed дают одну и ту же базу.
+
+Запуск: python -m benchmarks.seed --url sqlite:///./bench.db --contacts 1000000 --leads 200000
+"""
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.engine import Engine
+import argparse
+import datetime
+import random
+import time
+
+CHUNK_SIZE = 50000
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Параметры масштаба данных (общие для seed и suite)"""
+    parser.add_argument("--sources", type=int, default=20)
+    parser.add_argument("--operators", type=int, default=200)
+    parser.add_argument("--weight-density", type=float, default=0.3, help="доля пар оператор-источник с весом")
+    parser.add_argument("--leads", type=int, default=50000)
+    parser.add_argument("--contacts", type=int, default=200000)
+    parser.add_argument("--processed-ratio", type=float, default=0.95, help="доля обработанных исторических обращений")
+    parser.add_argument("--max-load", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=90, help="за сколько дней распределены исторические обращения")
+    parser.add_argument("--seed", type=int, default=42)
+
+def _chunks(rows, size: int = CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def seed_database(engine: Engine, sources: int = 20, operators: int = 200, weight_density: float = 0.3,
+                  leads: int = 50000, contacts: int = 200000, processed_ratio: float = 0.95,
+                  max_load: int = 100000, days: int = 90, seed: int = 42) -> dict:
+    """Создает схему и заполняет пустую БД; возвращает число созданных записей по таблицам"""
+    # Приложение импортируется здесь, а не при импорте модуля: настройки app читаются из окружения
+    # один раз, и benchmarks.suite задает CRM_DATABASE_URL уже после разбора аргументов
+    from app.migrations import run_migrations
+    from app.models import Operator, Source, Lead, LeadIdentity, Contact, OperatorSourceWeight
+    from app.services import identity_keys, backfill_rollups
+
+    rng = random.Random(seed)
+    run_migrations(engine)
+    now = datetime.datetime.utcnow()
+    span = days * 86400
+
+    weights = [
+        {"operator_id": operator_id, "source_id": source_id, "weight": round(rng.uniform(0.5, 5), 3)}
+        for operator_id in range(1, operators + 1)
+        for source_id in range(1, sources + 1)
+        if rng.random() < weight_density
+    ]
+    # Каждый источник обслуживает хотя бы один оператор
+    covered = {weight["source_id"] for weight in weights}
+    weights.extend(
+        {"operator_id": rng.randint(1, operators), "source_id": source_id, "weight": 1.0}
+        for source_id in range(1, sources + 1) if source_id not in covered
+    )
+
+    def lead_rows():
+        for i in range(1, leads + 1):
+            yield {
+                "external_id": f"ext-{i}" if i % 3 == 0 else None,
+                "phone": f"+7 9{i:09d}",
+                "email": f"lead{i}@example.com" if i % 2 == 0 else None,
+                "name": f"Lead {i}",
+                "created_at": now - datetime.timedelta(seconds=span * (leads - i) / max(leads, 1)),
+            }
+
+    def identity_rows():
+        for i in range(1, leads + 1):
+            for key in identity_keys(
+                f"ext-{i}" if i % 3 == 0 else None, f"+7 9{i:09d}", f"lead{i}@example.com" if i % 2 == 0 else None
+            ):
+                yield {"key": key, "lead_id": i}
+
+    def contact_rows():
+        # Первое обращение лида отмечается создавшим его, как при регистрации через сервис
+        seen = set()
+        for i in range(contacts):
+            lead_id = rng.randint(1, leads)
+            created_lead = lead_id not in seen
+            seen.add(lead_id)
+            yield {
+                "lead_id": lead_id,
+                "source_id": rng.randint(1, sources),
+                "operator_id": rng.randint(1, operators) if rng.random() < 0.98 else None,
+                "message": f"Message {i}",
+                "created_at": now - datetime.timedelta(seconds=span * (contacts - i) / max(contacts, 1)),
+                "is_processed": rng.random() < processed_ratio,
+                "created_lead": created_lead,
+            }
+
+    with engine.begin() as conn:
+        conn.execute(insert(Operator), [
+            {"name": f"Operator {i}", "is_active": True, "max_load": max_load} for i in range(1, operators + 1)
+        ])
+        conn.execute(insert(Source), [
+            {"name": f"Source {i}", "description": f"Synthetic source {i}"} for i in range(1, sources + 1)
+        ])
+        conn.execute(insert(OperatorSourceWeight), weights)
+        for table, rows in ((Lead, lead_rows()), (LeadIdentity, identity_rows()), (Contact, contact_rows())):
+            for chunk in _chunks(rows):
+                conn.execute(insert(table), chunk)
+        # Агрегаты для /stats/sources и симулятора: обращения вставлены в обход сервиса распределения
+        backfill_rollups(conn)
+
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+
+    return {
+        "operators": operators,
+        "sources": sources,
+        "operator_source_weights": len(weights),
+        "leads": leads,
+        "contacts": contacts,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", required=True, help="адрес пустой БД, например sqlite:///./bench.db")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    started = time.perf_counter()
+    counts = seed_database(
+        engine, sources=args.sources, operators=args.operators, weight_density=args.weight_density,
+        leads=args.leads, contacts=args.contacts, processed_ratio=args.processed_ratio,
+        max_load=args.max_load, days=args.days, seed=args.seed
+    )
+    engine.dispose()
+    print(f"Seeded in {time.perf_counter() - started:.1f}s: {counts}")
+
+if __name__ == "__main__":
+    main()
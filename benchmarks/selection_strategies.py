@@ -0,0 +1,94 @@
+"""Справедливость и скорость стратегий выбора оператора (SELECTION_STRATEGIES) без БД.
+
+Таблица маршрутизации одного источника строится в памяти для большого числа операторов со случайными весами.
+
+1. Только выбор: picks/s и отклонение распределения выборов от весов - максимальное по оператору
+   (в выборах) и полное расхождение долей (TVD, 0 - точно по весам).
+2. С нагрузкой: выбор с резервированием в журнале нагрузки; обработанные обращения случайно
+   освобождают место. Выводится разброс загрузки операторов (load / max_load) и доля обращений без оператора.
+
+Запуск: python -m benchmarks.selection_strategies --operators 10000 --picks 1000000
+"""
+from app.services import RoutingTable, OperatorLoadLedger, SELECTION_STRATEGIES, create_strategy
+import argparse
+import random
+import statistics
+import time
+
+def build_table(strategy: str, args, ledger: OperatorLoadLedger = None) -> RoutingTable:
+    rng = random.Random(args.seed)
+    entries = [
+        (operator_id, round(rng.uniform(0.5, 5), 3), rng.randint(args.max_load // 2, args.max_load), True)
+        for operator_id in range(1, args.operators + 1)
+    ]
+    return RoutingTable(1, entries, ledger or OperatorLoadLedger(), create_strategy(strategy, 1, args.seed))
+
+def run_picks(strategy: str, args) -> dict:
+    table = build_table(strategy, args)
+    table.eligible()
+    counts = dict.fromkeys(table.max_loads, 0)
+    pick = table.pick
+    started = time.perf_counter()
+    for _ in range(args.picks):
+        counts[pick()] += 1
+    elapsed = time.perf_counter() - started
+
+    total_weight = sum(weight for _, weight, _, _ in table.entries)
+    deviations = [
+        counts[operator_id] - args.picks * weight / total_weight for operator_id, weight, _, _ in table.entries
+    ]
+    return {
+        "picks_per_second": args.picks / elapsed,
+        "max_deviation": max(abs(deviation) for deviation in deviations),
+        "tvd": sum(abs(deviation) for deviation in deviations) / (2 * args.picks),
+    }
+
+def run_with_load(strategy: str, args) -> dict:
+    ledger = OperatorLoadLedger()
+    table = build_table(strategy, args, ledger)
+    rng = random.Random(args.seed + 1)
+    assigned = []
+    unassigned = 0
+    for _ in range(args.load_picks):
+        operator_id = table.pick_and_reserve()
+        if operator_id is None:
+            unassigned += 1
+        else:
+            ledger.confirm(operator_id)
+            assigned.append(operator_id)
+        # Обработка: случайное необработанное обращение освобождает место у своего оператора
+        if assigned and rng.random() < args.process_ratio:
+            index = rng.randrange(len(assigned))
+            assigned[index], assigned[-1] = assigned[-1], assigned[index]
+            ledger.decrement(assigned.pop())
+
+    utilization = [ledger.get_load(operator_id) / max_load for operator_id, max_load in table.max_loads.items()]
+    return {
+        "utilization_mean": statistics.fmean(utilization),
+        "utilization_stdev": statistics.pstdev(utilization),
+        "unassigned_rate": unassigned / args.load_picks,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strategies", default=",".join(SELECTION_STRATEGIES))
+    parser.add_argument("--operators", type=int, default=10000)
+    parser.add_argument("--picks", type=int, default=1000000, help="выборов в замере без нагрузки")
+    parser.add_argument("--load-picks", type=int, default=500000, help="выборов в замере с нагрузкой")
+    parser.add_argument("--max-load", type=int, default=40)
+    parser.add_argument("--process-ratio", type=float, default=0.6, help="вероятность обработки после выбора")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{args.operators} operators, {args.picks} picks, {args.load_picks} picks with load")
+    print(f"{'strategy':<14}{'picks/s':>11}{'max dev':>10}{'tvd':>8}{'util mean':>11}{'util stdev':>12}{'unassigned':>12}")
+    for strategy in args.strategies.split(","):
+        picks = run_picks(strategy, args)
+        load = run_with_load(strategy, args)
+        print(
+            f"{strategy:<14}{picks['picks_per_second']:>11.0f}{picks['max_deviation']:>10.1f}{picks['tvd']:>8.4f}"
+            f"{load['utilization_mean']:>11.3f}{load['utilization_stdev']:>12.3f}{load['unassigned_rate']:>12.3%}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Набор бенчмарков сервиса распределения с результатами в JSON.
+
+Заполняет БД синтетическими данными (benchmarks.seed), затем измеряет:
+- в процессе через TestClient: регистрацию обращения, статистику нагрузки, списки и пакетную регистрацию;
+- через HTTP: нагрузку на локальный uvicorn от параллельных клиентов (можно отключить --skip-http).
+
+Результаты сохраняются в JSON вместе с версией кода, чтобы сравнивать коммиты:
+    python -m benchmarks.suite --contacts 1000000 --output before.json
+    python -m benchmarks.suite --contacts 1000000 --output after.json
+    python -m benchmarks.compare before.json after.json
+
+По умолчанию используется временная база SQLite; --url задает другую пустую БД (например, локальный PostgreSQL),
+а --no-seed - уже заполненную.
+"""
+from . import seed as seed_module
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def summarize(latencies: list[float], elapsed: float = None) -> dict:
+    """Перцентили задержки в миллисекундах и пропускная способность"""
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+    result = {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p90_ms": percentile(0.90),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+    if elapsed:
+        result["rps"] = len(ordered) / elapsed
+    return result
+
+def timed(client, method: str, url: str, repeat: int, **kwargs) -> dict:
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        request_started = time.perf_counter()
+        response = client.request(method, url() if callable(url) else url, **kwargs)
+        latencies.append(time.perf_counter() - request_started)
+        response.raise_for_status()
+    return summarize(latencies, time.perf_counter() - started)
+
+def run_in_process(args, counts: dict) -> dict:
+    """Сценарии в процессе приложения через TestClient"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    rng = random.Random(args.seed)
+    results = {}
+    with TestClient(app) as client:
+        def registration() -> dict:
+            # Половина обращений - от существующих лидов, половина - от новых
+            if rng.random() < 0.5:
+                phone = f"+7 9{rng.randint(1, counts['leads']):09d}"
+            else:
+                phone = f"+7 8{rng.randrange(10 ** 9):09d}"
+            return {"phone": phone, "source_id": rng.randint(1, counts["sources"]), "message": "Benchmark"}
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            request_started = time.perf_counter()
+            client.post("/contacts/register/", json=registration()).raise_for_status()
+            latencies.append(time.perf_counter() - request_started)
+        results["register_contact"] = summarize(latencies, time.perf_counter() - started)
+
+        results["operator_load_stats"] = timed(client, "GET", "/stats/operator-load", args.repeat)
+        results["operator_load_stats_by_source"] = timed(
+            client, "GET", "/stats/operator-load?by_source=true", args.repeat
+        )
+        results["list_contacts"] = timed(client, "GET", "/contacts/?limit=100", args.repeat)
+        results["list_contacts_expanded"] = timed(
+            client, "GET", "/contacts/?limit=50&expand=lead,source,operator", args.repeat
+        )
+        results["contacts_by_ids"] = timed(
+            client, "GET",
+            lambda: "/contacts/?expand=lead,source,operator&ids=" + ",".join(
+                str(rng.randint(1, counts["contacts"])) for _ in range(50)
+            ),
+            args.repeat
+        )
+        results["operator_contacts"] = timed(
+            client, "GET", lambda: f"/operators/{rng.randint(1, counts['operators'])}/contacts?limit=100", args.repeat
+        )
+        results["source_contacts"] = timed(
+            client, "GET", lambda: f"/sources/{rng.randint(1, counts['sources'])}/contacts?limit=100", args.repeat
+        )
+        results["unprocessed_contacts"] = timed(client, "GET", "/stats/unprocessed-contacts?limit=100", args.repeat)
+        results["list_leads"] = timed(client, "GET", "/leads/?limit=100", args.repeat)
+
+        # Последовательный обход страниц по курсору
+        latencies = []
+        cursor = None
+        for _ in range(args.repeat):
+            request_started = time.perf_counter()
+            response = client.get("/contacts/", params={"limit": 100, **({"cursor": cursor} if cursor else {})})
+            latencies.append(time.perf_counter() - request_started)
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        results["contacts_cursor_walk"] = summarize(latencies)
+
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(args.batches):
+            batch = [registration() for _ in range(args.batch_size)]
+            request_started = time.perf_counter()
+            client.post("/contacts/register/batch", json=batch).raise_for_status()
+            latencies.append(time.perf_counter() - request_started)
+        elapsed = time.perf_counter() - started
+        results["register_batch"] = summarize(latencies, elapsed)
+        results["register_batch"]["contacts_per_second"] = args.batches * args.batch_size / elapsed
+    return results
+
+async def _http_load(base_url: str, args, counts: dict) -> dict:
+    import httpx
+    from .async_load import wait_ready
+
+    rng = random.Random(args.seed + 1)
+    limits = httpx.Limits(max_connections=args.http_clients, max_keepalive_connections=args.http_clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        await wait_ready(client)
+        latencies = {"register": [], "read": []}
+        errors = 0
+        counter = iter(range(args.http_requests))
+
+        async def worker() -> None:
+            nonlocal errors
+            for _ in counter:
+                started = time.perf_counter()
+                if rng.random() < args.write_ratio:
+                    kind = "register"
+                    response = await client.post("/contacts/register/", json={
+                        "phone": f"+7 9{rng.randint(1, counts['leads']):09d}",
+                        "source_id": rng.randint(1, counts["sources"])
+                    })
+                else:
+                    kind = "read"
+                    response = await client.get(rng.choice([
+                        "/contacts/?limit=20",
+                        f"/operators/{rng.randint(1, counts['operators'])}/contacts?limit=20",
+                        "/stats/operator-load",
+                    ]))
+                latencies[kind].append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.http_clients)))
+        elapsed = time.perf_counter() - started
+
+    result = summarize(latencies["register"] + latencies["read"], elapsed)
+    result["errors"] = errors
+    result["register"] = summarize(latencies["register"]) if latencies["register"] else None
+    result["read"] = summarize(latencies["read"]) if latencies["read"] else None
+    return result
+
+def run_http(args, counts: dict, env: dict) -> dict:
+    """Нагрузка на локальный uvicorn с той же БД"""
+    from .async_load import free_port
+
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--backlog", str(max(2048, args.http_clients * 2))],
+        env=env, cwd=ROOT
+    )
+    try:
+        return {"http_mixed_load": asyncio.run(_http_load(f"http://127.0.0.1:{port}", args, counts))}
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="адрес БД; по умолчанию временная база SQLite")
+    parser.add_argument("--no-seed", action="store_true", help="использовать уже заполненную БД")
+    seed_module.add_arguments(parser)
+    parser.add_argument("--requests", type=int, default=500, help="регистраций в сценарии register_contact")
+    parser.add_argument("--repeat", type=int, default=50, help="повторов каждого сценария чтения")
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--skip-http", action="store_true", help="не запускать нагрузку через uvicorn")
+    parser.add_argument("--http-clients", type=int, default=100)
+    parser.add_argument("--http-requests", type=int, default=3000)
+    parser.add_argument("--write-ratio", type=float, default=0.3)
+    parser.add_argument("--output", help="файл JSON с результатами (по умолчанию - stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url or f"sqlite:///{os.path.join(tmp, 'suite.db')}"
+        # Настройки приложения читаются из окружения при импорте app, поэтому задаем их до импорта
+        env = dict(os.environ, CRM_DATABASE_URL=url, CRM_INGEST_ENABLED="false")
+        os.environ.update(CRM_DATABASE_URL=url, CRM_INGEST_ENABLED="false")
+
+        from sqlalchemy import create_engine
+        engine = create_engine(url)
+        started = time.perf_counter()
+        if args.no_seed:
+            counts = {"sources": args.sources, "operators": args.operators, "leads": args.leads,
+                      "contacts": args.contacts}
+        else:
+            counts = seed_module.seed_database(
+                engine, sources=args.sources, operators=args.operators, weight_density=args.weight_density,
+                leads=args.leads, contacts=args.contacts, processed_ratio=args.processed_ratio,
+                max_load=args.max_load, days=args.days, seed=args.seed
+            )
+        seed_seconds = time.perf_counter() - started
+        engine.dispose()
+        print(f"Database ready in {seed_seconds:.1f}s: {counts}", file=sys.stderr)
+
+        results = run_in_process(args, counts)
+        if not args.skip_http:
+            results.update(run_http(args, counts, env))
+
+    import sqlalchemy
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+            "database": engine.dialect.name,
+            "seed_seconds": seed_seconds,
+            "args": {key: value for key, value in vars(args).items() if key not in {"url", "output"}},
+            "counts": counts,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import itertools
+import os
+import tempfile
+
+import pytest
+
+# Настройки читаются при импорте приложения: тесты работают с отдельной временной БД,
+# фоновое перераспределение отключено, чтобы назначения в тестах не менялись между запросами
+_directory = tempfile.mkdtemp(prefix="crm-tests-")
+os.environ["CRM_DATABASE_URL"] = f"sqlite:///{os.path.join(_directory, 'crm.db')}"
+os.environ["CRM_REDISTRIBUTION_ENABLED"] = "false"
+
+from fastapi.testclient import TestClient
+from app.main import app
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+_names = itertools.count(1)
+
+@pytest.fixture
+def source_id(client):
+    """Новый источник с одним активным оператором"""
+    number = next(_names)
+    operator_id = client.post("/operators/", json={"name": f"operator {number}", "max_load": 1000}).json()["id"]
+    source_id = client.post("/sources/", json={"name": f"source {number}"}).json()["id"]
+    client.post(f"/operators/{operator_id}/sources/{source_id}/weight", params={"weight": 1})
+    return source_id
@@ -0,0 +1,21 @@
+from app.database import SessionLocal
+from app.services import LeadAffinityCache
+
+def test_warm_fills_cache_size_leads(client, source_id):
+    def register(phone):
+        response = client.post("/contacts/register/", json={"phone": phone, "source_id": source_id})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    quiet = register("+79000000201")
+    # Последние обращения - у одного лида: лимит по строкам обращений оставил бы в кэше только его
+    busy = [register("+79000000202") for _ in range(5)][-1]
+
+    cache = LeadAffinityCache(cache_size=2)
+    db = SessionLocal()
+    try:
+        assert cache.warm(db) == 2
+    finally:
+        db.close()
+    assert cache.get(busy["lead_id"]) == busy["operator_id"]
+    assert cache.get(quiet["lead_id"]) == quiet["operator_id"]
@@ -0,0 +1,54 @@
+import json
+
+def register(client, source_id, phone, message):
+    response = client.post("/contacts/register/", json={"phone": phone, "source_id": source_id, "message": message})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def archive_all(client):
+    client.post("/contacts/processed", json={"created_before": "2100-01-01T00:00:00"})
+    return client.post("/contacts/archive", params={"older_than_days": 0}).json()
+
+def history(client, lead_id):
+    return client.get(f"/leads/{lead_id}/contacts", params={"include_archived": True}).json()
+
+def test_reused_contact_id_keeps_both_histories(client, source_id):
+    archive_all(client)
+    first = register(client, source_id, "+79000000101", "first")
+    archive_all(client)
+    # contacts пуста: SQLite выдает новому обращению тот же id
+    second = register(client, source_id, "+79000000102", "second")
+    assert second["id"] == first["id"]
+    assert second["lead_id"] != first["lead_id"]
+    archive_all(client)
+
+    assert [contact["message"] for contact in history(client, first["lead_id"])] == ["first"]
+    assert [contact["message"] for contact in history(client, second["lead_id"])] == ["second"]
+
+def test_repeated_archival_does_not_duplicate(client, source_id):
+    contact = register(client, source_id, "+79000000103", "once")
+    assert archive_all(client)["archived"] >= 1
+    assert archive_all(client)["archived"] == 0
+    assert len(history(client, contact["lead_id"])) == 1
+
+def test_history_merges_hot_and_archived_contacts(client, source_id):
+    old = register(client, source_id, "+79000000104", "old")
+    archive_all(client)
+    new = register(client, source_id, "+79000000104", "new")
+    assert new["lead_id"] == old["lead_id"]
+
+    hot = client.get(f"/leads/{old['lead_id']}/contacts").json()
+    assert [contact["message"] for contact in hot] == ["new"]
+    assert [contact["message"] for contact in history(client, old["lead_id"])] == ["old", "new"]
+
+def test_archived_contacts_in_details_and_exports(client, source_id):
+    contact = register(client, source_id, "+79000000105", "exported")
+    archive_all(client)
+
+    # Подробности обращения читают только contacts
+    assert client.get(f"/contacts/{contact['id']}").status_code == 404
+    for path, key in (("/export/contacts", "id"), ("/export/assignments", "contact_id")):
+        hot = client.get(path, params={"source_id": source_id}).text.splitlines()
+        full = client.get(path, params={"source_id": source_id, "include_archived": True}).text.splitlines()
+        assert hot == []
+        assert [json.loads(line)[key] for line in full] == [contact["id"]]
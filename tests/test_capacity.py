@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.config import settings
+from app.database import SessionLocal, create_db_engine, engine
+from app.models import OperatorCapacity
+from app.services import (
+    CapacityStore, MemoryCapacityStore, DatabaseCapacityStore, NetworkCapacityStore, LocalCapacityClient,
+    OperatorLoadLedger, create_capacity_store
+)
+
+def test_capacity_store_is_abstract():
+    with pytest.raises(TypeError):
+        CapacityStore()
+
+    class Incomplete(CapacityStore):
+        def acquire(self, db, operator_id, max_load):
+            return True, 1
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_capacity_stores_implement_interface():
+    assert isinstance(DatabaseCapacityStore(engine), CapacityStore)
+    assert isinstance(NetworkCapacityStore(LocalCapacityClient()), CapacityStore)
+
+def test_memory_backend_is_a_capacity_store():
+    store = create_capacity_store(settings.model_copy(update={"capacity_backend": "memory"}), engine)
+    assert isinstance(store, MemoryCapacityStore)
+    assert isinstance(OperatorLoadLedger().store, MemoryCapacityStore)
+
+    assert store.acquire(None, 1, 2) == (True, 1)
+    assert store.acquire(None, 1, 2) == (True, 2)
+    assert store.acquire(None, 1, 2) == (False, 2)
+    assert store.release(1, 5) == 0
+    store.initialize({1: 3, 2: 1})
+    assert store.loads() == {1: 0, 2: 1}
+    store.forget(2)
+    assert store.loads() == {1: 0}
+
+def test_memory_ledger_keeps_pending_reservations_on_seed(client):
+    ledger = OperatorLoadLedger()
+    assert not ledger.shared
+    assert ledger.try_reserve(10**6, 1)
+    assert not ledger.try_reserve(10**6, 1)
+    db = SessionLocal()
+    try:
+        # Незакоммиченный резерв не виден в БД, но остается в нагрузке после заполнения журнала
+        ledger.seed(db)
+    finally:
+        db.close()
+    assert ledger.get_load(10**6) == 1
+    ledger.release(10**6)
+    assert ledger.get_load(10**6) == 0
+
+def test_store_io_inside_run_sync_leaves_event_loop(tmp_path):
+    threads = []
+
+    class RecordingClient(LocalCapacityClient):
+        def acquire(self, field, limit):
+            threads.append(threading.current_thread())
+            return super().acquire(field, limit)
+
+    network = NetworkCapacityStore(RecordingClient())
+    database = DatabaseCapacityStore(create_db_engine(settings.model_copy(update={
+        "database_url": f"sqlite:///{tmp_path / 'capacity.db'}", "archive_database_path": None
+    })))
+    OperatorCapacity.__table__.create(database.engine)
+    event.listen(database.engine, "before_cursor_execute", lambda *args: threads.append(threading.current_thread()))
+
+    async def register():
+        async_engine = create_async_engine("sqlite+aiosqlite://")
+        async with AsyncSession(async_engine) as session:
+            # Как AsyncDistributionService: синхронный код сервиса на потоке цикла событий
+            await session.run_sync(lambda _: (network.acquire(None, 1, 5), database.reset({1: 2})))
+        await async_engine.dispose()
+
+    asyncio.run(register())
+    database.engine.dispose()
+    assert threads
+    assert all(thread is not threading.main_thread() for thread in threads)
+    # Вне цикла событий вызовы выполняются в текущем потоке
+    threads.clear()
+    network.acquire(None, 1, 5)
+    assert threads == [threading.main_thread()]
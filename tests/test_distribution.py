@@ -0,0 +1,183 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import event, func, select
+
+from app.database import SessionLocal, engine
+from app.models import Contact, ContactRollup, Lead, LeadIdentity
+from app.schemas import ContactRegistration
+from app.services import DistributionService, load_ledger
+from app.services import distribution
+
+def row_counts() -> dict:
+    db = SessionLocal()
+    try:
+        counts = {
+            model.__tablename__: db.scalar(select(func.count()).select_from(model))
+            for model in (Lead, LeadIdentity, Contact)
+        }
+        # Строки агрегатов обновляются на месте, поэтому сравниваются их суммы
+        counts["rollup_contacts"] = db.scalar(select(func.coalesce(func.sum(ContactRollup.contacts), 0)))
+        counts["rollup_new_leads"] = db.scalar(select(func.coalesce(func.sum(ContactRollup.new_leads), 0)))
+        return counts
+    finally:
+        db.close()
+
+def nonzero_loads() -> dict:
+    return {operator_id: load for operator_id, load in load_ledger.get_loads().items() if load}
+
+def fail(*args, **kwargs):
+    raise RuntimeError("injected failure")
+
+def test_failed_registration_keeps_no_lead(client, source_id, monkeypatch):
+    before = row_counts()
+    # Ошибка после того, как лид и его ключи записаны в точке сохранения
+    monkeypatch.setattr(DistributionService, "reserve_operator", fail)
+    db = SessionLocal()
+    try:
+        with pytest.raises(RuntimeError):
+            DistributionService(db).register_contact(ContactRegistration(phone="+79000000501", source_id=source_id))
+    finally:
+        db.close()
+
+    assert row_counts() == before
+
+def test_failed_commit_rolls_back_registration(client, source_id, monkeypatch):
+    before = row_counts()
+    loads = nonzero_loads()
+    apply_rollups = distribution.apply_rollups
+
+    def apply_and_fail(db, delta):
+        # Все записи регистрации, включая агрегаты, выполнены; ошибка перед коммитом
+        apply_rollups(db, delta)
+        fail()
+
+    monkeypatch.setattr(distribution, "apply_rollups", apply_and_fail)
+    db = SessionLocal()
+    try:
+        with pytest.raises(RuntimeError):
+            DistributionService(db).register_contact(ContactRegistration(phone="+79000000502", source_id=source_id))
+    finally:
+        db.close()
+
+    assert row_counts() == before
+    # Резерв места у оператора снят вместе с откатом
+    assert nonzero_loads() == loads
+
+def test_batch_error_item_does_not_block_others(client, source_id):
+    before = row_counts()
+    results = client.post("/contacts/register/batch", json=[
+        {"phone": "+79000000503", "source_id": source_id},
+        {"phone": "+79000000504", "source_id": 999999},
+        {"phone": "+79000000505", "source_id": source_id},
+    ]).json()
+
+    assert [result["status"] for result in results] == ["assigned", "error", "assigned"]
+    after = row_counts()
+    # Для обращения с неизвестным источником лид не создается
+    assert after["leads"] == before["leads"] + 2
+    assert after["contacts"] == before["contacts"] + 2
+    assert after["rollup_new_leads"] == before["rollup_new_leads"] + 2
+
+def test_failed_batch_item_rolls_back_batch(client, source_id, monkeypatch):
+    before = row_counts()
+    loads = nonzero_loads()
+    reserve_operator = DistributionService.reserve_operator
+    calls = []
+
+    def reserve_then_fail(self, work, table, lead_id):
+        # Первое обращение пакета назначено, второе падает после записи своего лида
+        calls.append(lead_id)
+        if len(calls) == 2:
+            fail()
+        return reserve_operator(self, work, table, lead_id)
+
+    monkeypatch.setattr(DistributionService, "reserve_operator", reserve_then_fail)
+    db = SessionLocal()
+    try:
+        with pytest.raises(RuntimeError):
+            DistributionService(db).register_contacts([
+                ContactRegistration(phone=f"+7900000051{i}", source_id=source_id) for i in range(3)
+            ])
+    finally:
+        db.close()
+
+    assert row_counts() == before
+    assert nonzero_loads() == loads
+
+def test_priority_redistribution_prefers_high_priority_source(client):
+    # Один оператор на два источника; обращения приходят, пока у него нет мест,
+    # и старое обращение - у источника с низким приоритетом
+    operator = {"name": "priority operator", "max_load": 0}
+    operator_id = client.post("/operators/", json=operator).json()["id"]
+    sources = {}
+    for priority in (0, 5):
+        sources[priority] = client.post("/sources/", json={"name": f"priority {priority}", "priority": priority}).json()
+        client.post(f"/operators/{operator_id}/sources/{sources[priority]['id']}/weight", params={"weight": 1})
+    assert sources[5]["priority"] == 5
+    contact_ids = {
+        priority: client.post("/contacts/register/", json={
+            "phone": f"+7900000052{priority}", "source_id": sources[priority]["id"]
+        }).json()["id"]
+        for priority in (0, 5)
+    }
+
+    # Освобождается одно место
+    client.put(f"/operators/{operator_id}", json={**operator, "max_load": 1})
+    assert client.post("/contacts/redistribute", params={"order": "priority"}).json()["assigned"] == 1
+
+    db = SessionLocal()
+    try:
+        operators = {priority: db.get(Contact, contact_id).operator_id for priority, contact_id in contact_ids.items()}
+    finally:
+        db.close()
+    assert operators == {0: None, 5: operator_id}
+
+def test_batch_registration_commits_once(client, source_id):
+    commits = []
+
+    def on_commit(conn):
+        commits.append(conn)
+
+    event.listen(engine, "commit", on_commit)
+    try:
+        results = client.post("/contacts/register/batch", json=[
+            {"phone": f"+7900000053{i}", "source_id": source_id} for i in range(5)
+        ]).json()
+    finally:
+        event.remove(engine, "commit", on_commit)
+
+    assert [result["status"] for result in results] == ["assigned"] * 5
+    assert len(commits) == 1
+
+def test_concurrent_registrations_share_leads_and_respect_max_load(client):
+    operator_id = client.post("/operators/", json={"name": "concurrent operator", "max_load": 5}).json()["id"]
+    source_id = client.post("/sources/", json={"name": "concurrent source"}).json()["id"]
+    client.post(f"/operators/{operator_id}/sources/{source_id}/weight", params={"weight": 1})
+    phones = [f"+7900000054{i}" for i in range(4)]
+
+    def register(number):
+        db = SessionLocal()
+        try:
+            contact = DistributionService(db).register_contact(
+                ContactRegistration(phone=phones[number % len(phones)], source_id=source_id)
+            )
+            return contact.lead_id, contact.operator_id
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(register, range(32)))
+
+    # Одинаковые телефоны из разных потоков дают одного лида на телефон
+    assert len({lead_id for lead_id, _ in results}) == len(phones)
+    # Мест у оператора 5: остальные обращения ждут перераспределения без оператора
+    assert sum(operator == operator_id for _, operator in results) == 5
+    assert load_ledger.get_loads()[operator_id] == 5
+    db = SessionLocal()
+    try:
+        leads = db.scalar(select(func.count()).select_from(Lead).where(Lead.phone.in_(phones)))
+        assigned = db.scalar(select(func.count()).select_from(Contact).where(Contact.operator_id == operator_id))
+    finally:
+        db.close()
+    assert (leads, assigned) == (len(phones), 5)
@@ -0,0 +1,23 @@
+import json
+
+from app.database import SessionLocal
+from app.models import Contact, Lead
+
+def test_assignments_export_keeps_contacts_without_source(client):
+    db = SessionLocal()
+    try:
+        # Обращение без источника (записано в обход регистрации)
+        lead = Lead(phone="+79000000401")
+        db.add(lead)
+        db.flush()
+        contact = Contact(lead_id=lead.id, source_id=None, message="no source")
+        db.add(contact)
+        db.commit()
+        contact_id = contact.id
+    finally:
+        db.close()
+
+    rows = [json.loads(line) for line in client.get("/export/assignments").text.splitlines()]
+    row = next(row for row in rows if row["contact_id"] == contact_id)
+    assert row["source_id"] is None
+    assert row["source_name"] is None
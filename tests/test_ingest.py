@@ -0,0 +1,20 @@
+import asyncio
+
+from app.database import SessionLocal
+from app.schemas import ContactRegistration
+from app.services import IngestQueue
+
+def test_stop_right_after_submit_drains_queue(client, source_id):
+    async def ingest():
+        queue = IngestQueue(SessionLocal, workers=2)
+        await queue.start()
+        # Воркеры еще ни разу не запускались: остановка должна дождаться обработки очереди
+        ticket_id = queue.submit(ContactRegistration(phone="+79000000701", source_id=source_id))["ticket_id"]
+        watchdog = asyncio.get_running_loop().call_later(10, asyncio.current_task().cancel)
+        try:
+            await queue.stop()
+        finally:
+            watchdog.cancel()
+        return queue.get_ticket(ticket_id)["status"]
+
+    assert asyncio.run(ingest()) == "assigned"
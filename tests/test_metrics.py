@@ -0,0 +1,59 @@
+import asyncio
+
+from app.database import SessionLocal
+from app.metrics import UNKNOWN_SOURCE, distribution_contacts_total, distribution_stage_seconds
+from app.schemas import ContactRegistration
+from app.services import IngestQueue
+
+BATCH_STAGES = ("batch_lookup", "batch_lead", "batch_select", "batch_flush", "batch_commit", "batch_total")
+
+def stage_counts(*stages) -> dict:
+    return {stage: distribution_stage_seconds.get_count(stage=stage) for stage in stages}
+
+def test_unknown_source_is_not_a_label(client, source_id):
+    errors = distribution_contacts_total.get(source_id=UNKNOWN_SOURCE, outcome="error")
+    assert client.post("/contacts/register/", json={"phone": "+79000000601", "source_id": 987654}).status_code == 404
+    client.post("/contacts/register/batch", json=[
+        {"phone": "+79000000602", "source_id": 987655},
+        {"phone": "+79000000603", "source_id": source_id},
+    ])
+
+    assert distribution_contacts_total.get(source_id=UNKNOWN_SOURCE, outcome="error") == errors + 2
+    assert "987654" not in client.get("/metrics").text
+    assert distribution_contacts_total.get(source_id=source_id, outcome="assigned") >= 1
+
+def test_batch_registration_records_stages(client, source_id):
+    before = stage_counts(*BATCH_STAGES)
+    client.post("/contacts/register/batch", json=[
+        {"phone": f"+7900000061{i}", "source_id": source_id} for i in range(3)
+    ])
+    after = stage_counts(*BATCH_STAGES)
+
+    for stage in ("batch_lookup", "batch_flush", "batch_commit", "batch_total"):
+        assert after[stage] == before[stage] + 1
+    # Создание лида и выбор оператора замеряются для каждого обращения пакета
+    assert after["batch_lead"] == before["batch_lead"] + 3
+    assert after["batch_select"] == before["batch_select"] + 3
+
+def test_ingest_queue_records_wait_and_batch_stages(client, source_id):
+    before = stage_counts("ingest_wait", "batch_total")
+
+    async def ingest():
+        queue = IngestQueue(SessionLocal, workers=1)
+        await queue.start()
+        tickets = [
+            queue.submit(ContactRegistration(phone=f"+7900000062{i}", source_id=source_id))["ticket_id"]
+            for i in range(2)
+        ]
+        for _ in range(500):
+            statuses = [queue.get_ticket(ticket_id)["status"] for ticket_id in tickets]
+            if "queued" not in statuses:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return statuses
+
+    assert asyncio.run(ingest()) == ["assigned", "assigned"]
+    after = stage_counts("ingest_wait", "batch_total")
+    assert after["ingest_wait"] == before["ingest_wait"] + 2
+    assert after["batch_total"] >= before["batch_total"] + 1
@@ -0,0 +1,62 @@
+import datetime
+
+from sqlalchemy import func, select, text
+
+from app.config import settings
+from app.database import create_db_engine
+from app.migrations import MIGRATIONS, run_migrations
+from app.models import Contact, ContactRollup, LeadIdentity
+
+# Схема исходной базы (crm.db до миграций): без lead_identities, contact_rollups, contacts_archive
+BASELINE_SCHEMA = (
+    "CREATE TABLE operators (id INTEGER NOT NULL, name VARCHAR, is_active BOOLEAN, max_load INTEGER, PRIMARY KEY (id))",
+    "CREATE TABLE leads (id INTEGER NOT NULL, external_id VARCHAR, phone VARCHAR, email VARCHAR, name VARCHAR,"
+    " created_at DATETIME, PRIMARY KEY (id))",
+    "CREATE UNIQUE INDEX ix_leads_external_id ON leads (external_id)",
+    "CREATE TABLE sources (id INTEGER NOT NULL, name VARCHAR, description VARCHAR, PRIMARY KEY (id))",
+    "CREATE UNIQUE INDEX ix_sources_name ON sources (name)",
+    "CREATE TABLE operator_source_weights (id INTEGER NOT NULL, operator_id INTEGER, source_id INTEGER,"
+    " weight FLOAT, PRIMARY KEY (id))",
+    "CREATE TABLE contacts (id INTEGER NOT NULL, lead_id INTEGER, source_id INTEGER, operator_id INTEGER,"
+    " message VARCHAR, contact_data VARCHAR, created_at DATETIME, is_processed BOOLEAN, PRIMARY KEY (id))",
+)
+
+def baseline_engine(path):
+    engine = create_db_engine(settings.model_copy(update={
+        "database_url": f"sqlite:///{path}", "archive_database_path": None
+    }))
+    created = datetime.datetime(2024, 1, 1, 10, 0)
+    with engine.begin() as conn:
+        for statement in BASELINE_SCHEMA:
+            conn.execute(text(statement))
+        conn.execute(text("INSERT INTO operators VALUES (1, 'operator', 1, 10)"))
+        conn.execute(text("INSERT INTO sources VALUES (1, 'source', NULL)"))
+        conn.execute(text("INSERT INTO operator_source_weights VALUES (1, 1, 1, 1.0)"))
+        conn.execute(text("INSERT INTO leads VALUES (1, 'ext-1', '+7 900 000-00-01', NULL, NULL, :created)"),
+                     {"created": created})
+        # Второй лид создан заранее, за час до своего первого обращения
+        conn.execute(text("INSERT INTO leads VALUES (2, NULL, '+7 900 000-00-02', NULL, NULL, :created)"),
+                     {"created": created - datetime.timedelta(hours=1)})
+        conn.execute(text("INSERT INTO contacts VALUES (:id, :lead_id, 1, 1, NULL, NULL, :created, 0)"), [
+            {"id": 1, "lead_id": 1, "created": created},
+            {"id": 2, "lead_id": 1, "created": created + datetime.timedelta(minutes=5)},
+            {"id": 3, "lead_id": 2, "created": created + datetime.timedelta(minutes=10)},
+        ])
+    return engine
+
+def test_migrations_upgrade_baseline_database(tmp_path):
+    engine = baseline_engine(tmp_path / "crm.db")
+    try:
+        assert run_migrations(engine) == [version for version, _, _ in MIGRATIONS]
+        with engine.connect() as conn:
+            keys = set(conn.scalars(select(LeadIdentity.key)))
+            created_lead = dict(conn.execute(select(Contact.id, Contact.created_lead)).all())
+            rollups = conn.execute(select(func.sum(ContactRollup.contacts), func.sum(ContactRollup.new_leads))).one()
+        assert keys == {"external_id:ext-1", "phone:79000000001", "phone:79000000002"}
+        # Лида создало первое обращение лида
+        assert created_lead == {1: True, 2: False, 3: True}
+        assert tuple(rollups) == (3, 2)
+        # Повторный запуск ничего не меняет
+        assert run_migrations(engine) == []
+    finally:
+        engine.dispose()
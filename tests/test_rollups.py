@@ -0,0 +1,50 @@
+from sqlalchemy import select
+
+from app.database import engine
+from app.models import ContactRollup
+from app.services import backfill_rollups
+
+def rollup_rows() -> list[tuple]:
+    table = ContactRollup.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(select(
+            table.c.bucket, table.c.source_id, table.c.operator_id, table.c.contacts, table.c.processed, table.c.new_leads
+        )).all()
+    # Перераспределение оставляет строки с нулевыми счетчиками; пересчет их не создает
+    return sorted(tuple(row) for row in rows if any(row[3:]))
+
+def test_live_rollups_match_rebuild(client, source_id):
+    def register(phone, source=source_id):
+        response = client.post("/contacts/register/", json={"phone": phone, "source_id": source})
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    # Лид, созданный заранее через POST /leads/, - не новый лид обращения
+    client.post("/leads/", json={"phone": "+79000000301"})
+    register("+79000000301")
+    first = register("+79000000302")
+    register("+79000000302")
+    register("+79000000303")
+    response = client.post("/contacts/register/batch", json=[
+        {"phone": phone, "source_id": source_id} for phone in ("+79000000304", "+79000000304", "+79000000301")
+    ])
+    assert response.status_code == 200, response.text
+
+    # Обращение без оператора, назначенное перераспределением
+    waiting = client.post("/sources/", json={"name": "rollups waiting"}).json()["id"]
+    register("+79000000305", waiting)
+    operator_id = first["operator_id"]
+    client.post(f"/operators/{operator_id}/sources/{waiting}/weight", params={"weight": 1})
+    assert client.post("/contacts/redistribute").json()["assigned"] >= 1
+
+    client.post("/contacts/processed", json={"ids": [first["id"]]})
+    client.post("/contacts/archive", params={"older_than_days": 0})
+
+    stats = {item["source_id"]: item for item in client.get("/stats/sources").json()}
+    assert stats[source_id]["new_leads"] == 3
+    assert stats[waiting]["new_leads"] == 1
+
+    live = rollup_rows()
+    with engine.begin() as conn:
+        backfill_rollups(conn)
+    assert rollup_rows() == live
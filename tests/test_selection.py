@@ -0,0 +1,25 @@
+import pytest
+
+from app.services import SELECTION_STRATEGIES, SelectionStrategy, create_strategy, register_strategy
+
+def test_selection_strategy_is_abstract():
+    with pytest.raises(TypeError):
+        SelectionStrategy()
+
+def test_register_rejects_incomplete_strategy():
+    class PickOnly(SelectionStrategy):
+        name = "pick_only"
+
+        def pick(self, state, operator_ids, cumulative, table, rng=None):
+            return operator_ids[0]
+
+    with pytest.raises(TypeError, match="prepare"):
+        register_strategy(PickOnly)
+    assert "pick_only" not in SELECTION_STRATEGIES
+
+@pytest.mark.parametrize("name", sorted(SELECTION_STRATEGIES))
+def test_builtin_strategies_pick_from_candidates(name):
+    strategy = create_strategy(name, source_id=1, seed=1)
+    operator_ids, weights, cumulative = [10, 20, 30], [1.0, 2.0, 3.0], [1.0, 3.0, 6.0]
+    state = strategy.prepare(operator_ids, weights, cumulative)
+    assert strategy.pick(state, operator_ids, cumulative, None) in operator_ids